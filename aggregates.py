@@ -0,0 +1,99 @@
+"""Response counts for the research dashboard without scanning documents.
+
+Every metric is a named count with a matching storage filter, e.g.
+
+    'question.17.shown'      -> status == 'submitted' and question_ids contains 17
+    'question.17.answered'   -> status == 'submitted' and answered_ids contains 17
+    'demographics.age.18_24' -> status == 'submitted' and demographics.age == '18_24'
+
+AggregateView answers from a baseline, refreshed after a TTL, plus the
+submissions this process has seen since that baseline was taken. The baseline
+is read from the sharded counters (see counters.py) when they are configured,
+and otherwise from backend count() queries (aggregation queries on Firestore,
+not document reads).
+"""
+import threading
+import time
+from collections import Counter
+
+from survey_content import DEMOGRAPHIC_OPTIONS, QUESTION_BANK, TRANSLATIONS
+
+SUBMITTED = ('status', '==', 'submitted')
+
+
+def metric_filters(languages=tuple(TRANSLATIONS), bank_size=len(QUESTION_BANK)):
+    """Yield (metric, filters) for every dashboard count of a survey"""
+    yield 'submissions', [SUBMITTED]
+    for language in languages:
+        yield f'language.{language}', [SUBMITTED, ('language', '==', language)]
+    for index in range(bank_size):
+        yield f'question.{index}.shown', [SUBMITTED, ('question_ids', 'array_contains', index)]
+        yield f'question.{index}.answered', [SUBMITTED, ('answered_ids', 'array_contains', index)]
+    for field, options in DEMOGRAPHIC_OPTIONS.items():
+        for code in options:
+            yield f'demographics.{field}.{code}', [SUBMITTED, (f'demographics.{field}', '==', code)]
+
+
+def summarize(document):
+    """The metric increments one submitted version 2 document contributes"""
+    counts = Counter({'submissions': 1, f"language.{document.get('language')}": 1})
+    for index in document.get('question_ids', []):
+        counts[f'question.{index}.shown'] += 1
+    for index in document.get('answered_ids', []):
+        counts[f'question.{index}.answered'] += 1
+    for field, code in (document.get('demographics') or {}).items():
+        if code is not None:
+            counts[f'demographics.{field}.{code}'] += 1
+    return counts
+
+
+class AggregateView:
+    """Dashboard counts: a TTL-cached baseline plus live increments from this process"""
+
+    def __init__(self, backend, ttl=300, counters=None, languages=tuple(TRANSLATIONS),
+                 bank_size=len(QUESTION_BANK)):
+        self.backend = backend
+        self.ttl = ttl
+        self.counters = counters
+        self.languages = tuple(languages)
+        self.bank_size = bank_size
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._baseline = None
+        self._baseline_at = 0.0
+        self._live = Counter()
+
+    def add(self, counts):
+        with self._lock:
+            self._live.update(counts)
+
+    def _refresh(self):
+        # Live counts from before the queries are in the new baseline; later ones stay live.
+        # Submissions that land while the queries run may be counted twice until the next refresh.
+        with self._lock:
+            counted = Counter(self._live)
+        if self.counters is not None:
+            baseline = Counter(self.counters.read(force=True))
+        else:
+            baseline = Counter()
+            for metric, filters in metric_filters(self.languages, self.bank_size):
+                baseline[metric] = self.backend.count(filters)
+        with self._lock:
+            self._live -= counted
+            self._baseline = baseline
+            self._baseline_at = time.time()
+
+    def snapshot(self, force=False):
+        """Current counts by metric name and the age of the baseline in seconds"""
+        with self._refresh_lock:
+            if force or self._baseline is None or time.time() - self._baseline_at > self.ttl:
+                self._refresh()
+        with self._lock:
+            counts = self._baseline + self._live
+            age = time.time() - self._baseline_at
+        return counts, age
+
+    def question_counts(self, kind='answered'):
+        """{question bank index: count} for 'shown' or 'answered'"""
+        counts, _ = self.snapshot()
+        return {index: counts[f'question.{index}.{kind}'] for index in range(self.bank_size)}
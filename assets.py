@@ -0,0 +1,177 @@
+"""Minified, fingerprinted stylesheet for the survey pages.
+
+    python assets.py                                  # build static/survey-<hash>.css
+    python assets.py --config .streamlit/config.toml
+
+The styles live in assets/survey.css and take their colors from --survey-*
+custom properties. build() sets those from the [theme] section of
+.streamlit/config.toml (primaryColor and ACCENT_COLOR, which is not a
+Streamlit option, drive the gradients and the progress bar; background,
+secondary background and text colors the cards), minifies the result and
+names the file after its content hash. Streamlit serves static/ at
+app/static/ when server.enableStaticServing is on (set in the same file),
+and a ?v= query makes Tornado send ten-year cache headers, which the hash in
+the name makes safe.
+
+Streamlit sends static files other than images, fonts, PDF, XML and JSON as
+text/plain with nosniff, which browsers refuse as a stylesheet, so the app
+does not <link> the file. It sends loader_html() instead: a few hundred bytes
+of script that fetch the file (from the HTTP cache after the first visit) and
+keep it in a <style> in the page head, where it survives reruns. The loader
+of a session's first run also carries the CSS itself and inlines it when the
+fetch fails (static serving off, a proxy dropping app/static/), so the page
+is never left unstyled.
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import tomllib
+
+SOURCE_PATH = 'assets/survey.css'
+STATIC_DIR = 'static'
+STATIC_URL = 'app/static'
+CONFIG_PATH = '.streamlit/config.toml'
+
+# The survey's own palette, for colors config.toml leaves out
+DEFAULT_THEME = {
+    'primaryColor': '#667eea',
+    'backgroundColor': '#ffffff',
+    'secondaryBackgroundColor': '#f0f2f6',
+    'textColor': '#262730',
+}
+# Second stop of the header and progress gradients; Streamlit warns about unknown [theme] keys
+ACCENT_COLOR = '#764ba2'
+
+_COMMENTS = re.compile(r'/\*.*?\*/', re.S)
+_SPACES = re.compile(r'\s+')
+_PUNCTUATION = re.compile(r' ?([{};,>]) ?')
+_COLON = re.compile(r': ')
+
+LOADER = """<script>(function () {
+var id = $id, d = document, fallback = $fallback;
+if (d.getElementById(id)) return;
+function apply(css) {
+  if (d.getElementById(id)) return;
+  d.querySelectorAll('style[id^="survey-css-"]').forEach(function (old) { old.remove(); });
+  var style = d.createElement('style');
+  style.id = id;
+  style.textContent = css;
+  d.head.appendChild(style);
+}
+fetch($url).then(function (r) { if (!r.ok) throw r.status; return r.text(); }).then(apply, function () {
+  if (fallback !== null) apply(fallback);
+});
+})();</script>"""
+
+
+def load_theme(path=None):
+    """The [theme] colors of config.toml, over DEFAULT_THEME"""
+    theme = dict(DEFAULT_THEME)
+    path = path or CONFIG_PATH
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            configured = tomllib.load(f).get('theme', {})
+        theme.update((key, value) for key, value in configured.items() if key in DEFAULT_THEME)
+    return theme
+
+
+def rgb(color):
+    """(r, g, b) of a #rrggbb or #rgb color"""
+    value = color.lstrip('#')
+    if len(value) == 3:
+        value = ''.join(ch * 2 for ch in value)
+    if len(value) != 6:
+        raise ValueError(f"Theme colors must be #rrggbb or #rgb, not {color!r}")
+    return tuple(int(value[i:i + 2], 16) for i in (0, 2, 4))
+
+
+def mix(first, second, weight):
+    """#rrggbb of first blended with `weight` of second"""
+    return '#' + ''.join(f'{round(a + (b - a) * weight):02x}' for a, b in zip(rgb(first), rgb(second)))
+
+
+def theme_css(theme, accent=ACCENT_COLOR):
+    """The :root rule setting the --survey-* properties the stylesheet uses"""
+    properties = {
+        'primary': theme['primaryColor'],
+        'primary-rgb': ','.join(map(str, rgb(theme['primaryColor']))),
+        'accent': accent,
+        'accent-rgb': ','.join(map(str, rgb(accent))),
+        'background': theme['backgroundColor'],
+        'panel': theme['secondaryBackgroundColor'],
+        'panel-shade': mix(theme['secondaryBackgroundColor'], theme['primaryColor'], 0.25),
+        'text': theme['textColor'],
+    }
+    return ':root{' + ';'.join(f'--survey-{name}:{value}' for name, value in properties.items()) + '}'
+
+
+def minify(css):
+    """Drop comments and the whitespace CSS does not need (no strings with these characters here)"""
+    css = _SPACES.sub(' ', _COMMENTS.sub('', css))
+    css = _COLON.sub(':', _PUNCTUATION.sub(r'\1', css))
+    return css.replace(';}', '}').strip()
+
+
+def build(source_path=SOURCE_PATH, static_dir=STATIC_DIR, config_path=None):
+    """Write the stylesheet for the current source and theme if it is not there yet; returns its file name"""
+    with open(source_path, encoding='utf-8') as f:
+        css = theme_css(load_theme(config_path)) + minify(f.read())
+    digest = hashlib.sha256(css.encode('utf-8')).hexdigest()[:12]
+    name = f"survey-{digest}.css"
+    path = os.path.join(static_dir, name)
+    if not os.path.exists(path):
+        os.makedirs(static_dir, exist_ok=True)
+        partial = f"{path}.{os.getpid()}.tmp"
+        with open(partial, 'w', encoding='utf-8') as f:
+            f.write(css)
+        # Workers building the same revision at once write identical files
+        os.replace(partial, path)
+    return name
+
+
+def fingerprint(name):
+    """The content hash in a built file name"""
+    return name.rsplit('-', 1)[-1].split('.')[0]
+
+
+def asset_url(name, base=STATIC_URL):
+    """URL of a built file; the v= query gets long-lived cache headers from Tornado's static handler"""
+    return f"{base}/{name}?v={fingerprint(name)}"
+
+
+def loader_html(name, base=STATIC_URL, fallback=False, static_dir=STATIC_DIR):
+    """Script that adds a built stylesheet to the page head once per page load
+
+    With fallback it also carries the CSS, inlined if the fetch fails.
+    """
+    element_id = f"survey-css-{fingerprint(name)}"
+    css = None
+    if fallback:
+        with open(os.path.join(static_dir, name), encoding='utf-8') as f:
+            css = f.read()
+    # "</" would end the <script> early
+    inline = json.dumps(css).replace('</', '<\\/')
+    return (LOADER.replace('$id', json.dumps(element_id)).replace('$url', json.dumps(asset_url(name, base)))
+            .replace('$fallback', inline))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--source', default=SOURCE_PATH)
+    parser.add_argument('--out', default=STATIC_DIR, help="directory Streamlit serves as app/static")
+    parser.add_argument('--config', help="config.toml with the [theme] colors")
+    args = parser.parse_args(argv)
+
+    name = build(args.source, args.out, args.config)
+    size = os.path.getsize(os.path.join(args.out, name))
+    print(f"wrote {os.path.join(args.out, name)} ({size:,} bytes from {os.path.getsize(args.source):,}); "
+          f"each rerun sends {len(loader_html(name)):,} bytes of loader "
+          f"({len(loader_html(name, fallback=True, static_dir=args.out)):,} with the fallback, once per session)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,277 @@
+"""Bulk ingest of responses collected offline (in-person sessions, partner spreadsheets).
+
+    python bulk_ingest.py sessions.jsonl
+    python bulk_ingest.py partner.csv --backend sqlite --path local_data/survey_responses.sqlite3
+    python bulk_ingest.py partner.csv --dry-run        # validate only
+
+JSONL files hold one submission payload per line (see submissions.py); the
+token may be left out and "timestamp" may give the ISO time it was collected.
+Storage also records when each record was loaded (ingested_at), and exports,
+search and dedup read in that order, so their next incremental run picks up
+back-dated records.
+CSV files have one response per row with the columns
+
+    token, study, language, timestamp, age, education, experience, suggestions,
+    question_1, response_1, ... question_N, response_N
+
+where question_N is the English question text, as many as the study asks.
+Empty cells count as missing; a missing study is the default one (see
+studies.py).
+
+Records are checked against RECORD_SCHEMA (compiled once) and then by the
+same rules as the ingest server, and written in parallel batched commits with
+their counter increments. A record without a token gets one derived from the
+file name, its record number and its content, so reruns store nothing twice.
+Progress is checkpointed in <input>.ingest-state.json after every batch,
+and rejected records are listed in <input>.rejects.jsonl; an interrupted run
+resumes after the last checkpoint.
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from jsonschema import Draft202012Validator
+from jsonschema.exceptions import best_match
+
+import scan
+import schema
+import studies
+from aggregates import summarize
+from counters import ShardedCounter
+from storage import add_backend_arguments, backend_from_args
+from submission_writer import SubmissionWriter
+from submissions import MAX_RESPONSE_CHARS, InvalidSubmission, register_studies, validate_payload
+from survey_content import DEMOGRAPHIC_CODES
+
+logger = logging.getLogger(__name__)
+
+# Derived tokens: uuid5(TOKEN_NAMESPACE, "<file name>:<record number>:<record JSON>")
+TOKEN_NAMESPACE = uuid.UUID('eab965a2-4f13-4df3-b0c6-cbe777e44fca')
+
+_TEXT = {'type': ['string', 'null'], 'maxLength': MAX_RESPONSE_CHARS}
+
+RECORD_SCHEMA = {
+    '$schema': 'https://json-schema.org/draft/2020-12/schema',
+    'type': 'object',
+    'required': ['language', 'questions_and_responses'],
+    'properties': {
+        'token': {'type': 'string', 'pattern': '^[0-9a-fA-F]{8}-?([0-9a-fA-F]{4}-?){3}[0-9a-fA-F]{12}$'},
+        'study': {'type': 'string'},
+        # Languages and question counts are per study, checked by validate_payload()
+        'language': {'type': 'string'},
+        'timestamp': {'type': 'string'},
+        'demographics': {
+            'type': ['object', 'null'],
+            'properties': {field: {'type': ['string', 'null']} for field in DEMOGRAPHIC_CODES},
+            'additionalProperties': False,
+        },
+        'questions_and_responses': {
+            'type': 'array',
+            'minItems': 1,
+            'items': {
+                'type': 'object',
+                'required': ['question_en'],
+                'properties': {'question_en': {'type': 'string'}, 'question_ar': _TEXT, 'response': _TEXT},
+            },
+        },
+        'final_questions': {'type': ['object', 'null'], 'properties': {'suggestions': _TEXT}},
+    },
+}
+
+Draft202012Validator.check_schema(RECORD_SCHEMA)
+VALIDATOR = Draft202012Validator(RECORD_SCHEMA)
+
+
+def csv_record(row):
+    """A CSV row as a payload dict"""
+    def cell(name):
+        value = (row.get(name) or '').strip()
+        return value or None
+
+    record = {
+        'language': cell('language'),
+        'demographics': {field: cell(field) for field in DEMOGRAPHIC_CODES},
+        'questions_and_responses': [],
+        'final_questions': {'suggestions': cell('suggestions')},
+    }
+    for name in ('token', 'study', 'timestamp'):
+        if cell(name):
+            record[name] = cell(name)
+    number = 1
+    while f'question_{number}' in row:
+        question = cell(f'question_{number}')
+        if question:
+            record['questions_and_responses'].append(
+                {'question_en': question, 'response': cell(f'response_{number}')})
+        number += 1
+    return record
+
+
+def read_records(path, fmt):
+    """Yield (record number, record or None, error) for every record in the file"""
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        if fmt == 'csv':
+            for number, row in enumerate(csv.DictReader(f), 1):
+                yield number, csv_record(row), None
+            return
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield number, json.loads(line), None
+            except ValueError as error:
+                yield number, None, f"Not JSON: {error}"
+
+
+def parse_timestamp(value):
+    """Naive UTC datetime from ISO text, like datetime.utcnow()"""
+    if value is None:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise InvalidSubmission(f"timestamp is not an ISO date-time: {value!r}")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def prepare(record, source, number, defined=None):
+    """Validate one record and build its writer item; raises InvalidSubmission"""
+    error = best_match(VALIDATOR.iter_errors(record))
+    if error is not None:
+        where = '/'.join(str(part) for part in error.absolute_path)
+        raise InvalidSubmission(f"{where}: {error.message}" if where else error.message)
+    if 'token' not in record:
+        canonical = json.dumps(record, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+        record = {**record, 'token': uuid.uuid5(TOKEN_NAMESPACE, f"{source}:{number}:{canonical}").hex}
+    timestamp = parse_timestamp(record.get('timestamp'))
+    token, language, data, study = validate_payload(record, defined)
+    document = scan.tag_document(schema.encode_submission(token, language, data, timestamp, study.content))
+    return ('set', study.doc_id(token), document, summarize(document), token)
+
+
+def new_state():
+    return {'records_done': 0, 'written': 0, 'skipped': 0, 'rejected': 0}
+
+
+def load_state(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return new_state()
+
+
+def save_state(path, state):
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def ingest(writer, path, fmt, workers=4, batch_size=1000, reset=False, dry_run=False, defined=None):
+    """Load one file, resuming after its checkpoint; returns the final state"""
+    state_path = path + '.ingest-state.json'
+    state = new_state() if reset or dry_run else load_state(state_path)
+    source = os.path.basename(path)
+    done = state['records_done']
+    batch = []
+    rejected = 0
+    # (last record number, records in the batch, rejects among them, future) in file order
+    pending = deque()
+
+    def finish_oldest():
+        last, size, batch_rejected, future = pending.popleft()
+        written = future.result()
+        state['records_done'] = last
+        state['rejected'] += batch_rejected
+        state['written'] += written
+        # Already stored by an earlier run, repeated in the file, or dropped after failing on its own
+        state['skipped'] += size - written
+        state['last_run'] = datetime.now(timezone.utc).isoformat()
+        save_state(state_path, state)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool, \
+            open(path + '.rejects.jsonl', 'a' if done else 'w', encoding='utf-8') as rejects:
+        last = done
+        for number, record, error in read_records(path, fmt):
+            if number <= done:
+                continue
+            last = number
+            if error is None:
+                try:
+                    batch.append(prepare(record, source, number, defined))
+                except InvalidSubmission as invalid:
+                    error = str(invalid)
+            if error is not None:
+                rejected += 1
+                rejects.write(json.dumps({'record': number, 'error': error}, ensure_ascii=False) + '\n')
+            if len(batch) >= batch_size and not dry_run:
+                pending.append((number, len(batch), rejected, pool.submit(writer.write_batch, batch)))
+                batch = []
+                rejected = 0
+                # Bound the records held in memory while commits are in flight
+                while len(pending) > workers * 2:
+                    finish_oldest()
+            elif dry_run:
+                batch = []
+        if dry_run:
+            state.update(records_done=last, rejected=rejected)
+            return state
+        if batch or rejected:
+            pending.append((last, len(batch), rejected, pool.submit(writer.write_batch, batch)))
+        while pending:
+            finish_oldest()
+    return state
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_backend_arguments(parser)
+    parser.add_argument('inputs', nargs='+', help="JSONL or CSV files")
+    parser.add_argument('--format', choices=('jsonl', 'csv'), help="input format (default: from the file extension)")
+    parser.add_argument('--workers', type=int, default=4, help="batches committed in parallel")
+    parser.add_argument('--batch-size', type=int, default=1000, help="records per checkpointed batch")
+    parser.add_argument('--counter-shards', type=int, default=10, help="0 disables the sharded counters")
+    parser.add_argument('--reset', action='store_true', help="ignore the checkpoints and start from the top")
+    parser.add_argument('--dry-run', action='store_true', help="validate and list rejects without writing")
+    parser.add_argument('--studies', default=studies.STUDIES_PATH, help="study definitions (see studies.py)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    defined = studies.load(args.studies, args.collection)
+    writer = None
+    if not args.dry_run:
+        backend = backend_from_args(args)
+        counters = ShardedCounter(backend, args.collection, args.counter_shards) if args.counter_shards else None
+        writer = SubmissionWriter(backend, counters)
+        register_studies(writer, defined, args.counter_shards)
+
+    failed = False
+    for path in args.inputs:
+        fmt = args.format or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+        started = time.perf_counter()
+        state = ingest(writer, path, fmt, args.workers, args.batch_size, args.reset, args.dry_run, defined)
+        elapsed = time.perf_counter() - started
+        print(f"{path}: {state['written']} written, {state['skipped']} skipped, "
+              f"{state['rejected']} rejected, through record {state['records_done']} "
+              f"in {elapsed:.1f} s")
+        failed = failed or state['rejected'] > 0
+    if writer is not None:
+        writer.close()
+        stats = writer.stats()
+        print(f"{stats['duplicates']} duplicates, {stats['failed']} failed writes, "
+              f"{stats['batches']} commits, {stats['retries']} retries")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
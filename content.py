@@ -0,0 +1,343 @@
+"""Question bank and interface text, loaded from a versioned data file.
+
+content/survey_content.json is the editable source:
+
+    {
+        "version": 3,                                  # bumped by whoever edits the file
+        "question_bank": [{"en": "...", "ar": "..."}, ...],
+        "translations": {"en": {"title": "...", ...}, "ar": {...}}
+    }
+
+It is compiled once per revision into <cache>/survey_content-<hash>.bin: a
+JSON header, a uint32 offset table and one UTF-8 blob holding every string.
+The compiled file is opened with mmap, so all worker processes on a machine
+share one page-cache copy and strings are decoded only when they are shown.
+
+Snapshots are immutable. watch() recompiles when the source changes and
+swaps current() in one assignment; sessions remember the version they started
+with and keep reading it, so a reload never changes text under a respondent.
+Each study (see studies.py) may have its own source file; current(), reload()
+and watch() take the source path and keep one current revision per file.
+
+    python content.py            # validate and compile the source
+"""
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+from collections.abc import Mapping, Sequence
+
+logger = logging.getLogger(__name__)
+
+CONTENT_PATH = os.environ.get('SURVEY_CONTENT_PATH', 'content/survey_content.json')
+CACHE_DIR = os.environ.get('SURVEY_CONTENT_CACHE', 'local_data/content')
+
+MAGIC = b'SVYC1\n'
+# Offsets are written in native byte order: the compiled file is a per-machine cache
+_OFFSET_TYPE = 'I'
+
+
+def question_bank_version(bank):
+    """Short content hash identifying a question bank revision"""
+    canonical = json.dumps(bank, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode()).hexdigest()[:12]
+
+
+def validate(source):
+    """Raise ValueError unless every question and translation key exists in every language"""
+    translations = source.get('translations') or {}
+    languages = list(translations)
+    if not languages:
+        raise ValueError("No translations")
+    keys = set(translations[languages[0]])
+    for language in languages[1:]:
+        if set(translations[language]) != keys:
+            raise ValueError(f"Translation keys for '{language}' differ from '{languages[0]}'")
+    bank = source.get('question_bank') or []
+    if not bank:
+        raise ValueError("Empty question bank")
+    for index, question in enumerate(bank):
+        if set(question) != set(languages):
+            raise ValueError(f"Question {index} is not written in exactly {languages}")
+
+
+def compile_content(source_path=CONTENT_PATH, cache_dir=CACHE_DIR):
+    """Compile the JSON source if this revision is not compiled yet; returns the compiled path"""
+    with open(source_path, 'rb') as f:
+        raw = f.read()
+    digest = hashlib.sha256(raw).hexdigest()[:12]
+    path = os.path.join(cache_dir, f"survey_content-{digest}.bin")
+    if os.path.exists(path):
+        return path
+
+    source = json.loads(raw)
+    validate(source)
+    bank = source['question_bank']
+    translations = source['translations']
+    languages = list(translations)
+    keys = list(translations[languages[0]])
+
+    # Question i in language j is string i*L + j; translation key k follows the questions
+    strings = [question[language] for question in bank for language in languages]
+    strings += [translations[language][key] for key in keys for language in languages]
+    encoded = [text.encode('utf-8') for text in strings]
+    offsets = array(_OFFSET_TYPE, [0])
+    for chunk in encoded:
+        offsets.append(offsets[-1] + len(chunk))
+
+    header = json.dumps({
+        'revision': source.get('version'),
+        'version': digest,
+        'bank_version': question_bank_version(bank),
+        'languages': languages,
+        'question_count': len(bank),
+        'translation_keys': keys,
+    }, ensure_ascii=False).encode('utf-8')
+    # Pad so the offset table starts 4-byte aligned
+    header += b' ' * (-(len(MAGIC) + 4 + len(header)) % offsets.itemsize)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    partial = f"{path}.{os.getpid()}.tmp"
+    with open(partial, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<I', len(header)))
+        f.write(header)
+        f.write(offsets.tobytes())
+        f.write(b''.join(encoded))
+    # Workers compiling the same revision at once write identical files
+    os.replace(partial, path)
+    return path
+
+
+class ContentSnapshot:
+    """One compiled content revision, read from a memory-mapped file"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._map)
+        if bytes(view[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f"{path} is not a compiled content file")
+        start = len(MAGIC) + 4
+        (header_size,) = struct.unpack('<I', view[len(MAGIC):start])
+        header = json.loads(bytes(view[start:start + header_size]))
+        start += header_size
+
+        self.path = path
+        self.revision = header['revision']
+        self.version = header['version']
+        self.bank_version = header['bank_version']
+        self.languages = tuple(header['languages'])
+        count = header['question_count'] * len(self.languages) + \
+            len(header['translation_keys']) * len(self.languages)
+        end = start + (count + 1) * array(_OFFSET_TYPE).itemsize
+        self._offsets = view[start:end].cast(_OFFSET_TYPE)
+        self._blob = view[end:]
+        self.questions = QuestionBank(self, header['question_count'])
+        self.translations = Translations(self, header['question_count'], header['translation_keys'])
+
+    def string(self, number):
+        return str(self._blob[self._offsets[number]:self._offsets[number + 1]], 'utf-8')
+
+
+class QuestionBank(Sequence):
+    """QUESTION_BANK-compatible list of {language: text} dicts built on access"""
+
+    def __init__(self, snapshot, count):
+        self._snapshot = snapshot
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        index = range(self._count)[index]
+        languages = self._snapshot.languages
+        first = index * len(languages)
+        return {language: self._snapshot.string(first + j) for j, language in enumerate(languages)}
+
+    def text(self, index, language):
+        """One question in one language, without building the dict"""
+        languages = self._snapshot.languages
+        return self._snapshot.string(range(self._count)[index] * len(languages) + languages.index(language))
+
+
+class Translations(Mapping):
+    """TRANSLATIONS-compatible {language: {key: text}} mapping"""
+
+    def __init__(self, snapshot, question_count, keys):
+        self._snapshot = snapshot
+        self._first = question_count * len(snapshot.languages)
+        self._keys = {key: position for position, key in enumerate(keys)}
+        self._languages = {
+            language: LanguageTexts(self, column) for column, language in enumerate(snapshot.languages)
+        }
+
+    def __getitem__(self, language):
+        return self._languages[language]
+
+    def __iter__(self):
+        return iter(self._languages)
+
+    def __len__(self):
+        return len(self._languages)
+
+    def text(self, key, column):
+        width = len(self._snapshot.languages)
+        return self._snapshot.string(self._first + self._keys[key] * width + column)
+
+
+class LanguageTexts(Mapping):
+    """The interface strings of one language"""
+
+    def __init__(self, translations, column):
+        self._translations = translations
+        self._column = column
+
+    def __getitem__(self, key):
+        return self._translations.text(key, self._column)
+
+    def __iter__(self):
+        return iter(self._translations._keys)
+
+    def __len__(self):
+        return len(self._translations._keys)
+
+
+_lock = threading.Lock()
+_snapshots = {}
+# Source path -> the revision new sessions start with
+_current = {}
+_listeners = []
+_observer = None
+# Absolute source path -> the path as given, for every watched file
+_watched = {}
+
+
+def _open(source_path):
+    path = compile_content(source_path)
+    with _lock:
+        loaded = next((s for s in _snapshots.values() if s.path == path), None)
+    return loaded or ContentSnapshot(path)
+
+
+def current(source_path=CONTENT_PATH):
+    """The content new sessions of a source file start with"""
+    active = _current.get(source_path)
+    if active is None:
+        opened = _open(source_path)
+        with _lock:
+            active = _current.setdefault(source_path, opened)
+            _snapshots.setdefault(active.version, active)
+    return active
+
+
+def snapshot(version=None):
+    """A revision by version (the current one for None); KeyError if it was never compiled here"""
+    if version is None:
+        return current()
+    loaded = _snapshots.get(version)
+    if loaded is None:
+        # Compiled by another worker on this machine, e.g. for a session resumed here
+        path = os.path.join(CACHE_DIR, f"survey_content-{version}.bin")
+        if not version.isalnum() or not os.path.exists(path):
+            raise KeyError(version)
+        opened = ContentSnapshot(path)
+        with _lock:
+            loaded = _snapshots.setdefault(version, opened)
+    return loaded
+
+
+def questions_for(bank_version):
+    """The question list of a loaded revision with this bank version, or None"""
+    with _lock:
+        loaded = list(_snapshots.values())
+    for candidate in loaded:
+        if candidate.bank_version == bank_version:
+            return candidate.questions
+    return None
+
+
+def on_reload(callback):
+    """Call callback(snapshot) whenever a new revision becomes current"""
+    _listeners.append(callback)
+
+
+def reload(source_path=CONTENT_PATH):
+    """Compile and switch to the source's current revision; returns True if it changed"""
+    active = current(source_path)
+    snapshot = _open(source_path)
+    if snapshot.version == active.version:
+        return False
+    # Question indices are baked into stored responses, counters and the scheduler
+    if len(snapshot.questions) != len(active.questions):
+        raise ValueError("A hot reload cannot add or remove questions; restart the app instead")
+    if snapshot.languages != active.languages:
+        raise ValueError("A hot reload cannot change the languages; restart the app instead")
+    with _lock:
+        # Older revisions stay mapped for the sessions that started with them
+        _snapshots[snapshot.version] = snapshot
+        _current[source_path] = snapshot
+    logger.info("Survey content revision %s (%s) of %s is now current",
+                snapshot.revision, snapshot.version, source_path)
+    for callback in list(_listeners):
+        try:
+            callback(snapshot)
+        except Exception:
+            logger.exception("Content reload listener failed")
+    return True
+
+
+def watch(source_path=CONTENT_PATH):
+    """Reload whenever the source file is saved; safe to call more than once per file"""
+    global _observer
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+
+    class Handler(FileSystemEventHandler):
+        def on_any_event(self, event):
+            # Opens and reads (including our own) also produce events
+            if event.event_type not in ('created', 'modified', 'moved', 'closed'):
+                return
+            paths = {getattr(event, 'src_path', None), getattr(event, 'dest_path', None)}
+            for changed in {_watched.get(os.path.abspath(p)) for p in paths if p} - {None}:
+                try:
+                    reload(changed)
+                except (OSError, ValueError) as error:
+                    # Half-written or invalid files keep the current revision
+                    logger.warning("Ignoring change to %s: %s", changed, error)
+
+    target = os.path.abspath(source_path)
+    directory = os.path.dirname(target)
+    with _lock:
+        if target in _watched:
+            return _observer
+        if _observer is None:
+            _observer = Observer()
+            _observer.daemon = True
+            _observer.start()
+        # Watch the directory: editors save by replacing the file
+        if not any(os.path.dirname(watched) == directory for watched in _watched):
+            _observer.schedule(Handler(), directory)
+        _watched[target] = source_path
+    return _observer
+
+
+def main(argv=None):
+    source_path = (argv or sys.argv[1:] or [CONTENT_PATH])[0]
+    compiled = ContentSnapshot(compile_content(source_path))
+    print(f"revision {compiled.revision}: {len(compiled.questions)} questions, "
+          f"languages {', '.join(compiled.languages)}, bank version {compiled.bank_version}")
+    print(f"compiled to {compiled.path} ({os.path.getsize(compiled.path):,} bytes)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
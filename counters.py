@@ -0,0 +1,107 @@
+"""Sharded distributed counters for live survey statistics.
+
+A counter is N shard documents under counters/<name>/shards/<k>. Each shard
+holds every metric as a nested field, so 'question.17.answered' is stored as
+{'question': {'17': {'answered': n}}}. Writers add to one randomly chosen
+shard, which keeps each shard far below Firestore's ~1 write/second/document
+limit; readers sum all shards and cache the total for a short TTL.
+
+    python counters.py --seed     # recompute the totals from count() queries
+"""
+import argparse
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+COUNTER_COLLECTION = "counters"
+
+
+def nest(counts):
+    """{'a.b': 1} -> {'a': {'b': 1}}"""
+    nested = {}
+    for metric, amount in counts.items():
+        *parents, leaf = metric.split('.')
+        node = nested
+        for part in parents:
+            node = node.setdefault(part, {})
+        node[leaf] = node.get(leaf, 0) + amount
+    return nested
+
+
+def flatten(nested, prefix=''):
+    """{'a': {'b': 1}} -> Counter({'a.b': 1})"""
+    counts = Counter()
+    for key, value in (nested or {}).items():
+        metric = f"{prefix}{key}"
+        if isinstance(value, dict):
+            counts.update(flatten(value, metric + '.'))
+        elif isinstance(value, (int, float)):
+            counts[metric] += value
+    return counts
+
+
+class ShardedCounter:
+    """A set of named counts spread over num_shards documents"""
+
+    def __init__(self, backend, name, num_shards=10, ttl=10):
+        self.backend = backend
+        self.name = name
+        self.num_shards = num_shards
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._cached = None
+        self._cached_at = 0.0
+
+    def shard_path(self, shard):
+        return f"{COUNTER_COLLECTION}/{self.name}/shards/{shard}"
+
+    def increment_write(self, counts):
+        """An 'increment' write adding counts to a random shard, for the same batch as the response"""
+        shard = random.randrange(self.num_shards)
+        return ('increment', self.shard_path(shard), nest(counts))
+
+    def read(self, force=False):
+        """Sum of all shards as a Counter of metric -> total, cached for `ttl` seconds"""
+        with self._lock:
+            if not force and self._cached is not None and time.time() - self._cached_at <= self.ttl:
+                return self._cached
+        totals = Counter()
+        for shard in range(self.num_shards):
+            totals.update(flatten(self.backend.get(self.shard_path(shard))))
+        with self._lock:
+            self._cached = totals
+            self._cached_at = time.time()
+        return totals
+
+    def seed(self, counts):
+        """Overwrite the counter with exact totals: everything in shard 0, other shards cleared"""
+        writes = [('set', self.shard_path(0), nest(counts))]
+        writes += [('set', self.shard_path(shard), {}) for shard in range(1, self.num_shards)]
+        self.backend.apply_batch(writes)
+
+
+def main(argv=None):
+    from aggregates import metric_filters
+    from storage import add_backend_arguments, backend_from_args
+
+    parser = argparse.ArgumentParser(description="Inspect or seed the sharded response counters")
+    add_backend_arguments(parser)
+    parser.add_argument('--shards', type=int, default=10)
+    parser.add_argument('--seed', action='store_true',
+                        help="recompute totals with count() queries and overwrite the shards "
+                             "(run while no submissions are arriving)")
+    args = parser.parse_args(argv)
+
+    backend = backend_from_args(args)
+    counter = ShardedCounter(backend, args.collection, args.shards)
+    if args.seed:
+        counter.seed({metric: backend.count(filters) for metric, filters in metric_filters()})
+    for metric, total in sorted(counter.read(force=True).items()):
+        print(f"{metric:<40}{total:>10}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,310 @@
+"""Near-duplicate answers and scripted submissions, found with MinHash and LSH.
+
+    python dedup.py                                   # index new submissions and flag them
+    python dedup.py --backend sqlite --path local_data/survey_responses.sqlite3
+    python dedup.py --report                          # only list the largest clusters
+
+Every answer of at least MIN_CHARS normalized characters (see textnorm.py)
+gets a MinHash signature over its character shingles. The signature is cut
+into BANDS bands. Only the first answer of each cluster, its representative,
+is put in the LSH buckets of its bands, so a new answer is compared with at
+most BUCKET_CANDIDATES representatives per band, fetched in one query, not
+with every earlier answer: a thousand copies of a scripted answer cost no
+more to check against than one. A new answer whose estimated Jaccard
+similarity with a representative reaches THRESHOLD joins that cluster;
+otherwise it becomes the representative of a new one.
+
+Signatures, buckets, clusters and the scan cursor persist in one SQLite
+file (--index), so each run reads only the submissions that arrived since
+the last one, in the order they were stored (ingested_at, see storage.py), so
+back-dated bulk_ingest.py loads are read too; answers already indexed are
+skipped, so --reset rescans without double counting.
+Flagged responses are merged with
+
+    "near_duplicates": {"clusters": {"<position>": "<cluster>"}, "suspect": true}
+
+where suspect marks submissions in which at least SUSPECT_SHARE of the
+indexed answers (and no fewer than SUSPECT_MIN_ANSWERS) are near-duplicates,
+the usual shape of scripted or
+copy-pasted submissions.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from collections import defaultdict
+
+import numpy as np
+
+import schema
+from storage import add_backend_arguments, backend_from_args, merge_fields, scan_cursor
+from submission_writer import SubmissionWriter
+from textnorm import words
+
+INDEX_PATH = os.environ.get('SURVEY_DEDUP_INDEX', 'local_data/dedup.sqlite3')
+
+NUM_PERM = 128
+BANDS = 16           # 16 bands of 8 rows: pairs above ~0.7 similarity usually share a bucket
+SHINGLE = 5
+THRESHOLD = 0.8
+MIN_CHARS = 30
+# Representatives compared per band and new answer
+BUCKET_CANDIDATES = 8
+SUSPECT_SHARE = 0.5
+SUSPECT_MIN_ANSWERS = 2
+
+# Mersenne prime for the universal hashes: a * crc32 + b stays below 2**64
+_PRIME = np.uint64((1 << 31) - 1)
+
+
+class MinHasher:
+    """MinHash signatures over the character shingles of normalized text"""
+
+    def __init__(self, num_perm=NUM_PERM, shingle=SHINGLE, seed=1):
+        self.num_perm = num_perm
+        self.shingle = shingle
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, int(_PRIME), num_perm).astype(np.uint64)
+        self._b = rng.randint(0, int(_PRIME), num_perm).astype(np.uint64)
+
+    def shingles(self, text):
+        text = ' '.join(words(text))
+        if len(text) < MIN_CHARS:
+            return None
+        return {text[i:i + self.shingle] for i in range(len(text) - self.shingle + 1)}
+
+    def signature(self, text):
+        """uint32 signature, or None for answers too short to compare"""
+        shingles = self.shingles(text) if text else None
+        if not shingles:
+            return None
+        hashes = np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingles),
+                             dtype=np.uint64, count=len(shingles))
+        return ((hashes[:, None] * self._a + self._b) % _PRIME).min(axis=0).astype(np.uint32)
+
+
+def similarity(first, second):
+    """Estimated Jaccard similarity of two signatures"""
+    return float(np.count_nonzero(first == second)) / len(first)
+
+
+class DuplicateIndex:
+    """Persistent LSH index of answer signatures"""
+
+    def __init__(self, path=INDEX_PATH, hasher=None, bands=BANDS, threshold=THRESHOLD):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.hasher = hasher or MinHasher()
+        self.bands = bands
+        self.rows = self.hasher.num_perm // bands
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            " id INTEGER PRIMARY KEY,"
+            " key TEXT NOT NULL UNIQUE,"
+            " response_id TEXT NOT NULL,"
+            " position INTEGER NOT NULL,"
+            " signature BLOB NOT NULL,"
+            " cluster TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answers_by_cluster ON answers (cluster)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answers_by_response ON answers (response_id)")
+        # Cluster representatives by answer rowid, one row per band
+        self._conn.execute("CREATE TABLE IF NOT EXISTS buckets (band INTEGER, bucket INTEGER, answer INTEGER)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS buckets_by_band ON buckets (band, bucket)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS clusters (cluster TEXT PRIMARY KEY, size INTEGER NOT NULL)")
+        self._check_parameters()
+
+    def _check_parameters(self):
+        # Layout 2: only cluster representatives are in the buckets
+        parameters = json.dumps({'num_perm': self.hasher.num_perm, 'shingle': self.hasher.shingle,
+                                 'bands': self.bands, 'min_chars': MIN_CHARS, 'layout': 2})
+        stored = self.get_meta('parameters')
+        if stored is None:
+            self.set_meta('parameters', parameters)
+        elif stored != parameters:
+            raise ValueError(f"The index was built with {stored}; rebuild it to use {parameters}")
+
+    def get_meta(self, key):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def _buckets(self, signature):
+        for band in range(self.bands):
+            chunk = signature[band * self.rows:(band + 1) * self.rows].tobytes()
+            yield band, int.from_bytes(hashlib.blake2b(chunk, digest_size=8).digest(), 'big', signed=True)
+
+    def _add(self, response_id, position, signature):
+        """Index one answer inside the caller's transaction; returns (cluster, earlier answer keys to flag)
+
+        The keys are None when the answer matched nothing (or was indexed
+        before), and otherwise list the representatives that were alone in
+        their cluster until now; answers of larger clusters are flagged already.
+        """
+        key = f"{response_id}/{position}"
+        row = self._conn.execute("SELECT cluster FROM answers WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            return row[0], None
+
+        buckets = list(self._buckets(signature))
+        candidates = set()
+        for band, bucket in buckets:
+            candidates.update(found for (found,) in self._conn.execute(
+                "SELECT answer FROM buckets WHERE band = ? AND bucket = ? LIMIT ?",
+                (band, bucket, BUCKET_CANDIDATES)))
+        matches = {}
+        if candidates:
+            rows = self._conn.execute(
+                f"SELECT key, signature, cluster FROM answers WHERE id IN ({','.join('?' * len(candidates))})",
+                list(candidates))
+            for other, stored, cluster in rows:
+                if similarity(signature, np.frombuffer(stored, dtype=np.uint32)) >= self.threshold:
+                    matches[other] = cluster
+
+        if not matches:
+            answer = self._insert(key, response_id, position, signature, key)
+            self._conn.executemany("INSERT INTO buckets (band, bucket, answer) VALUES (?, ?, ?)",
+                                   [(band, bucket, answer) for band, bucket in buckets])
+            self._conn.execute("INSERT OR REPLACE INTO clusters (cluster, size) VALUES (?, 1)", (key,))
+            return key, None
+
+        sizes = {cluster: self._conn.execute("SELECT size FROM clusters WHERE cluster = ?",
+                                             (cluster,)).fetchone()[0]
+                 for cluster in set(matches.values())}
+        cluster = min(sizes)
+        # The new answer can join clusters that were separate so far; their representatives stay in the buckets
+        for other in set(sizes) - {cluster}:
+            self._conn.execute("UPDATE answers SET cluster = ? WHERE cluster = ?", (cluster, other))
+            self._conn.execute("DELETE FROM clusters WHERE cluster = ?", (other,))
+        self._conn.execute("UPDATE clusters SET size = ? WHERE cluster = ?", (sum(sizes.values()) + 1, cluster))
+        self._insert(key, response_id, position, signature, cluster)
+        return cluster, [other for other, found in matches.items() if sizes[found] == 1]
+
+    def _insert(self, key, response_id, position, signature, cluster):
+        return self._conn.execute(
+            "INSERT INTO answers (key, response_id, position, signature, cluster) VALUES (?, ?, ?, ?, ?)",
+            (key, response_id, position, signature.tobytes(), cluster)).lastrowid
+
+    def add_document(self, response_id, document):
+        """Index a response's answers; returns {response_id: {position: cluster}} for every near-duplicate
+
+        The result includes the earlier answers a new one matched, so both
+        sides of a pair get flagged.
+        """
+        signatures = [(position, self.hasher.signature(text))
+                      for position, text in enumerate(schema.response_texts(document))]
+        flagged = defaultdict(dict)
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for position, signature in signatures:
+                    if signature is None:
+                        continue
+                    cluster, matched = self._add(response_id, position, signature)
+                    if matched is not None:
+                        flagged[response_id][position] = cluster
+                        for other in matched:
+                            other_id, other_position = other.rsplit('/', 1)
+                            flagged[other_id][int(other_position)] = cluster
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return flagged
+
+    def indexed_answers(self, response_id):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM answers WHERE response_id = ?", (response_id,)).fetchone()[0]
+
+    def clusters(self, min_size=2, limit=20):
+        """[(cluster, size, responses)] largest first"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT cluster, COUNT(*) AS size, COUNT(DISTINCT response_id) FROM answers"
+                " GROUP BY cluster HAVING size >= ? ORDER BY size DESC LIMIT ?",
+                (min_size, limit)).fetchall()
+
+
+def flag_fields(positions, suspect=None):
+    fields = {'near_duplicates': {'clusters': {str(position): cluster for position, cluster in positions.items()}}}
+    if suspect is not None:
+        fields['near_duplicates']['suspect'] = suspect
+    return fields
+
+
+def run(backend, index, writer=None, page_size=500, reset=False):
+    """Index submissions after the stored cursor; returns (responses, near-duplicate answers, suspects)"""
+    after = None if reset else json.loads(index.get_meta('after') or 'null')
+    responses = duplicates = suspects = 0
+    while True:
+        page = backend.scan(after=after, limit=page_size)
+        if not page:
+            break
+        merges = {}
+        for doc_id, document in page:
+            if document.get('status', 'submitted') != 'submitted':
+                continue
+            flagged = index.add_document(doc_id, document)
+            responses += 1
+            own = flagged.pop(doc_id, {})
+            suspect = None
+            if own:
+                duplicates += len(own)
+                suspect = len(own) >= max(SUSPECT_MIN_ANSWERS, SUSPECT_SHARE * index.indexed_answers(doc_id))
+                suspects += suspect
+                merges[doc_id] = merge_fields(merges.get(doc_id, {}), flag_fields(own, suspect))
+            for other_id, positions in flagged.items():
+                merges[other_id] = merge_fields(merges.get(other_id, {}), flag_fields(positions))
+        if writer is not None and merges:
+            writer.write_batch([('merge', doc_id, fields, None, None) for doc_id, fields in merges.items()])
+        last_id, last_document = page[-1]
+        after = scan_cursor(last_id, last_document)
+        # Only after the flags are written, so a crash re-reads the page
+        index.set_meta('after', json.dumps(after))
+        if len(page) < page_size:
+            break
+    return responses, duplicates, suspects
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_backend_arguments(parser)
+    parser.add_argument('--index', default=INDEX_PATH, help="SQLite file holding the LSH index")
+    parser.add_argument('--page-size', type=int, default=500, help="documents fetched per query")
+    parser.add_argument('--reset', action='store_true', help="rescan from the start (indexed answers are skipped)")
+    parser.add_argument('--no-write', action='store_true', help="index and report without flagging documents")
+    parser.add_argument('--report', action='store_true', help="only list the largest clusters")
+    args = parser.parse_args(argv)
+
+    index = DuplicateIndex(args.index)
+    if not args.report:
+        backend = backend_from_args(args)
+        writer = None if args.no_write else SubmissionWriter(backend)
+        started = time.perf_counter()
+        responses, duplicates, suspects = run(backend, index, writer, args.page_size, args.reset)
+        if writer is not None:
+            writer.close()
+        print(f"indexed {responses} responses in {time.perf_counter() - started:.1f} s: "
+              f"{duplicates} near-duplicate answers, {suspects} suspect submissions")
+    for cluster, size, responses in index.clusters():
+        print(f"{size:6d} answers in {responses:5d} responses  cluster {cluster}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
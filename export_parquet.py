@@ -0,0 +1,198 @@
+"""Incremental export of submitted survey responses to partitioned Parquet.
+
+    python export_parquet.py --out exports/
+    python export_parquet.py --backend sqlite --path local_data/survey_responses.sqlite3 --out exports/
+
+Pages through the collection in the order documents were stored (ingested_at,
+see storage.py) with query cursors, so memory stays at one page regardless of
+collection size. A high-water mark in <out>/_export_state.json makes reruns
+fetch only documents stored since the last run, back-dated bulk loads
+included. Each answer becomes one row under <out>/date=YYYY-MM-DD/, in the
+partition of its own timestamp. --reset exports everything again and then
+removes the part files of earlier runs.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import scan
+import schema
+from storage import add_backend_arguments, backend_from_args, scan_cursor
+
+STATE_FILE = "_export_state.json"
+
+ROW_SCHEMA = pa.schema([
+    ('response_id', pa.string()),
+    ('timestamp', pa.timestamp('us', tz='UTC')),
+    ('language', pa.string()),
+    ('schema_version', pa.int16()),
+    ('question_bank_version', pa.string()),
+    ('position', pa.int16()),
+    ('question_index', pa.int16()),
+    ('question_en', pa.string()),
+    ('question_ar', pa.string()),
+    ('response', pa.string()),
+    ('age', pa.string()),
+    ('education', pa.string()),
+    ('experience', pa.string()),
+    ('suggestions', pa.string()),
+    ('contains_private', pa.bool_()),
+    ('contains_toxic', pa.bool_()),
+])
+
+
+def to_utc(value):
+    """Timestamps arrive as datetimes (Firestore, memory) or ISO text (SQLite, JSONL)"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def flatten(document, load_questions):
+    """One row per answer, with the response's demographics repeated on each row"""
+    expanded = schema.expand_document(document, load_questions)
+    timestamp = to_utc(expanded['timestamp'])
+    demographics = expanded['demographics']
+    # Responses saved before scanning was added are scanned here
+    flags = document.get('flags') or scan.flag_responses(
+        item['response'] for item in expanded['questions_and_responses'])
+    flagged = {label: set(flags.get(label, ())) for label in scan.LABELS}
+    for item in expanded['questions_and_responses']:
+        yield {
+            'response_id': expanded['id'],
+            'timestamp': timestamp,
+            'language': expanded['language'],
+            'schema_version': expanded['schema_version'],
+            'question_bank_version': expanded['question_bank_version'],
+            'position': item['position'],
+            'question_index': item['question_index'],
+            'question_en': item['question_en'],
+            'question_ar': item['question_ar'],
+            'response': item['response'],
+            'age': demographics.get('age'),
+            'education': demographics.get('education'),
+            'experience': demographics.get('experience'),
+            'suggestions': expanded['final_questions'].get('suggestions'),
+            'contains_private': item['position'] in flagged[scan.PRIVATE],
+            'contains_toxic': item['position'] in flagged[scan.TOXIC],
+        }
+
+
+def load_state(out_dir):
+    try:
+        with open(os.path.join(out_dir, STATE_FILE), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'after': None, 'exported_documents': 0}
+
+
+def save_state(out_dir, state):
+    path = os.path.join(out_dir, STATE_FILE)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+class PartitionedWriter:
+    """One open ParquetWriter per date partition; files appear only once closed"""
+
+    def __init__(self, out_dir, run_id):
+        self.out_dir = out_dir
+        self.run_id = run_id
+        self._writers = {}
+
+    def write(self, rows):
+        by_date = {}
+        for row in rows:
+            by_date.setdefault(row['timestamp'].date().isoformat(), []).append(row)
+        for date, date_rows in by_date.items():
+            if date not in self._writers:
+                directory = os.path.join(self.out_dir, f"date={date}")
+                os.makedirs(directory, exist_ok=True)
+                final_path = os.path.join(directory, f"part-{self.run_id}.parquet")
+                writer = pq.ParquetWriter(final_path + '.inprogress', ROW_SCHEMA, compression='zstd')
+                self._writers[date] = (writer, final_path)
+            self._writers[date][0].write_table(pa.Table.from_pylist(date_rows, schema=ROW_SCHEMA))
+
+    def close(self):
+        for writer, final_path in self._writers.values():
+            writer.close()
+            os.replace(final_path + '.inprogress', final_path)
+        return len(self._writers)
+
+    def remove_earlier_runs(self):
+        """Delete the part files of every other run; returns how many"""
+        removed = 0
+        for entry in os.scandir(self.out_dir):
+            if not (entry.is_dir() and entry.name.startswith('date=')):
+                continue
+            for part in os.scandir(entry.path):
+                if part.name.endswith('.parquet') and part.name != f"part-{self.run_id}.parquet":
+                    os.remove(part.path)
+                    removed += 1
+        return removed
+
+
+def export(backend, out_dir, page_size=500, reset=False):
+    """Export everything after the stored high-water mark; returns (documents, rows, files)"""
+    os.makedirs(out_dir, exist_ok=True)
+    state = {'after': None, 'exported_documents': 0} if reset else load_state(out_dir)
+    after = state['after']
+    load_questions = schema.QuestionBankSnapshots(backend)
+    writer = PartitionedWriter(out_dir, datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f'))
+    documents = rows = 0
+
+    while True:
+        page = backend.scan(after=after, limit=page_size)
+        if not page:
+            break
+        page_rows = []
+        for doc_id, document in page:
+            if document.get('status', 'submitted') == 'submitted':
+                page_rows.extend(flatten({'id': doc_id, **document}, load_questions))
+                documents += 1
+        writer.write(page_rows)
+        rows += len(page_rows)
+        last_id, last_document = page[-1]
+        after = scan_cursor(last_id, last_document)
+        if len(page) < page_size:
+            break
+
+    files = writer.close()
+    if reset:
+        # Everything is in this run's files now; older parts would duplicate rows
+        writer.remove_earlier_runs()
+    # Advance the high-water mark only after the files are in place
+    state['after'] = after
+    state['exported_documents'] += documents
+    state['last_run'] = datetime.now(timezone.utc).isoformat()
+    save_state(out_dir, state)
+    return documents, rows, files
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_backend_arguments(parser)
+    parser.add_argument('--out', default='exports', help="output directory")
+    parser.add_argument('--page-size', type=int, default=500, help="documents fetched per query")
+    parser.add_argument('--reset', action='store_true',
+                        help="ignore the high-water mark, export everything and replace earlier files")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    documents, rows, files = export(backend_from_args(args), args.out, args.page_size, args.reset)
+    print(f"exported {documents} responses ({rows} rows, {files} files) "
+          f"in {time.perf_counter() - started:.1f} s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,89 @@
+"""Compiled message catalog for every user-visible string.
+
+Messages come from the "translations" of the survey content file (see
+content.py). A language is compiled the first time it is asked for: plain
+strings are decoded once, and strings with {placeholders} are parsed once
+into a Template, so rendering a message is a single dict lookup plus, for
+templates, a join. Sessions hold only a language code, so a new language
+costs nothing per session.
+"""
+import threading
+from string import Formatter
+
+import content
+
+
+class Template:
+    """A message with {fields}, parsed once"""
+
+    __slots__ = ('text', 'pieces')
+
+    def __init__(self, text, pieces):
+        self.text = text
+        self.pieces = pieces
+
+    def format(self, **values):
+        parts = []
+        for literal, field, spec, conversion in self.pieces:
+            parts.append(literal)
+            if field is not None:
+                value = values[field]
+                if conversion:
+                    value = {'r': repr, 's': str, 'a': ascii}[conversion](value)
+                parts.append(format(value, spec))
+        return ''.join(parts)
+
+
+def compile_message(text):
+    """A str for plain text ('{{' unescaped), or a Template when it has fields"""
+    pieces = tuple(Formatter().parse(text))
+    if all(field is None for _, field, _, _ in pieces):
+        return ''.join(literal for literal, _, _, _ in pieces)
+    if not all(field is None or field.isidentifier() for _, field, _, _ in pieces):
+        raise ValueError(f"Only plain {{name}} fields are supported: {text!r}")
+    return Template(text, pieces)
+
+
+class Catalog:
+    """The messages of one content revision, compiled per language on first use"""
+
+    def __init__(self, translations):
+        self._translations = translations
+        self._languages = {}
+        self._lock = threading.Lock()
+
+    @property
+    def languages(self):
+        return tuple(self._translations)
+
+    def messages(self, language):
+        """{key: str or Template} for a language"""
+        compiled = self._languages.get(language)
+        if compiled is None:
+            with self._lock:
+                compiled = self._languages.get(language)
+                if compiled is None:
+                    texts = self._translations[language]
+                    compiled = {key: compile_message(texts[key]) for key in texts}
+                    self._languages[language] = compiled
+        return compiled
+
+    def text(self, language, key, **values):
+        message = self.messages(language)[key]
+        if isinstance(message, str):
+            return message
+        return message.format(**values) if values else message.text
+
+
+_catalogs = {}
+_lock = threading.Lock()
+
+
+def catalog(version=None):
+    """The catalog of a loaded content revision (the current one for None)"""
+    snapshot = content.snapshot(version)
+    compiled = _catalogs.get(snapshot.version)
+    if compiled is None:
+        with _lock:
+            compiled = _catalogs.setdefault(snapshot.version, Catalog(snapshot.translations))
+    return compiled
@@ -0,0 +1,148 @@
+"""JSON ingest server for the static survey bundle.
+
+    python static_site.py --out site/
+    python ingest_server.py --static site/ --port 8080
+    python ingest_server.py --backend sqlite --path local_data/survey_responses.sqlite3
+
+POST /api/submit takes one finished payload (see submissions.py) of any study
+in studies.json and queues it on the same write-behind SubmissionWriter,
+counters and idempotent submission tokens as the Streamlit app. Each respondent costs the server one
+request instead of a websocket and a rerun per click. Responses:
+
+    202 {"id": ...}        queued (also for a repeated token, which is stored once)
+    400 {"error": ...}     the payload is invalid
+    503 {"error": ...}     storage is down; retry later with the same token
+"""
+import argparse
+import json
+import logging
+import sys
+
+import tornado.ioloop
+import tornado.web
+
+import metrics
+import studies
+from counters import ShardedCounter
+from storage import InstrumentedBackend, add_backend_arguments, backend_from_args
+from submission_writer import CircuitOpen, SubmissionWriter
+from submissions import InvalidSubmission, register_studies, save_payload
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY_BYTES = 256 * 1024
+
+
+class JsonHandler(tornado.web.RequestHandler):
+    def initialize(self, allow_origin=None):
+        self.allow_origin = allow_origin
+
+    def set_default_headers(self):
+        self.set_header('Content-Type', 'application/json')
+
+    def prepare(self):
+        if self.allow_origin:
+            self.set_header('Access-Control-Allow-Origin', self.allow_origin)
+            self.set_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
+            self.set_header('Access-Control-Allow-Headers', 'Content-Type')
+
+    def options(self):
+        self.set_status(204)
+
+    def write_error(self, status_code, **kwargs):
+        self.finish({'error': self._reason})
+
+
+class SubmitHandler(JsonHandler):
+    """POST /api/submit"""
+
+    def initialize(self, writer, defined, allow_origin=None):
+        super().initialize(allow_origin)
+        self.writer = writer
+        self.defined = defined
+
+    async def post(self):
+        try:
+            payload = json.loads(self.request.body)
+        except ValueError:
+            raise tornado.web.HTTPError(400, reason="Body is not JSON")
+        with metrics.span('ingest.submit'):
+            try:
+                # Usually just a queue put, but a full queue falls back to a blocking write
+                doc_id = await tornado.ioloop.IOLoop.current().run_in_executor(
+                    None, save_payload, self.writer, payload, None, self.defined)
+            except InvalidSubmission as error:
+                raise tornado.web.HTTPError(400, reason=str(error))
+            except CircuitOpen as error:
+                self.set_header('Retry-After', str(int(self.writer.breaker.retry_in()) + 1))
+                raise tornado.web.HTTPError(503, reason=str(error))
+            except Exception:
+                logger.exception("Saving a submission failed")
+                raise tornado.web.HTTPError(503, reason="Could not save the response, please retry")
+        self.set_status(202)
+        self.finish({'id': doc_id})
+
+
+class HealthHandler(JsonHandler):
+    """GET /healthz: writer queue and circuit state"""
+
+    def initialize(self, writer, allow_origin=None):
+        super().initialize(allow_origin)
+        self.writer = writer
+
+    def get(self):
+        self.finish(self.writer.stats())
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4')
+        self.finish(metrics.REGISTRY.render())
+
+
+def make_app(writer, defined, static_dir=None, allow_origin=None):
+    options = {'writer': writer, 'allow_origin': allow_origin}
+    routes = [
+        (r'/api/submit', SubmitHandler, {**options, 'defined': defined}),
+        (r'/healthz', HealthHandler, options),
+        (r'/metrics', MetricsHandler),
+    ]
+    if static_dir:
+        routes.append((r'/(.*)', tornado.web.StaticFileHandler,
+                       {'path': static_dir, 'default_filename': 'index.html'}))
+    return tornado.web.Application(routes)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Accept finished survey payloads over HTTP")
+    add_backend_arguments(parser)
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--static', help="also serve the static_site.py bundle from this directory")
+    parser.add_argument('--allow-origin', help="CORS origin allowed to POST (when the bundle is hosted elsewhere)")
+    parser.add_argument('--counter-shards', type=int, default=10, help="0 disables the sharded counters")
+    parser.add_argument('--studies', default=studies.STUDIES_PATH, help="study definitions (see studies.py)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    backend = InstrumentedBackend(backend_from_args(args))
+    counters = ShardedCounter(backend, args.collection, args.counter_shards) if args.counter_shards else None
+    writer = SubmissionWriter(backend, counters)
+    metrics.REGISTRY.register_gauges('survey_writer', writer.stats)
+    defined = studies.load(args.studies, args.collection)
+    register_studies(writer, defined, args.counter_shards)
+
+    app = make_app(writer, defined, args.static, args.allow_origin)
+    app.listen(args.port, args.host, max_body_size=MAX_BODY_BYTES)
+    logger.info("Accepting submissions on http://%s:%d/api/submit", args.host, args.port)
+    try:
+        tornado.ioloop.IOLoop.current().start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        writer.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
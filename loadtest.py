@@ -0,0 +1,222 @@
+"""Headless load test: drive simulated respondents through prompt_collector.py with AppTest.
+
+    python loadtest.py --respondents 200 --concurrency 20 --think-time 0.5
+
+Storage is stubbed with the in-memory backend (optionally with simulated write
+latency), so no Firebase credentials are needed.
+
+Every step goes through the app's own widgets, so each session writes what
+a real one does: the draft created on leaving the demographics step, an
+autosave per answered question and the final status flip. AppTest keeps the
+elements of the run before an st.rerun() in its element tree, and the next
+run fails on the widget state of those no longer rendered; they are left out
+of it, as a browser would (see skip_stale_widgets()).
+
+AppTest installs a process-wide runtime for each run, so runs in one
+process must not overlap: respondents take turns running the script, and
+--concurrency overlaps their think time and the background writer's storage
+round-trips rather than script execution. Step latencies are the runs alone.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from streamlit.testing.v1 import AppTest, element_tree
+
+from survey_content import DEMOGRAPHIC_CODES, TRANSLATIONS
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompt_collector.py")
+STEPS = ('start', 'consent', 'demographics', 'question', 'final_submit')
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def skip_stale_widgets():
+    """Leave widgets kept from before an st.rerun() out of AppTest's widget states
+
+    Their state is gone from the session, so collecting it raises KeyError.
+    """
+    get_widget_state = element_tree.get_widget_state
+    if getattr(get_widget_state, 'skips_stale', False):
+        return
+
+    def current_widget_state(node):
+        try:
+            return get_widget_state(node)
+        except KeyError:
+            return None
+
+    current_widget_state.skips_stale = True
+    element_tree.get_widget_state = current_widget_state
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MiB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class LoadTest:
+    """Runs respondent sessions and collects per-step rerun latencies"""
+
+    def __init__(self, think_time, timeout, language='ar'):
+        self.think_time = think_time
+        self.timeout = timeout
+        self.text = TRANSLATIONS[language]
+        self.latencies = {step: [] for step in STEPS}
+        self.completed = 0
+        self.errors = []
+        self._lock = threading.Lock()
+        # One AppTest run at a time (see the module docstring)
+        self._run_lock = threading.Lock()
+
+    def _think(self):
+        if self.think_time > 0:
+            time.sleep(random.uniform(0.5, 1.5) * self.think_time)
+
+    def _timed(self, step, action):
+        with self._run_lock:
+            started = time.perf_counter()
+            at = action()
+            elapsed = time.perf_counter() - started
+        with self._lock:
+            self.latencies[step].append(elapsed)
+        if at.exception:
+            raise RuntimeError(f"{step}: {at.exception[0].message}")
+        return at
+
+    def _click(self, at, label, step):
+        # Elements kept from before an st.rerun() follow the current ones
+        button = next(b for b in at.button if b.label == label)
+        return self._timed(step, lambda: button.click().run(timeout=self.timeout))
+
+    def respondent(self, number):
+        """Walk one respondent from consent to the final submit"""
+        try:
+            at = AppTest.from_file(APP_PATH, default_timeout=self.timeout)
+            at = self._timed('start', lambda: at.run())
+            self._think()
+            at = self._click(at, self.text['agree_button'], 'consent')
+            self._think()
+            for field, codes in DEMOGRAPHIC_CODES.items():
+                at.selectbox(key=f"demographic_{field}").set_value(random.choice(codes))
+            at = self._click(at, self.text['next'], 'demographics')
+            if at.session_state['draft_id'] is None:
+                raise RuntimeError("demographics: no draft was created")
+
+            questions = len(at.session_state['survey'])
+            for i in range(questions):
+                self._think()
+                at.text_area(key=f"prompt_text_{i}").input(f"load test prompt {number}-{i}")
+                if i < questions - 1:
+                    at = self._click(at, self.text['next'], 'question')
+                else:
+                    at = self._click(at, self.text['step_final'] + " →", 'question')
+
+            self._think()
+            at.text_area[0].input("load test suggestion")
+            at = self._click(at, self.text['submit'], 'final_submit')
+            if not at.session_state['submitted']:
+                raise RuntimeError("final_submit: session was not marked as submitted")
+        except Exception as e:
+            with self._lock:
+                self.errors.append(f"respondent {number}: {e}")
+            return
+        with self._lock:
+            self.completed += 1
+
+    def run(self, respondents, concurrency):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(self.respondent, range(respondents)))
+        return time.perf_counter() - started
+
+    def stored(self):
+        """Submitted responses in the app's storage once its writer has flushed"""
+        from aggregates import SUBMITTED
+        from resources import get_storage_backend, get_submission_writer
+
+        get_submission_writer().close()
+        return get_storage_backend().count([SUBMITTED])
+
+    def report(self, elapsed):
+        steps = {}
+        for step, values in self.latencies.items():
+            steps[step] = {
+                'count': len(values),
+                'p50_ms': percentile(values, 50) * 1000,
+                'p95_ms': percentile(values, 95) * 1000,
+                'p99_ms': percentile(values, 99) * 1000,
+                'mean_ms': statistics.fmean(values) * 1000 if values else 0.0,
+            }
+        return {
+            'completed': self.completed,
+            'stored': self.stored(),
+            'errors': len(self.errors),
+            'elapsed_seconds': elapsed,
+            'submissions_per_second': self.completed / elapsed if elapsed else 0.0,
+            'peak_rss_mb': peak_rss_mb(),
+            'steps': steps,
+        }
+
+
+def print_report(report):
+    print(f"completed sessions   {report['completed']} ({report['errors']} errors)")
+    print(f"stored submissions   {report['stored']}")
+    print(f"elapsed              {report['elapsed_seconds']:.1f} s")
+    print(f"submissions/second   {report['submissions_per_second']:.2f}")
+    print(f"peak RSS             {report['peak_rss_mb']:.1f} MiB")
+    print()
+    print(f"{'step':<14}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'mean ms':>10}")
+    for step, row in report['steps'].items():
+        print(f"{step:<14}{row['count']:>7}{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}"
+              f"{row['p99_ms']:>10.1f}{row['mean_ms']:>10.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--respondents', type=int, default=20, help="sessions to simulate")
+    parser.add_argument('--concurrency', type=int, default=5, help="sessions running at once")
+    parser.add_argument('--think-time', type=float, default=0.0,
+                        help="mean pause between clicks, in seconds")
+    parser.add_argument('--write-latency', type=float, default=0.0,
+                        help="simulated storage round-trip per batch, in seconds")
+    parser.add_argument('--timeout', type=float, default=30.0, help="per-rerun timeout in seconds")
+    parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    # Read by get_storage_config() inside the app
+    os.environ['SURVEY_STORAGE_BACKEND'] = 'memory'
+    os.environ['SURVEY_STORAGE_LATENCY'] = str(args.write_latency)
+
+    skip_stale_widgets()
+    test = LoadTest(args.think_time, args.timeout)
+    elapsed = test.run(args.respondents, args.concurrency)
+    report = test.report(elapsed)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    for error in test.errors[:10]:
+        print(error, file=sys.stderr)
+    return 1 if test.errors or report['stored'] != test.completed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,139 @@
+import hmac
+import time
+
+import pandas as pd
+import streamlit as st
+
+from resources import get_aggregates, get_search_index, get_studies, get_study, secrets_section
+from survey_content import DEMOGRAPHIC_CODES
+
+st.set_page_config(
+    page_title="Research Dashboard",
+    page_icon="📊",
+    layout="wide",
+    initial_sidebar_state="collapsed"
+)
+
+
+def check_password():
+    """Gate the page behind the [dashboard] password in st.secrets"""
+    expected = secrets_section("dashboard").get("password")
+    if not expected:
+        st.error("Set a password in the [dashboard] section of secrets.toml to enable this page.")
+        return False
+    if st.session_state.get('dashboard_unlocked'):
+        return True
+    password = st.text_input("Password", type="password")
+    if password and hmac.compare_digest(password, expected):
+        st.session_state.dashboard_unlocked = True
+        st.rerun()
+    return False
+
+
+def select_study():
+    """The study named by ?study= (the default one without it), switchable when there are several"""
+    studies = list(get_studies())
+    try:
+        study = get_study(st.query_params.get('study'))
+    except KeyError:
+        st.error(f"Unknown study: {st.query_params.get('study')}")
+        st.stop()
+    if len(studies) > 1:
+        ids = [candidate.id for candidate in studies]
+        chosen = st.selectbox("Study", ids, index=ids.index(study.id))
+        if chosen != study.id:
+            st.query_params['study'] = chosen
+            st.rerun()
+    return study
+
+
+def show_dashboard():
+    study = select_study()
+    snapshot = study.content
+    # Labels in English where the study has it
+    label_language = 'en' if 'en' in snapshot.languages else study.languages[0]
+    texts = snapshot.translations[label_language]
+    aggregates = get_aggregates(study.id)
+    _, col2 = st.columns([6, 1])
+    with col2:
+        refresh = st.button("Refresh")
+    counts, age = aggregates.snapshot(force=refresh)
+
+    st.title("📊 Research Dashboard")
+    source = "the sharded counters" if aggregates.counters is not None else "aggregation queries"
+    st.caption(f"Counts from {source} {age:.0f} s ago plus live submissions since "
+               f"(refreshed every {aggregates.ttl:.0f} s). Responses stored before schema "
+               f"version 2 are not broken down by question.")
+
+    total = counts['submissions']
+    columns = st.columns(1 + len(study.languages))
+    columns[0].metric("Submitted responses", total)
+    for column, language in zip(columns[1:], study.languages):
+        column.metric(f"Language: {language}", counts[f'language.{language}'])
+
+    st.subheader("Questions")
+    rows = []
+    for index in range(len(snapshot.questions)):
+        shown = counts[f'question.{index}.shown']
+        answered = counts[f'question.{index}.answered']
+        rows.append({
+            'index': index,
+            'question': snapshot.questions.text(index, label_language),
+            'shown': shown,
+            'answered': answered,
+            'skip rate': (shown - answered) / shown if shown else None,
+        })
+    questions = pd.DataFrame(rows).set_index('index')
+    st.bar_chart(questions['answered'])
+    st.dataframe(
+        questions,
+        use_container_width=True,
+        column_config={'skip rate': st.column_config.NumberColumn(format="percent")},
+    )
+
+    st.subheader("Demographics")
+    for column, (field, codes) in zip(st.columns(len(DEMOGRAPHIC_CODES)), DEMOGRAPHIC_CODES.items()):
+        with column:
+            st.markdown(f"**{field.title()}**")
+            distribution = pd.Series(
+                {texts[f'option.{field}.{code}']: counts[f'demographics.{field}.{code}'] for code in codes}
+            )
+            st.bar_chart(distribution)
+
+    show_search(study, label_language)
+
+
+def show_search(study, label_language):
+    st.subheader("Search answers")
+    if study.collection:
+        st.caption(f"The search index covers the storage backend's own collection; this study's responses "
+                   f"are in {study.collection}.")
+        return
+    snapshot = study.content
+    index = get_search_index()
+    if index is None:
+        st.caption("Run `python search.py --update` to build the search index.")
+        return
+    with st.form("search"):
+        col1, col2, col3 = st.columns([3, 1, 2])
+        query = col1.text_input("Words (an answer must contain all of them)")
+        language = col2.selectbox("Language", [None, *study.languages], format_func=lambda code: code or "all")
+        question = col3.selectbox(
+            "Question", [None, *range(len(snapshot.questions))],
+            format_func=lambda index: "all" if index is None else
+            f"{index}: {snapshot.questions.text(index, label_language)}",
+        )
+        st.form_submit_button("Search")
+    if not query and question is None:
+        return
+    started = time.perf_counter()
+    total, hits = index.search(query, language, question, limit=200)
+    elapsed = (time.perf_counter() - started) * 1000
+    st.caption(f"{total} matching answers in {elapsed:.0f} ms; the newest {len(hits)} are shown. "
+               f"The index covers responses up to the last `search.py --update`.")
+    if hits:
+        st.dataframe(pd.DataFrame(hits).drop(columns='number'), use_container_width=True, hide_index=True)
+
+
+if check_password():
+    show_dashboard()
@@ -1,670 +1,311 @@
 import streamlit as st
-import json
 from datetime import datetime
-import hashlib
-import random
-import os
-import firebase_admin
-from firebase_admin import credentials, firestore
-
-# Initialize Firebase
-if not firebase_admin._apps:
-    cred = credentials.Certificate(dict(st.secrets["firebase"]))
-
-    firebase_admin.initialize_app(cred)
-
-db = firestore.client()
+import uuid
+import logging
+import i18n
+import metrics
+import render
+import scan
+import schema
+import session_store
+from aggregates import summarize
+from resources import (
+    get_aggregates,
+    get_question_scheduler,
+    get_session_store,
+    get_study,
+    get_stylesheet_loader,
+    get_submission_writer,
+    start_metrics_reporting,
+    start_content_watch,
+    start_storage_warmup,
+    warm_render_cache,
+)
+from submissions import submit_document
+from survey_content import DEMOGRAPHIC_CODES
+from survey_session import SurveySession
+
+logger = logging.getLogger(__name__)
+
+# Tracked by this script besides the survey; saved to the session store with it
+SESSION_FIELDS = ('study_id', 'language', 'step', 'current_question', 'consent_given', 'submission_token',
+                  'draft_id', 'submitted', 'counted_token')
+
+def restore_session():
+    """Continue the session saved under the URL's resume token, or give this session a new token"""
+    store = get_session_store()
+    st.session_state.resume_token = None
+    if store is None:
+        return
+    token = st.query_params.get('resume')
+    state = None
+    if session_store.valid_token(token):
+        try:
+            state = store.load(token)
+        except Exception:
+            logger.exception("Session store read failed; starting a new session")
+    survey = None
+    # A submitted session whose delete failed is not continued either
+    if state and not state.get('submitted'):
+        try:
+            study = get_study(state.get('study_id'))
+            survey = SurveySession.from_state(state, study.content)
+        except KeyError:
+            # A study this deployment no longer runs
+            survey = None
+    if survey is None:
+        token = session_store.new_token()
+        st.query_params['resume'] = token
+    else:
+        st.session_state.survey = survey
+        for field in SESSION_FIELDS:
+            if field in state:
+                st.session_state[field] = state[field]
+        # Only what changes from here on is written back
+        st.session_state.persisted_state = state
+    st.session_state.resume_token = token
+
+def persist_session():
+    """Write the fields that changed since the last save to the session store"""
+    token = st.session_state.get('resume_token')
+    if token is None:
+        return
+    state = {field: st.session_state[field] for field in SESSION_FIELDS}
+    state.update(st.session_state.survey.to_state())
+    # The copy shares the answer strings with the survey, so it costs little memory
+    persisted = st.session_state.get('persisted_state', {})
+    delta = {field: value for field, value in state.items() if field not in persisted or persisted[field] != value}
+    if not delta:
+        return
+    try:
+        get_session_store().save(token, delta)
+        st.session_state.persisted_state = state
+    except Exception:
+        # The next run sends the same delta again
+        logger.exception("Session store write failed")
+
+def end_session():
+    """Forget the stored session after its submit and put a fresh resume token in the URL
+
+    Reopening the old link then starts a new survey instead of the submitted one.
+    """
+    token = st.session_state.get('resume_token')
+    if token is None:
+        return
+    store = get_session_store()
+    try:
+        # Marked first, so restore_session() refuses it should the delete fail
+        store.save(token, {'submitted': True})
+        store.delete(token)
+    except Exception:
+        logger.exception("Session store delete failed")
+    st.query_params['resume'] = session_store.new_token()
+    # Nothing after the thank-you screen needs saving
+    st.session_state.resume_token = None
+    st.session_state.persisted_state = {}
+
+if 'resume_token' not in st.session_state:
+    restore_session()
+
+# A resumed session keeps its study; new ones take ?study= from the URL (default study without it)
+if 'study_id' not in st.session_state:
+    try:
+        st.session_state.study_id = get_study(st.query_params.get('study')).id
+    except KeyError:
+        # In the default study's first language: the link does not say which study's to use
+        fallback = get_study()
+        catalog = i18n.catalog(fallback.content.version)
+        language = fallback.languages[0]
+        st.set_page_config(page_title=catalog.text(language, 'page_title'), page_icon="🤖", layout="wide",
+                           initial_sidebar_state="collapsed")
+        st.error(catalog.text(language, 'unknown_study', study=st.query_params.get('study')))
+        st.stop()
+study = get_study(st.session_state.study_id)
 
 # Page configuration
 st.set_page_config(
-    page_title="Chatbot Prompt Research Study",
+    page_title=i18n.catalog(study.content.version).text(
+        st.session_state.get('language', study.languages[0]), 'page_title'),
     page_icon="🤖",
     layout="wide",
     initial_sidebar_state="collapsed"
 )
 
-# Custom CSS for better styling
-st.markdown("""
-<style>
-    .main-header {
-        text-align: center;
-        padding: 2rem 0;
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        color: white;
-        border-radius: 10px;
-        margin-bottom: 2rem;
-    }
-    
-    .creative-progress {
-        position: relative;
-        margin: 2rem auto;
-        padding: 2rem;
-        max-width: 900px;
-        background: linear-gradient(135deg, #f5f7fa 0%, #c3cfe2 100%);
-        border-radius: 20px;
-    }
-    
-    .progress-dots {
-        display: flex; 
-        justify-content: space-between;
-        align-items: center;
-        gap: 100px;
-        margin: 2rem 0;
-        position: relative;
-        padding: 0 20px;
-    }
-    
-    .progress-line {
-        position: absolute;
-        top: 50%;
-        left: 60px;
-        right: 60px;
-        height: 4px;
-        background: #e0e0e0;
-        z-index: 0;
-        transform: translateY(-50%);
-        border-radius: 2px;
-    }
-    
-    .progress-line-fill {
-        height: 100%;
-        background: linear-gradient(90deg, #667eea 0%, #764ba2 100%);
-        transition: width 0.5s ease;
-        border-radius: 2px;
-    }
-    
-    .dot-container {
-        display: inine-flex;
-        position: relative;
-        flex-direction: column;
-        align-items: center;
-        z-index: 1;
-    }
-    
-    /*
-    .dot-container:not(:last-child)::after {
-        content: "";
-        position: absolute;
-        top: 22px;
-        left: 60px;              
-        width: 150px;            
-        height: 4px;
-        background: #e0e0e0;
-        z-index: 0;
-    }
-    
-    .dot-container.completed::after {
-        background: linear-gradient(90deg, #667eea, #764ba2);
-    }
-    */
-    
-    .dot {
-        width: 45px;
-        height: 45px;
-        border-radius: 50%;
-        background: white;
-        border: 4px solid #e0e0e0;
-        display: flex;
-        align-items: center;
-        justify-content: center;
-        font-weight: bold;
-        transition: all 0.3s ease;
-        position: relative;
-        margin-bottom: 0.5rem;
-    }
-    
-    .dot.completed {
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        border-color: #667eea;
-        color: white;
-        transform: scale(1.1)
-    }
-    
-    .dot.active {
-        background: white;
-        border-color: #667eea;
-        outline: 4px solid rgba(102, 126, 234, 0.2);
-        outline-offset: 0;
-        color: #667eea;
-        transform: scale(1.2);
-        box-shadow: 0 0 0 4px rgba(102, 126, 234, 0.2);
-    }
-    
-    .dot-label {
-        font-size: 0.75rem;
-        font-weight: 600;
-        text-align: center;
-        color: #666;
-        white-space: nowrap;
-    }
-    
-    .dot-label.completed {
-        color: #667eea;
-    }
-    
-    .dot-label.active {
-        color: #667eea;
-        font-weight: 700;
-    }
-    
-    .question-card {
-        background: white;
-        padding: 2.5rem;
-        border-radius: 15px;
-        box-shadow: 0 10px 40px rgba(0,0,0,0.1);
-        margin: 2rem 0;
-        border-left: 5px solid #667eea;
-    }
-    
-    .scenario-text {
-        font-size: 1.3rem;
-        font-weight: 500;
-        color: #333;
-        line-height: 1.8;
-        margin: 1.5rem 0;
-        padding: 1.5rem;
-        background: linear-gradient(135deg, #667eea15 0%, #764ba215 100%);
-        border-radius: 10px;
-        border-left: 4px solid #667eea;
-    }
-    
-    .privacy-notice {
-        background: #ffffff;
-        padding: 2rem;
-        border-radius: 10px;
-        margin: 2rem 0;
-        box-shadow: 0 2px 8px rgba(0,0,0,0.05);
-    }
-    
-    .privacy-notice p {
-        font-size: 1.1rem;
-        line-height: 1.8;
-        color: #333;
-        margin: 1rem 0;
-    }
-    
-    .privacy-notice ul {
-        font-size: 1.05rem;
-        line-height: 1.8;
-        color: #333;
-    }
-    
-    .language-switcher {
-        position: fixed;
-        top: 1rem;
-        right: 1rem;
-        z-index: 1000;
-    }
-    
-    .stTextArea textarea {
-        font-size: 16px;
-        border-radius: 10px;
-        border: 2px solid #e0e0e0;
-    }
-    
-    .stTextArea textarea:focus {
-        border-color: #667eea;
-        box-shadow: 0 0 0 2px rgba(102, 126, 234, 0.2);
-    }
-    
-    .step-title {
-        text-align: center;
-        color: #667eea;
-        font-size: 1.1rem;
-        margin-bottom: 0.5rem;
-        font-weight: 600;
-    }
-    
-    .question-counter {
-        text-align: center;
-        font-size: 2rem;
-        font-weight: bold;
-        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-        -webkit-background-clip: text;
-        -webkit-text-fill-color: transparent;
-        margin: 1rem 0;
-    }
-</style>
-""", unsafe_allow_html=True)
-
-# Question Bank - 50 questions in English and Arabic
-QUESTION_BANK = [
-    {
-        'en': 'What was the last thing you asked AI to help you with? Write the exact prompt if you remember it.',
-        'ar': 'ما هو آخر شيء طلبت من الذكاء الاصطناعي مساعدتك فيه؟اكتب الأمر كما تتذكره.'
-    },
-    {
-        'en': 'Ask AI to help you write a CV. Include your background, skills, and the type of job you’re targeting. Write the exact prompt you would type.',
-        'ar': 'اطلب من الذكاء الاصطناعي مساعدتك في كتابة سيرة ذاتية. اذكر خلفيتك ومهاراتك ونوع الوظيفة المطلوبة. اكتب النص كما سترسله.'
-    },
-    {
-        'en': 'Ask AI to write a professional email for you. Include who you are writing to and why.',
-        'ar': 'اطلب من الذكاء الاصطناعي كتابة بريد إلكتروني احترافي لك.، مع ذكر الجهة التي تراسلها والسبب'
-    },
-    {
-        'en': 'Ask AI to help you introduce yourself to someone new.',
-        'ar': 'اطلب من الذكاء الاصطناعي مساعدتك في تقديم نفسك لشخص جديد.'
-    },
-    {
-        'en': 'Complain to AI about something that annoyed you recently.',
-        'ar': 'اشتكِ للذكاء الاصطناعي من شيء أزعجك مؤخراً.'
-    },
-    {
-        'en': 'Discuss with AI a social issue that you want to understand better.',
-        'ar': 'ناقش مع الذكاء الاصطناعي قضية اجتماعية تهمك وتريد فهمه بشكل أفضل.'
-    },
-    {
-        'en': "Ask AI a question you've always been curious about but never asked anyone.",
-        'ar': 'اسأل الذكاء الاصطناعي سؤالاً كنت دائماً فضولياً بشأنه لكن لم تسأل أحداً عنه.'
-    },
-    {
-        'en': "You’re having a stressful or overwhelming day. Tell AI what’s going on and ask for support or advice.",
-        'ar': 'تمر بيوم مرهق أو صعب. أخبر الذكاء الاصطناعي بما يحدث واطلب الدعم أو النصيحة.'
-    },
-    {
-        'en': 'Ask AI to help you respond to someone who upset or offended you. Include what happened.',
-        'ar': 'اطلب من الذكاء الاصطناعي مساعدتك في في الرد على شخص أزعجك أو أساء إليك، واذكر ما حدث.'
-    },
-    {
-        'en': 'Ask AI to help you fill out an application form. Mention what the form is for.',
-        'ar': 'اطلب من الذكاء الاصطناعي مساعدتك في ملء استمارة طلب، واذكر نوعها.'
-    },
-    {
-        'en': "Ask AI something you saw online that you're not sure is true. Include what you saw.",
-        'ar': 'اسأل الذكاء الاصطناعي عن شيء رأيته في مواقع التواصل الاجتماعي ولست متأكداً من صحته، واذكر ما رأيت.'
-    },
-    {
-        'en': 'Ask AI to help you book an appointment somewhere. Add details about what it is for, where, your preferred date etc.',
-        'ar': 'اطلب من الذكاء الاصطناعي مساعدتك في حجز موعد في مكان ما. أضف تفاصيل حول الغرض من الموعد، والمكان، والتاريخ الي تفضله، وما إلى ذلك.'
-    },
-    {
-        'en': "Tell AI about a problem you're currently facing and ask for help solving it. Include enough context so AI understands the situation.",
-        'ar': 'أخبر الذكاء الاصطناعي عن مشكلة تواجهها واطلب المساعدة، مع إعطاء معلومات كافية لفهم الموقف.'
-    },
-    {
-        'en': 'Ask AI to explain something you disagree with most people about.',
-        'ar': 'اطلب من الذكاء الاصطناعي شرح شيء تختلف مع معظم الناس بشأنه.'
-    },
-    {
-        'en': "Ask AI to write a review for a place or product you didn't like.",
-        'ar': 'اطلب من الذكاء الاصطناعي كتابة مراجعة لمكان أو منتج لم يعجبك.'
-    },
-    {
-        'en': 'Ask AI for advice about a conflict or a difficult conversation you need to have.',
-        'ar': 'اطلب من الذكاء الاصطناعي نصيحة حول خلاف أو محادثة صعبة تحتاج لإجرائها.'
-    },
-    {
-        'en': "You're angry at someone. Tell AI what happened, how you feel and what to do next.",
-        'ar': 'أنت غاضب من شخص ما، أخبر الذكاء الاصطناعي بما حدث وكيف تشعر وما الذي تريد فعله بعد ذلك.'
-    },
-    {
-        'en': 'Ask AI to help you report something that went wrong.',
-        'ar': 'اطلب من الذكاء الاصطناعي مساعدتك في الإبلاغ عن شيء حدث خطأ.'
-    },
-    {
-        'en': "Ask AI a question about a group of people you don't understand.",
-        'ar': 'اسأل الذكاء الاصطناعي سؤالاً عن مجموعة من الناس لا تفهمهم.'
-    },
-    {
-        'en': 'Ask AI to help you write a message to your doctor. Include what the message is about and what you want to ask or say.',
-        'ar': 'اطلب من الذكاء الاصطناعي مساعدتك في كتابة رسالة لطبيبك، مع ذكر موضوع الرسالة وما الذي تريد سؤاله أو قوله'
-    },
-    {
-        'en': 'Ask AI to help you respond to someone who was rude to you.',
-        'ar': 'اطلب من الذكاء الاصطناعي مساعدتك في الرد على شخص كان وقحاً معك.'
-    },
-    {
-        'en': 'Ask AI to write a letter to someone important (bank, school, government, etc.). Explain what you want to say.',
-        'ar': 'اطلب من الذكاء الاصطناعي كتابة رسالة لشخص مهم (بنك، مدرسة، حكومة، إلخ). اشرح ما تريد قوله.'
-    },
-    {
-        'en': 'Ask AI about a topic that most people find controversial.',
-        'ar': 'اسأل الذكاء الاصطناعي عن موضوع يجده معظم الناس مثيراً للجدل.'
-    },
-    {
-        'en': 'You feel like nobody understands you, tell AI about it.',
-        'ar': 'تشعر أن لا أحد يفهمك، أخبر الذكاء الاصطناعي عن ذلك.'
-    },
-    {
-        'en': 'Ask AI to help you express your frustration about something.',
-        'ar': 'اطلب من الذكاء الاصطناعي مساعدتك في التعبير عن إحباطك من شيء ما.'
-    },
-    {
-        'en': 'Ask AI to explain why some things in life seem unfair.',
-        'ar': 'اسأل الذكاء الاصطناعي لماذا تبدو بعض الأشياء في الحياة غير عادلة.'
-    },
-    {
-        'en': 'Ask AI to help you create a profile for a website or app. Include what you would normally add to your profile.',
-        'ar': 'اطلب من الذكاء الاصطناعي مساعدتك في إنشاء ملف شخصي لموقع ويب أو تطبيق، مع ذكر ما تضيفه عادةً في ملفك الشخصي.'
-    },
-    {
-        'en': "Ask AI something you'd be embarrassed to ask a real person.",
-        'ar': 'اسأل الذكاء الاصطناعي شيئاً ستشعر بالحرج من سؤال شخص حقيقي عنه.'
-    },
-    {
-        'en': 'You want to share a post on social media. Ask AI to write something to post about how you feel today.',
-        'ar': 'تريد مشاركة منشور على وسائل التواصل الاجتماعي. اطلب من الذكاء الاصطناعي كتابة شيء عن شعورك اليوم.'
-    },
-    {
-        'en': 'Ask AI to help you with a government or official document. Include what type of document it is and what you need help with.',
-        'ar': 'اطلب من الذكاء الاصطناعي مساعدتك في وثيقة حكومية أو رسمية، مع ذكر نوع الوثيقة وما تحتاج المساعدة فيه.'
-    },
-    {
-        'en': 'Tell AI about a time you felt really hurt and ask what you should have done.',
-        'ar': 'أخبر الذكاء الاصطناعي عن مرة شعرت فيها بالأذى الشديد واسأل عما كان يجب عليك فعله.'
-    },
-    {
-        'en': 'Ask AI to help you get revenge on someone (just kidding... or are you?)',
-        'ar': 'اطلب من الذكاء الاصطناعي مساعدتك في الانتقام من شخص ما (مجرد مزاح... أو أنت جاد؟)'
-    },
-    {
-        'en': 'Tell AI about something you read on social media that shocked you.',
-        'ar': 'أخبر الذكاء الاصطناعي عن شيء قرأته على وسائل التواصل الاجتماعي صدمك.'
-    },
-    {
-        'en': 'Ask AI to help you write a complaint about a service, product, or experience. Explain what happened.',
-        'ar': 'اطلب من الذكاء الاصطناعي مساعدتك في كتابة شكوى حول خدمة أو منتج أو تجربة، اشرح ما حدث.'
-    },
-    {
-        'en': 'Ask AI to help you contact your bank about something. Describe the issue and what you want to ask or do.',
-        'ar': 'اطلب من الذكاء الاصطناعي مساعدتك في الاتصال بالبنك بشأن شيء ما. قم بوصف المشكلة وما الذي تريد سؤاله أو فعله.'
-    },
-    {
-        'en': 'Ask AI about a belief you have that most people would disagree with.',
-        'ar': 'اسأل الذكاء الاصطناعي عن اعتقاد لديك سيختلف معه معظم الناس.'
-    },
-    {
-        'en': 'Ask AI to help you prepare for an important meeting or interview. Describe what it’s for.',
-        'ar': 'اطلب من الذكاء الاصطناعي مساعدتك في الاستعداد لاجتماع أو مقابلة مهمة، صف السياق.'
-    },
-    {
-        'en': "Ask AI to explain something that you disagree with or find confusing about society.",
-        'ar': 'اطلب من الذكاء الاصطناعي شرح شيء لا تتفق معه أو تجده محيرًا في المجتمع.'
-    },
-    {
-        'en': 'Ask AI to help you share your travel plans with someone. Say where you’re going and why.',
-        'ar': 'اطلب من الذكاء الاصطناعي مساعدتك في مشاركة خطط سفرك مع شخص ما. اذكر الوجهة وسبب الرحلة.'
-    },
-    {
-        'en': 'Ask AI the most random question you can think of right now.',
-        'ar': 'اسأل الذكاء الاصطناعي أكثر سؤال عشوائي يمكنك التفكير فيه الآن.'
-    },
-    {
-        'en': "Ask AI to help you write a message to someone you've lost touch with.",
-        'ar': 'اطلب من الذكاء الاصطناعي مساعدتك في كتابة رسالة لشخص فقدت التواصل معه.'
-    },
-    {
-        'en': 'Ask AI about something that makes you really angry when you think about it.',
-        'ar': 'اسأل الذكاء الاصطناعي عن شيء يجعلك غاضباً حقاً عندما تفكر فيه.'
-    },
-    {
-        'en': 'Ask AI to help you deal with someone who treats you unfairly.',
-        'ar': 'اطلب من الذكاء الاصطناعي مساعدتك في التعامل مع شخص يعاملك بشكل غير عادل.'
-    },
-    {
-        'en': 'What would you ask AI if no one was watching?',
-        'ar': 'ماذا ستسأل الذكاء الاصطناعي لو لم يكن أحد يراقب؟'
-    }
-]
-
-# Translations
-TRANSLATIONS = {
-    'en': {
-        'title': '🤖 Chatbot Prompt Research Study',
-        'consent_header': '📋 Research Information & Consent',
-        'consent_text': '''
-Welcome to our research study! This questionnaire is part of an ongoing project to improve AI chatbots.
-Try to be as realistic as you can when answering the questions and click on "Submit All Responses" at the end to save your answers.
-
-**Your Privacy is Our Priority:**
-
-- All responses are completely anonymous
-
-- No personal identifying information is collected
-
-- Data will be used only for academic research
-
-- Responses are not stored with any user identifiers
-
-- You can skip any question you're uncomfortable answering
-
-- Your data will help make AI chatbots safer for everyone
-
-
-**Time Required:** Approximately 10-15 minutes
-
-**What to expect:** You'll be shown 10 randomly selected scenarios. For each one, write what you would actually say to an AI chatbot in that situation.
-
-By clicking "I Agree to Participate", you confirm that you understand the purpose of this research, consent to participate voluntarily, and understand your responses are anonymous.
-        ''',
-        'agree_button': '✓ I Agree to Participate',
-        'demographics_header': '👤 Background Information (Optional)',
-        'age_group': 'Age Group',
-        'education': 'Education Level',
-        'chatbot_experience': 'How often do you use AI chatbots?',
-        'prompts_header': 'Your Chatbot Prompts',
-        'scenario': 'Scenario',
-        'your_prompt': 'What would you type to AI?',
-        'contains_private': 'Contains private/personal information',
-        'contains_toxic': 'Contains toxic/harmful content',
-        'final_header': '🎯 Final Questions (Optional)',
-        'suggestions': 'Any suggestions for a chatbot safety scanner?',
-        'submit': '📤 Submit All Responses',
-        'thank_you': '🎉 Thank You!',
-        'thank_you_message': 'Your responses have been recorded. Thank you for contributing to safer AI!',
-        'progress': 'Progress',
-        'step_consent': 'Consent',
-        'step_background': 'Background',
-        'step_prompts': 'Questions',
-        'step_final': 'Final',
-        'step_complete': 'Complete',
-        'next': 'Next Question →',
-        'previous': '← Previous',
-        'skip': 'Skip this question',
-        'optional': '(Optional)',
-        'question_of': 'Question {current} of {total}',
-    },
-    'ar': {
-        'title': '🤖 دراسة بحثية حول محادثات الذكاء الاصطناعي',
-        'consent_header': '📋 معلومات البحث والموافقة',
-        'consent_text': '''
-مرحباً بك في دراستنا البحثية! هذا الاستبيان جزء من مشروع لتطوير المحادثات مع الذكاء الاصطناعي
-.حاول أن تكون واقعيًا قدر الإمكان عند الإجابة على الأسئلة، ثم اضغط على "إرسال جميع الإجابات" عند الانتهاء لحفظ إجاباتك
-
-**:خصوصيتك أولويتنا**
-
-- جميع الإجابات مجهولة الهوية تماماً
-
-- لا يتم جمع أي معلومات تعريفية شخصية
-
-- ستُستخدم البيانات للبحث الأكاديمي فقط
-
-- الإجابات لن تُخزن مع أي معرّفات للمستخدم
-
-- يمكنك تخطي أي سؤال لا ترغب في الإجابة عليه
-
-- بياناتك ستساعد في جعل الذكاء الاصطناعي أكثر أماناً للجميع
-
-
-الوقت المطلوب:** حوالي 10-15 دقيقة**
-
-.ما يمكن توقعه:** سيتم عرض 10 سيناريوهات مختارة عشوائياً. لكل سيناريو، اكتب ما ستقوله فعلياً لروبوت المحادثة بالذكاء الاصطناعي في هذا الموقف**
-
-.بالنقر على "أوافق على المشاركة"، فإنك تؤكد أنك تفهم الغرض من هذا البحث، وتوافق على المشاركة طوعاً، وتدرك أن إجاباتك مجهولة الهوية
-        ''',
-        'agree_button': '✓ أوافق على المشاركة',
-        'demographics_header': '👤 معلومات أساسية (اختيارية)',
-        'age_group': 'الفئة العمرية',
-        'education': 'المستوى التعليمي',
-        'chatbot_experience': 'كم مرة تستخدم روبوتات المحادثة بالذكاء الاصطناعي؟',
-        'prompts_header': 'محادثاتك مع الذكاء الاصطناعي',
-        'scenario': 'السيناريو',
-        'your_prompt': 'ماذا ستكتب للذكاء الاصطناعي؟',
-        'contains_private': 'يحتوي على معلومات خاصة/شخصية',
-        'contains_toxic': 'يحتوي على محتوى سام/ضار',
-        'final_header': '🎯 أسئلة ختامية',
-        'suggestions': 'أي اقتراحات لأداة فحص أمان روبوتات المحادثة بالذكاء الاصطناعي؟',
-        'submit': '📤 إرسال جميع الإجابات',
-        'thank_you': '🎉! شكراً لك',
-        'thank_you_message': '!تم تسجيل إجاباتك. شكراً لمساهمتك في جعل الذكاء الاصطناعي أكثر أماناً',
-        'progress': 'التقدم',
-        'step_consent': 'الموافقة',
-        'step_background': 'معلومات أساسية',
-        'step_prompts': 'أسئلة',
-        'step_final': 'الختام',
-        'step_complete': 'إنهاء',
-        'next': 'السؤال التالي ←',
-        'previous': '→ السابق',
-        'skip': 'تخطي هذا السؤال',
-        'optional': '(اختياري)',
-        'question_of': 'السؤال {current} من {total}',
-    }
-}
+# The CSS itself is fetched once from app/static/ and cached by the browser (see assets.py);
+# the first run also sends it inline in case that fetch fails
+st.html(get_stylesheet_loader(fallback='stylesheet_sent' not in st.session_state), unsafe_allow_javascript=True)
+st.session_state.stylesheet_sent = True
 
 # Initialize session state
 if 'language' not in st.session_state:
-    st.session_state.language = 'ar'
+    st.session_state.language = study.languages[0]
 if 'step' not in st.session_state:
     st.session_state.step = 0
 if 'current_question' not in st.session_state:
     st.session_state.current_question = 0
 if 'consent_given' not in st.session_state:
     st.session_state.consent_given = False
-if 'selected_questions' not in st.session_state:
-    # Always include the first and last questions
-    first_question = [QUESTION_BANK[0]]
-    last_question = [QUESTION_BANK[-1]]
-    
-    # Pick 8 random questions from the rest (excluding first and last)
-    random_questions = random.sample(QUESTION_BANK[1:-1], 8)
-    # Combine them
-    st.session_state.selected_questions = first_question + random_questions + last_question
-if 'responses' not in st.session_state:
-    st.session_state.responses = [{'text': ''} for _ in range(10)]
+if 'survey' not in st.session_state:
+    # Always include the study's pinned first and last questions
+    first_questions, last_questions = study.pinned()
+    
+    # Pick the rest from the other questions, favouring under-answered ones
+    random_questions = get_question_scheduler(study.id).pick(study.picks)
+    # Questions (as question bank indices), answers and demographics in one compact object
+    st.session_state.survey = SurveySession(first_questions + random_questions + last_questions,
+                                            study.content.version)
+if 'submission_token' not in st.session_state:
+    # Random per-session ID: names the response document and makes its submission idempotent
+    st.session_state.submission_token = uuid.uuid4().hex
+if 'draft_id' not in st.session_state:
+    st.session_state.draft_id = None
 if 'submitted' not in st.session_state:
     st.session_state.submitted = False
-if "demographics" not in st.session_state:
-    st.session_state.demographics = {
-        "age": None,
-        "education": None,
-        "experience": None
-    }
+if 'counted_token' not in st.session_state:
+    # The submission token whose counts were added to the live dashboard counts
+    st.session_state.counted_token = None
 
 def get_text(key, **kwargs):
     """Get translated text with formatting"""
-    text = TRANSLATIONS[st.session_state.language][key]
-    if kwargs:
-        return text.format(**kwargs)
-    return text
+    catalog = i18n.catalog(st.session_state.survey.content_version)
+    return catalog.text(st.session_state.language, key, **kwargs)
+
+def next_language():
+    """The language the switcher moves to: the next one the study offers"""
+    languages = study.languages
+    return languages[(languages.index(st.session_state.language) + 1) % len(languages)]
 
 def switch_language():
     """Toggle language"""
-    st.session_state.language = 'ar' if st.session_state.language == 'en' else 'en'
+    st.session_state.language = next_language()
 
+@metrics.timed()
 def progress_bar(current_step, total_steps, substep=0, total_substeps=0):
     """Create a creative visual progress indicator with horizontal dots and connecting lines"""
-    
-    # Calculate overall progress
-    if total_substeps > 0:
-        step_progress = (current_step + (substep / total_substeps)) / total_steps
-    else:
-        step_progress = current_step / total_steps
-    
-    progress_percent = int(step_progress * 100)
-    
-    # Create the progress visualization
-    st.markdown(f"""
-    <div class="creative-progress">
-        <div class="step-title">{get_text('progress')}</div>
-        <div class="question-counter">{progress_percent}%</div>
-        <div class="progress-dots">
-            <div class="progress-line">
-                <div class="progress-line-fill" style="width: {progress_percent}%;"></div>
-            </div>
-        </div>
-    """, unsafe_allow_html=True)
-    
-    # Create step dots
-    steps = [
-        get_text('step_consent'),
-        get_text('step_background'),
-        get_text('step_prompts'),
-        get_text('step_final'),
-        get_text('step_complete')
-    ]
-    
-    dots_html = '<div class="progress-dots">'
-    for i in range(len(steps)):
-        if i < current_step:
-            dot_class = "dot completed"
-            label_class = "dot-label completed"
-            icon = "★"
-        elif i == current_step:
-            dot_class = "dot active"
-            label_class = "dot-label active"
-            # For prompts step, show current question number
-            if i == 2 and total_substeps > 0:
-                icon = str(substep + 1)
-            else:
-                icon = "●"
-        else:
-            dot_class = "dot"
-            label_class = "dot-label"
-            icon = ""
-        
-        dots_html += f"""
-<div class="dot-container">
-    <div class="{dot_class}">{icon}</div>
-    <div class="{label_class}">{steps[i]}</div>
-</div>
-        """
-    
-    st.markdown(dots_html + """
-</div>
-</div>
-    """, unsafe_allow_html=True)
-
-def save_response(data):
-    """Save response to Firestore (anonymized)"""
+    head_html, dots_html = render.progress_html(
+        st.session_state.language, st.session_state.survey.content_version,
+        current_step, total_steps, substep, total_substeps
+    )
+    st.markdown(head_html, unsafe_allow_html=True)
+    st.markdown(dots_html, unsafe_allow_html=True)
+
+def queue_draft_update(fields, counts=None, token=None):
+    """Merge fields into this session's draft document through the background writer"""
+    draft_id = study.doc_id(st.session_state.draft_id)
+    writer = get_submission_writer()
+    if not writer.merge(draft_id, fields, counts, token):
+        writer.write_now('merge', draft_id, fields, counts, token)
+
+def save_demographics():
+    """Create the draft document on leaving the demographics step, or update its demographics"""
+    survey = st.session_state.survey
+    try:
+        if st.session_state.draft_id is not None:
+            queue_draft_update({'demographics': survey.demographics})
+            return
+
+        st.session_state.draft_id = st.session_state.submission_token
+        draft = schema.new_document(
+            st.session_state.draft_id,
+            st.session_state.language,
+            survey.question_ids,
+            survey.texts,
+            survey.demographics,
+            status='draft',
+            bank_version=survey.bank_version,
+        )
+        # The submit time and answered_ids are set when the status flips
+        draft['created_at'] = draft.pop('timestamp')
+        del draft['answered_ids']
+        queue_draft_update(draft)
+        survey.mark_saved()
+    except Exception:
+        # Fall back to a single full write at the final submit
+        logger.exception("Draft save failed")
+        st.session_state.draft_id = None
+
+def autosave_answer(index):
+    """Write one answer to the draft if it changed since it was last saved"""
+    survey = st.session_state.survey
+    text = survey.texts[index]
+    if st.session_state.draft_id is None or text == survey.saved[index]:
+        return
+    try:
+        queue_draft_update({'responses': {str(index): text}})
+        survey.mark_saved(index)
+    except Exception:
+        # The final submit sends whatever is still unsaved
+        logger.exception("Autosave failed")
+
+def count_submission(counts):
+    """Add a submission to the live dashboard counts, once per submission token
+
+    Storage ignores a repeated submit of the same token; the live counts
+    have to skip it here.
+    """
+    token = st.session_state.submission_token
+    if st.session_state.counted_token != token:
+        get_aggregates(study.id).add(counts)
+        st.session_state.counted_token = token
+
+def save_response(survey):
+    """Queue response for the storage backend (anonymized)"""
     try:
-        # Create anonymous ID based on timestamp
-        anonymous_id = hashlib.sha256(str(datetime.now()).encode()).hexdigest()[:16]
+        if st.session_state.draft_id is not None:
+            # Answers already live on the draft: send what is unsaved and flip the status
+            fields = {
+                'status': 'submitted',
+                'timestamp': datetime.utcnow(),
+                'language': st.session_state.language,
+                'answered_ids': schema.answered_ids(survey.question_ids, survey.texts),
+                'final_questions': survey.final_questions,
+                'flags': scan.flag_responses(survey.texts),
+            }
+            unsaved = survey.unsaved()
+            if unsaved:
+                fields['responses'] = unsaved
+            counts = summarize({
+                **fields,
+                'question_ids': survey.question_ids,
+                'demographics': survey.demographics,
+            })
+            # The token makes a repeated submit of this session a no-op, counters included
+            queue_draft_update(fields, counts, token=st.session_state.submission_token)
+            count_submission(counts)
+            return True
+
+        anonymous_id = st.session_state.submission_token
         
-        response = {
-            'id': anonymous_id,
-            'timestamp': datetime.utcnow(),
-            'language': st.session_state.language,
-            "demographics": data.get("demographics", {}),
-            "questions_and_responses": data.get("questions_and_responses", []),
-            "final_questions": data.get("final_questions", {}),
-            #'data': data
-        }
+        response = schema.new_document(
+            anonymous_id, st.session_state.language, survey.question_ids, survey.texts,
+            survey.demographics, survey.final_questions, bank_version=survey.bank_version,
+        )
         
-        # Save to the outputs directory so it's accessible
-        db.collection("survey_responses").document(anonymous_id).set(response)
+        # Hand off to the background writer; write directly if its queue is full
+        counts = submit_document(get_submission_writer(), response, anonymous_id, doc_id=study.doc_id(anonymous_id))
+        count_submission(counts)
 
         return True
 
     except Exception as e:
-        st.error(f"Error saving response: {e}")
+        st.error(get_text('save_error', error=e))
         return False
 
 # Main App Layout
+@metrics.timed()
 def main():
-    # Language switcher in top right corner
+    # Language switcher in top right corner, for studies offered in more than one language
     col1, col2 = st.columns([6, 1])
-    with col2:
-        lang_button = "EN" if st.session_state.language == 'ar' else "AR"
-        if st.button(lang_button, key="lang_switch", help="Switch Language / تغيير اللغة"):
-            switch_language()
-            st.rerun()
+    if len(study.languages) > 1:
+        with col2:
+            catalog = i18n.catalog(st.session_state.survey.content_version)
+            lang_button = catalog.text(next_language(), 'language_button')
+            if st.button(lang_button, key="lang_switch", help=get_text('language_help')):
+                switch_language()
+                st.rerun()
     
     # Header
-    st.markdown(f"""
-    <div class="main-header">
-        <h1>{get_text('title')}</h1>
-    </div>
-    """, unsafe_allow_html=True)
+    st.markdown(render.header_html(st.session_state.language, st.session_state.survey.content_version), unsafe_allow_html=True)
     
     # Show appropriate step
     if not st.session_state.submitted:
@@ -675,7 +316,7 @@ def main():
             progress_bar(1, 4)
             show_demographics_step()
         elif st.session_state.step == 2:
-            progress_bar(2, 4, st.session_state.current_question, 10)
+            # The pager draws its own progress bar so it can update without a full rerun
             show_single_question()
         elif st.session_state.step == 3:
             progress_bar(3, 4)
@@ -683,34 +324,15 @@ def main():
     else:
         progress_bar(4, 4)
         show_thank_you()
+    persist_session()
 
+@metrics.timed()
 def show_consent_step():
     """Step 0: Consent form"""
     st.markdown(f"## {get_text('consent_header')}")
     
     # Display consent text as clean HTML
-    consent_lines = get_text('consent_text').strip().split('\n\n')
-    consent_html = '<div class="privacy-notice">'
-    
-    for line in consent_lines:
-        line = line.strip()
-        if line.startswith('**') and line.endswith('**'):
-            # Bold headers
-            text = line.replace('**', '')
-            consent_html += f'<p style="font-weight: 600; color: #667eea; margin-top: 1.5rem;">{text}</p>'
-        elif line.startswith('- '):
-            # List items
-            if '- ' in consent_html:
-                consent_html += f'<p style="margin-left: 1.5rem;">✓ {line[2:]}</p>'
-            else:
-                consent_html += f'<p style="margin-left: 1.5rem; margin-top: 0.5rem;">✓ {line[2:]}</p>'
-        else:
-            # Regular paragraphs
-            consent_html += f'<p>{line}</p>'
-    
-    consent_html += '</div>'
-    
-    st.markdown(consent_html, unsafe_allow_html=True)
+    st.markdown(render.consent_html(st.session_state.language, st.session_state.survey.content_version), unsafe_allow_html=True)
     
     col1, col2, col3 = st.columns([1, 2, 1])
     with col2:
@@ -719,45 +341,50 @@ def show_consent_step():
             st.session_state.step = 1
             st.rerun()
 
+# Changing an answer reruns only this fragment; the buttons rerun the page
+@st.fragment
+@metrics.timed()
 def show_demographics_step():
     """Step 1: Demographics (optional)"""
     st.markdown(f"## {get_text('demographics_header')}")
     
-    age_options = {
-        'en': ['Prefer not to say', 'Under 18', '18-24', '25-34', '35-44', '45-54', '55+'],
-        'ar': ['أفضل عدم الإجابة', 'أقل من 18', '18-24', '25-34', '35-44', '45-54', '55+']
+    # Options are stored as language-independent codes and shown with localized labels,
+    # resolved here because format_func may be called outside the script run
+    labels = {
+        field: {code: get_text(f'option.{field}.{code}') for code in codes}
+        for field, codes in DEMOGRAPHIC_CODES.items()
     }
-    
+    # Start from the answers already given, e.g. in a resumed session; the keys keep
+    # the widgets' identity when the starting index changes
+    given = st.session_state.survey.demographics
+    chosen = {field: codes.index(given[field]) if given[field] in codes else 0
+              for field, codes in DEMOGRAPHIC_CODES.items()}
     age = st.selectbox(
         get_text('age_group'),
-        age_options[st.session_state.language]
+        DEMOGRAPHIC_CODES['age'],
+        index=chosen['age'],
+        key='demographic_age',
+        format_func=labels['age'].get
     )
     
-    education_options = {
-        'en': ['Prefer not to say', 'High School', 'Bachelor\'s Student', 'Bachelor\'s Degree', 'Master\'s Degree', 'PhD'],
-        'ar': ['أفضل عدم الإجابة', 'ثانوية', 'طالب بكالوريوس', 'بكالوريوس', 'ماجستير', 'دكتوراه']
-    }
-    
     education = st.selectbox(
         get_text('education'),
-        education_options[st.session_state.language]
+        DEMOGRAPHIC_CODES['education'],
+        index=chosen['education'],
+        key='demographic_education',
+        format_func=labels['education'].get
     )
     
-    experience_options = {
-        'en': ['Never', 'Rarely', 'Sometimes', 'Often', 'Daily'],
-        'ar': ['أبداً', 'نادراً', 'أحياناً', 'غالباً', 'يومياً']
-    }
-    
     experience = st.selectbox(
         get_text('chatbot_experience'),
-        experience_options[st.session_state.language]
+        DEMOGRAPHIC_CODES['experience'],
+        index=chosen['experience'],
+        key='demographic_experience',
+        format_func=labels['experience'].get
     )
     
-    st.session_state.demographics = {
-        'age': age,
-        'education': education,
-        'experience': experience
-    }
+    st.session_state.survey.set_demographics(age, education, experience)
+    persist_session()
     
     col1, col2, col3 = st.columns([1, 1, 1])
     with col1:
@@ -766,25 +393,53 @@ def show_demographics_step():
             st.rerun()
     with col2:
         if st.button(get_text('skip')):
+            save_demographics()
             st.session_state.step = 2
             st.session_state.current_question = 0
             st.rerun()
     with col3:
         if st.button(get_text('next'), type="primary"):
+            save_demographics()
             st.session_state.step = 2
             st.session_state.current_question = 0
             st.rerun()
             
 
+def sync_answer(index):
+    """Copy a question's text area into the session; callbacks run before the widget line does"""
+    key = f"prompt_text_{index}"
+    if key in st.session_state:
+        st.session_state.survey.texts[index] = st.session_state[key]
+
+def go_to_question(index):
+    """Pager button callback: save the current answer and move to another question"""
+    current_q = st.session_state.current_question
+    sync_answer(current_q)
+    autosave_answer(current_q)
+    st.session_state.current_question = index
+
+def leave_questions(step):
+    """Save the current answer and rerun the whole page on another step"""
+    autosave_answer(st.session_state.current_question)
+    st.session_state.step = step
+    st.rerun()
+
+# Moving between questions reruns only this fragment: the CSS, header and
+# language switcher are not rebuilt or re-sent
+@st.fragment
+@metrics.timed()
 def show_single_question():
     """Step 2: Show one question at a time"""
     current_q = st.session_state.current_question
-    question = st.session_state.selected_questions[current_q]
+    survey = st.session_state.survey
+    question = survey.question(current_q)
+    
+    progress_bar(2, 4, current_q, len(survey))
     
     # Question counter
     st.markdown(f"""
     <div class="question-counter">
-        {get_text('question_of', current=current_q + 1, total=10)}
+        {get_text('question_of', current=current_q + 1, total=len(survey))}
     </div>
     """, unsafe_allow_html=True)
     
@@ -800,48 +455,42 @@ def show_single_question():
     # Response area
     prompt_text = st.text_area(
         get_text('your_prompt'),
-        value=st.session_state.responses[current_q]['text'],
+        value=survey.texts[current_q],
         key=f"prompt_text_{current_q}",
         height=150,
-        placeholder="Type your response here... Be natural and realistic!" if st.session_state.language == 'en' 
-                    else "اكتب ردك هنا... كن طبيعياً وواقعياً!"
+        placeholder=get_text('prompt_placeholder')
     )
     
-    st.session_state.responses[current_q]['text'] = prompt_text
+    survey.texts[current_q] = prompt_text
+    persist_session()
     
     st.markdown("---")
     
-    # Navigation buttons
+    # Navigation buttons: moves within the pager run as callbacks, before the fragment reruns
     col1, col2, col3 = st.columns([1, 1, 1])
     
     with col1:
         if current_q > 0:
-            if st.button(get_text('previous'), use_container_width=True):
-                st.session_state.current_question -= 1
-                st.rerun()
+            st.button(get_text('previous'), use_container_width=True,
+                      on_click=go_to_question, args=(current_q - 1,))
         elif st.button("← " + get_text('step_background'), use_container_width=True):
-            st.session_state.step = 1
-            st.rerun()
+            leave_questions(1)
     
     with col2:
-        if st.button(get_text('skip'), use_container_width=True):
-            if current_q < 9:
-                st.session_state.current_question += 1
-                st.rerun()
-            else:
-                st.session_state.step = 3
-                st.rerun()
+        if current_q < len(survey) - 1:
+            st.button(get_text('skip'), use_container_width=True,
+                      on_click=go_to_question, args=(current_q + 1,))
+        elif st.button(get_text('skip'), use_container_width=True):
+            leave_questions(3)
     
     with col3:
-        if current_q < 9:
-            if st.button(get_text('next'), type="primary", use_container_width=True):
-                st.session_state.current_question += 1
-                st.rerun()
-        else:
-            if st.button(get_text('step_final') + " →", type="primary", use_container_width=True):
-                st.session_state.step = 3
-                st.rerun()
+        if current_q < len(survey) - 1:
+            st.button(get_text('next'), type="primary", use_container_width=True,
+                      on_click=go_to_question, args=(current_q + 1,))
+        elif st.button(get_text('step_final') + " →", type="primary", use_container_width=True):
+            leave_questions(3)
 
+@metrics.timed()
 def show_final_step():
     """Step 3: Final questions"""
     st.markdown(f"## {get_text('final_header')}")
@@ -850,42 +499,27 @@ def show_final_step():
         suggestions = st.text_area(
             get_text('suggestions'),
             height=150,
-            placeholder="e.g., 'It would be helpful if the scanner could...'" if st.session_state.language == 'en'
-                       else "مثال: 'سيكون من المفيد إذا كان الماسح الضوئي يستطيع...'"
+            placeholder=get_text('suggestions_placeholder')
         )
         
-        st.session_state.final_questions = {
-            'suggestions': suggestions
-        }
+        st.session_state.survey.suggestions = suggestions
         
         col1, col2 = st.columns([1, 1])
         with col1:
             if st.form_submit_button(get_text('previous')):
                 st.session_state.step = 2
-                st.session_state.current_question = 9
+                st.session_state.current_question = len(st.session_state.survey) - 1
                 st.rerun()
         with col2:
             if st.form_submit_button(get_text('submit'), type="primary"):
-                # Compile all data
-                all_data = {
-                    'demographics': getattr(st.session_state, 'demographics', {}),
-                    'questions_and_responses': [
-                        {
-                            'question_en': q['en'],
-                            'question_ar': q['ar'],
-                            'response': st.session_state.responses[i]['text'],
-                        }
-                        for i, q in enumerate(st.session_state.selected_questions)
-                    ],
-                    'final_questions': st.session_state.final_questions
-                }
-                
                 # Save response
-                if save_response(all_data):
+                if save_response(st.session_state.survey):
                     st.session_state.submitted = True
                     st.session_state.step = 4
+                    end_session()
                     st.rerun()
 
+@metrics.timed()
 def show_thank_you():
     """Final thank you screen"""
     st.balloons()
@@ -895,11 +529,15 @@ def show_thank_you():
         <h1>{get_text('thank_you')}</h1>
         <p style="font-size: 1.2rem;">{get_text('thank_you_message')}</p>
         <div style="margin-top: 2rem;">
-            <p>🔬 {"Your contribution helps advance AI safety research" if st.session_state.language == 'en' else "مساهمتك تساعد في تطوير أبحاث أمان الذكاء الاصطناعي"}</p>
-            <p>🛡️ {"Building safer chatbots for everyone" if st.session_state.language == 'en' else "بناء روبوتات دردشة أكثر أماناً للجميع"}</p>
+            <p>🔬 {get_text('thank_you_impact')}</p>
+            <p>🛡️ {get_text('thank_you_safety')}</p>
         </div>
     </div>
     """, unsafe_allow_html=True)
 
 if __name__ == "__main__":
+    start_metrics_reporting()
+    start_storage_warmup()
+    start_content_watch()
+    warm_render_cache()
     main()
\ No newline at end of file
@@ -0,0 +1,126 @@
+from functools import lru_cache
+
+import content
+import i18n
+
+# Steps shown by the progress bar; the prompts step (2) has one substep per question
+TOTAL_STEPS = 4
+QUESTIONS_PER_SESSION = 10
+
+
+@lru_cache(maxsize=None)
+def header_html(lang, version):
+    """Page header with the study title, for a content version"""
+    return f"""
+    <div class="main-header">
+        <h1>{i18n.catalog(version).text(lang, 'title')}</h1>
+    </div>
+    """
+
+
+@lru_cache(maxsize=None)
+def consent_html(lang, version):
+    """Consent text rendered as a privacy notice block"""
+    consent_lines = i18n.catalog(version).text(lang, 'consent_text').strip().split('\n\n')
+    parts = ['<div class="privacy-notice">']
+    # Tracks whether the markup so far contains '- ' instead of rescanning it per line
+    has_dash = False
+
+    for line in consent_lines:
+        line = line.strip()
+        if line.startswith('**') and line.endswith('**'):
+            # Bold headers
+            text = line.replace('**', '')
+            part = f'<p style="font-weight: 600; color: #667eea; margin-top: 1.5rem;">{text}</p>'
+        elif line.startswith('- '):
+            # List items
+            if has_dash:
+                part = f'<p style="margin-left: 1.5rem;">✓ {line[2:]}</p>'
+            else:
+                part = f'<p style="margin-left: 1.5rem; margin-top: 0.5rem;">✓ {line[2:]}</p>'
+        else:
+            # Regular paragraphs
+            part = f'<p>{line}</p>'
+        has_dash = has_dash or '- ' in part
+        parts.append(part)
+
+    parts.append('</div>')
+    return ''.join(parts)
+
+
+# Sized for a few studies of different lengths sharing the process
+@lru_cache(maxsize=1024)
+def progress_html(lang, version, current_step, total_steps, substep=0, total_substeps=0):
+    """Progress header and step dots markup, returned as two fragments"""
+    text = i18n.catalog(version).messages(lang)
+
+    # Calculate overall progress
+    if total_substeps > 0:
+        step_progress = (current_step + (substep / total_substeps)) / total_steps
+    else:
+        step_progress = current_step / total_steps
+
+    progress_percent = int(step_progress * 100)
+
+    head = f"""
+    <div class="creative-progress">
+        <div class="step-title">{text['progress']}</div>
+        <div class="question-counter">{progress_percent}%</div>
+        <div class="progress-dots">
+            <div class="progress-line">
+                <div class="progress-line-fill" style="width: {progress_percent}%;"></div>
+            </div>
+        </div>
+    """
+
+    steps = [
+        text['step_consent'],
+        text['step_background'],
+        text['step_prompts'],
+        text['step_final'],
+        text['step_complete']
+    ]
+
+    dots = ['<div class="progress-dots">']
+    for i, label in enumerate(steps):
+        if i < current_step:
+            dot_class = "dot completed"
+            label_class = "dot-label completed"
+            icon = "★"
+        elif i == current_step:
+            dot_class = "dot active"
+            label_class = "dot-label active"
+            # For prompts step, show current question number
+            if i == 2 and total_substeps > 0:
+                icon = str(substep + 1)
+            else:
+                icon = "●"
+        else:
+            dot_class = "dot"
+            label_class = "dot-label"
+            icon = ""
+
+        dots.append(f"""
+<div class="dot-container">
+    <div class="{dot_class}">{icon}</div>
+    <div class="{label_class}">{label}</div>
+</div>
+        """)
+
+    dots.append("""
+</div>
+</div>
+    """)
+    return head, ''.join(dots)
+
+
+def precompute(version=None, questions=QUESTIONS_PER_SESSION, languages=None):
+    """Fill the render cache for every language, step and question of a content version"""
+    version = version or content.current().version
+    for lang in languages or content.snapshot(version).languages:
+        header_html(lang, version)
+        consent_html(lang, version)
+        for step in range(TOTAL_STEPS + 1):
+            progress_html(lang, version, step, TOTAL_STEPS)
+        for substep in range(questions):
+            progress_html(lang, version, 2, TOTAL_STEPS, substep, questions)
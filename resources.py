@@ -0,0 +1,225 @@
+"""Process-wide resources shared by every session and page of the app.
+
+Streamlit re-executes page scripts on every rerun, but imported modules and
+st.cache_resource values live for the whole process.
+
+Every study (studies.py) shares the storage client, background writer,
+session store and render cache; counters, aggregates and the question
+scheduler are built once per study, and getters for them take a study id
+(None for the default study).
+"""
+import logging
+import os
+import threading
+
+import streamlit as st
+
+import assets
+import content
+import metrics
+import render
+import schema
+import search
+import session_store
+import studies
+from aggregates import AggregateView
+from counters import ShardedCounter
+from scheduler import QuestionScheduler
+from storage import DEFAULT_COLLECTION, InstrumentedBackend, create_backend, firestore_client
+from submission_writer import SubmissionWriter
+
+logger = logging.getLogger(__name__)
+
+
+@st.cache_resource
+def get_firestore_client():
+    """Initialize Firebase once per process and return a Firestore client"""
+    return firestore_client(dict(st.secrets["firebase"]))
+
+
+def secrets_section(name):
+    """A secrets.toml section as a dict; empty when the section or the file is missing"""
+    try:
+        return dict(st.secrets.get(name, {}))
+    except FileNotFoundError:
+        return {}
+
+
+def get_storage_config():
+    """Storage settings from the [storage] secrets section, overridable by environment"""
+    config = secrets_section("storage")
+    for key in ('backend', 'path', 'collection', 'latency'):
+        value = os.environ.get(f"SURVEY_STORAGE_{key.upper()}")
+        if value:
+            config[key] = value
+    return config
+
+
+@st.cache_resource
+def get_storage_backend():
+    """Storage backend shared by every session in this process"""
+    return InstrumentedBackend(create_backend(get_storage_config(), get_firestore_client))
+
+
+def get_session_store_config():
+    """Session store settings from the [session_store] secrets section, overridable by environment"""
+    config = secrets_section("session_store")
+    for key in ('backend', 'path', 'url', 'ttl'):
+        value = os.environ.get(f"SURVEY_SESSION_STORE_{key.upper()}")
+        if value:
+            config[key] = value
+    return config
+
+
+@st.cache_resource
+def get_session_store():
+    """External store for in-progress sessions, or None to keep them in this process only"""
+    return session_store.create_store(get_session_store_config())
+
+
+@st.cache_resource
+def get_studies():
+    """The study definitions, loaded once per process"""
+    return studies.load(collection=get_storage_config().get('collection', DEFAULT_COLLECTION))
+
+
+def get_study(study_id=None):
+    """A study by id, the default one for None; KeyError for unknown ids"""
+    return get_studies().get(study_id)
+
+
+@st.cache_resource
+def _open_counters(collection):
+    settings = secrets_section("counters")
+    if not settings.get("enabled", True):
+        return None
+    backend = get_storage_backend()
+    return ShardedCounter(
+        backend,
+        collection or settings.get("name", backend.collection),
+        num_shards=int(settings.get("shards", 10)),
+        ttl=float(settings.get("ttl", 10)),
+    )
+
+
+@st.cache_resource
+def get_submission_writer():
+    """Background writer shared by every session and study in this process"""
+    writer = SubmissionWriter(get_storage_backend(), _open_counters(None))
+    # Registered up front so no study's first submission counts towards another
+    for study in get_studies():
+        counters = _open_counters(study.collection)
+        if study.collection and counters is not None:
+            writer.add_counters(study.collection, counters)
+    metrics.REGISTRY.register_gauges('survey_writer', writer.stats)
+    return writer
+
+
+def _warm_storage():
+    try:
+        writer = get_submission_writer()
+        writer.backend.warm_up()
+        # Responses store question indices into these snapshots, written once per bank revision
+        snapshots = {study.content.bank_version: study.content for study in get_studies()}
+        for bank_version, snapshot in snapshots.items():
+            writer.submit(schema.snapshot_path(bank_version), schema.snapshot_document(snapshot))
+    except Exception:
+        logger.exception("Storage warm-up failed; the first submit will connect instead")
+
+
+@st.cache_resource
+def _open_search_index(path):
+    return search.SearchIndex(path)
+
+
+def get_search_index():
+    """The full-text index kept up to date by search.py --update, or None until it is first built"""
+    if not os.path.exists(search.INDEX_PATH):
+        return None
+    return _open_search_index(search.INDEX_PATH)
+
+
+@st.cache_resource
+def start_metrics_reporting():
+    """Start the /metrics endpoint and/or periodic log line configured by environment, once per process"""
+    port = os.environ.get('SURVEY_METRICS_PORT')
+    if port:
+        metrics.start_http_server(int(port))
+    interval = os.environ.get('SURVEY_METRICS_LOG_INTERVAL')
+    if interval:
+        metrics.start_log_reporter(float(interval))
+
+
+@st.cache_resource
+def get_stylesheet_loader(fallback=False):
+    """Build the fingerprinted stylesheet into static/ once per process; returns the markup pages send
+
+    The fallback variant also carries the CSS, for a session's first run.
+    """
+    return assets.loader_html(assets.build(), fallback=fallback)
+
+
+@st.cache_resource
+def warm_render_cache():
+    """Precompute the HTML fragments of every study's languages and length, once per process"""
+    for study in get_studies():
+        render.precompute(study.content.version, study.questions, study.languages)
+
+
+def _publish_content(snapshot):
+    for study in get_studies():
+        if study.content.version == snapshot.version:
+            render.precompute(snapshot.version, study.questions, study.languages)
+    get_submission_writer().submit(schema.snapshot_path(snapshot.bank_version), schema.snapshot_document(snapshot))
+
+
+@st.cache_resource
+def start_content_watch():
+    """Hot-reload every study's content file for new sessions, once per process; returns the watchers by path
+
+    content.watch() schedules every file on one shared observer, so the
+    values are the same thread.
+    """
+    content.on_reload(_publish_content)
+    return {path: content.watch(path) for path in {study.content_path for study in get_studies()}}
+
+
+@st.cache_resource
+def start_storage_warmup():
+    """Build the storage backend and open its connection in the background, once per process"""
+    thread = threading.Thread(target=_warm_storage, name="storage-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+@st.cache_resource
+def _open_aggregates(study_id):
+    study = get_study(study_id)
+    backend = get_storage_backend()
+    if study.collection:
+        backend = backend.with_collection(study.collection)
+    ttl = float(secrets_section("dashboard").get("ttl", 300))
+    return AggregateView(backend, ttl=ttl, counters=_open_counters(study.collection),
+                         languages=study.languages, bank_size=len(study.content.questions))
+
+
+def get_aggregates(study_id=None):
+    """A study's dashboard aggregates: cached count() baselines plus live in-process increments"""
+    return _open_aggregates(get_study(study_id).id)
+
+
+@st.cache_resource
+def _open_question_scheduler(study_id):
+    study = get_study(study_id)
+    settings = secrets_section("scheduler")
+    return QuestionScheduler(
+        get_aggregates(study_id).question_counts,
+        study.candidates(),
+        ttl=float(settings.get("ttl", 60)),
+        strength=float(settings.get("strength", 1.0)),
+    )
+
+
+def get_question_scheduler(study_id=None):
+    """Coverage-balanced picker for a study's questions between its pinned first and last ones"""
+    return _open_question_scheduler(get_study(study_id).id)
@@ -0,0 +1,342 @@
+"""Pre-scan of collected prompts for private information and toxic language.
+
+    python scan.py exports/                      # rescan a Parquet export
+    python scan.py exports/ --out flagged.csv    # and list the flagged answers
+    python scan.py --benchmark --prompts 100000 --processes 4
+
+Every answer is tagged with the contains_private / contains_toxic labels of
+the survey content. Private information is found with one precompiled regex
+combining emails, phone numbers, Saudi and Egyptian national IDs and IBANs
+(checksum-verified); toxic language with an Aho-Corasick automaton over the
+lexicon in content/toxic_terms.txt, so the cost per prompt does not grow
+with the number of terms. Both work on English and Arabic text, including
+Arabic-Indic digits. Long numbers are common in answers, so an ID-shaped
+number counts only if it passes its check (Luhn for Saudi IDs, birth date
+and governorate for Egyptian ones) or follows a word like "ID" or "هوية".
+
+Responses are tagged as they are saved (tag_document), so documents carry
+
+    "flags": {"contains_private": [positions], "contains_toxic": [positions]}
+
+and the Parquet export has one boolean column per label.
+"""
+import argparse
+import csv
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+
+import schema
+from textnorm import ARABIC_PREFIXES, ASCII_DIGITS, normalize
+
+LEXICON_PATH = os.environ.get('SURVEY_TOXIC_LEXICON', 'content/toxic_terms.txt')
+
+PRIVATE = 'contains_private'
+TOXIC = 'contains_toxic'
+LABELS = (PRIVATE, TOXIC)
+
+PRIVATE_PATTERNS = {
+    'email': r'[A-Za-z0-9._%+-]+@[A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)*\.[A-Za-z]{2,}',
+    'iban': r'(?<![A-Za-z0-9])[A-Za-z]{2}[0-9]{2}(?:[ ]?[A-Za-z0-9]){11,30}(?![A-Za-z0-9])',
+    # Saudi national ID / iqama (10 digits) and Egyptian national ID (14 digits)
+    'national_id': r'(?<![0-9])(?:[12][0-9]{9}|[23][0-9]{13})(?![0-9])',
+    # International (+966 5x..., 00 20 1x...) or local with a leading zero (05x..., 010...)
+    'phone': r'(?<![0-9+])(?:(?:\+|00)[1-9][0-9]{0,2}[ .-]?(?:\(?[0-9]\)?[ .-]?){7,12}[0-9]'
+             r'|0[0-9](?:[ .-]?[0-9]){7,9})(?![0-9])',
+}
+
+PRIVATE_REGEX = re.compile('|'.join(f'(?P<{name}>{pattern})' for name, pattern in PRIVATE_PATTERNS.items()))
+
+# Every private pattern needs a digit or an "@"
+_PRIVATE_HINT = re.compile('[0-9@\u0660-\u0669\u06f0-\u06f9]')
+
+# Words that make an ID-shaped number an ID without a valid check, when found shortly before it
+ID_CONTEXT = re.compile(r'(?i)\b(?:id|identity|national|iqama)\b|هوي|إقام|اقام|الرقم القومي|بطاق')
+ID_CONTEXT_CHARS = 40
+
+# Governorate of birth in an Egyptian national ID (88: born abroad)
+EGYPTIAN_GOVERNORATES = frozenset(['01', '02', '03', '04', '88',
+                                   *map(str, [*range(11, 20), *range(21, 30), *range(31, 36)])])
+
+
+def iban_valid(candidate):
+    """ISO 13616 mod-97 check"""
+    code = candidate.replace(' ', '').upper()
+    rearranged = code[4:] + code[:4]
+    digits = ''.join(str(int(ch, 36)) for ch in rearranged)
+    return int(digits) % 97 == 1
+
+
+def luhn_valid(candidate):
+    """Luhn check, as used by Saudi national ID and iqama numbers"""
+    total = 0
+    for position, digit in enumerate(reversed(candidate)):
+        value = int(digit) * (2 if position % 2 else 1)
+        total += value - 9 if value > 9 else value
+    return total % 10 == 0
+
+
+def egyptian_id_valid(candidate):
+    """Birth month and day and governorate of a 14-digit Egyptian national ID"""
+    month, day = int(candidate[3:5]), int(candidate[5:7])
+    return 1 <= month <= 12 and 1 <= day <= 31 and candidate[7:9] in EGYPTIAN_GOVERNORATES
+
+
+def national_id_valid(candidate, text, start):
+    """Whether an ID-shaped number at text[start:] is one: its check passes or an ID word precedes it"""
+    valid = luhn_valid(candidate) if len(candidate) == 10 else egyptian_id_valid(candidate)
+    return valid or ID_CONTEXT.search(text, max(0, start - ID_CONTEXT_CHARS), start) is not None
+
+
+class Lexicon:
+    """Aho-Corasick automaton: finds every term in one pass over the text
+
+    The failure links are folded into a full transition table, so each
+    character costs one dict lookup.
+    """
+
+    def __init__(self, terms):
+        self._goto = [{}]
+        self._fail = [0]
+        # Lengths of the terms that end at each state
+        self._out = [()]
+        for term in terms:
+            self._add(normalize(term).strip())
+        self._link()
+        self._delta = self._transitions()
+
+    def _add(self, term):
+        if not term:
+            return
+        state = 0
+        for ch in term:
+            following = self._goto[state].get(ch)
+            if following is None:
+                following = len(self._goto)
+                self._goto[state][ch] = following
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(())
+            state = following
+        self._out[state] = self._out[state] + (len(term),)
+
+    def _link(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, following in self._goto[state].items():
+                queue.append(following)
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(ch, 0)
+                self._fail[following] = target if target != following else 0
+                self._out[following] = self._out[following] + self._out[self._fail[following]]
+
+    def _transitions(self):
+        delta = [None] * len(self._goto)
+        delta[0] = dict(self._goto[0])
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            # The failure state is shallower, so its row is already complete
+            delta[state] = {**delta[self._fail[state]], **self._goto[state]}
+            queue.extend(self._goto[state].values())
+        return delta
+
+    def finditer(self, text):
+        """(start, end) of every term occurrence in normalized text"""
+        delta, out = self._delta, self._out
+        state = 0
+        for end, ch in enumerate(text, 1):
+            state = delta[state].get(ch, 0)
+            if out[state]:
+                for length in out[state]:
+                    yield end - length, end
+
+    def search(self, text):
+        """True if a term occurs in normalized text as a whole word (Arabic clitics allowed)"""
+        for start, end in self.finditer(text):
+            if end < len(text) and text[end].isalnum():
+                continue
+            if start == 0 or not text[start - 1].isalnum():
+                return True
+            word_start = start
+            while word_start and text[word_start - 1].isalnum():
+                word_start -= 1
+            if text[word_start:start] in ARABIC_PREFIXES:
+                return True
+        return False
+
+
+def load_lexicon(path=LEXICON_PATH):
+    with open(path, encoding='utf-8') as f:
+        return Lexicon(line.strip() for line in f if line.strip() and not line.startswith('#'))
+
+
+class Scanner:
+    """Flags one text at a time; build once and share (it is read-only)"""
+
+    def __init__(self, lexicon=None):
+        self.lexicon = lexicon if lexicon is not None else load_lexicon()
+
+    def private_matches(self, text):
+        """Names of the private-information patterns found in text"""
+        found = []
+        if not _PRIVATE_HINT.search(text):
+            return found
+        text = text.translate(ASCII_DIGITS)
+        for match in PRIVATE_REGEX.finditer(text):
+            kind = match.lastgroup
+            if kind == 'iban' and not iban_valid(match.group()):
+                continue
+            if kind == 'national_id' and not national_id_valid(match.group(), text, match.start()):
+                continue
+            found.append(kind)
+        return found
+
+    def contains_private(self, text):
+        return bool(self.private_matches(text))
+
+    def contains_toxic(self, text):
+        return self.lexicon.search(normalize(text))
+
+    def flags(self, text):
+        """(contains_private, contains_toxic) for one text"""
+        if not text:
+            return False, False
+        return self.contains_private(text), self.contains_toxic(text)
+
+
+_scanner = None
+_lock = threading.Lock()
+
+
+def scanner():
+    """The process-wide scanner, built on first use"""
+    global _scanner
+    if _scanner is None:
+        with _lock:
+            if _scanner is None:
+                _scanner = Scanner()
+    return _scanner
+
+
+def flag_responses(texts):
+    """{label: [positions]} for answers given in position order"""
+    active = scanner()
+    flagged = {label: [] for label in LABELS}
+    for position, text in enumerate(texts):
+        private, toxic = active.flags(text)
+        if private:
+            flagged[PRIVATE].append(position)
+        if toxic:
+            flagged[TOXIC].append(position)
+    return flagged
+
+
+def tag_document(document):
+    """Add the flags of every answer to a response document"""
+    document['flags'] = flag_responses(schema.response_texts(document))
+    return document
+
+
+def scan_texts(texts):
+    """Flags for a chunk of texts; runs in worker processes"""
+    active = scanner()
+    return [active.flags(text) for text in texts]
+
+
+def scan_export(path, out=None):
+    """Rescan the answers of a Parquet export; returns a Counter of flags"""
+    import pyarrow.dataset as ds
+
+    active = scanner()
+    totals = Counter()
+    flagged = []
+    dataset = ds.dataset(path, format='parquet', partitioning='hive')
+    for batch in dataset.to_batches(columns=['response_id', 'position', 'response']):
+        rows = batch.to_pydict()
+        for response_id, position, text in zip(rows['response_id'], rows['position'], rows['response']):
+            kinds = active.private_matches(text) if text else []
+            toxic = bool(text) and active.contains_toxic(text)
+            totals['answers'] += 1
+            totals[PRIVATE] += bool(kinds)
+            totals[TOXIC] += toxic
+            if kinds or toxic:
+                # Pattern names only: the flagged text itself stays in the export
+                flagged.append([response_id, position, bool(kinds), toxic, ' '.join(sorted(set(kinds)))])
+    if out:
+        with open(out, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['response_id', 'position', PRIVATE, TOXIC, 'private_kinds'])
+            writer.writerows(flagged)
+    return totals
+
+
+def sample_prompts(count, seed=0):
+    """Question-bank-like prompts in both languages, some with private data or insults"""
+    from survey_content import QUESTION_BANK
+
+    rng = random.Random(seed)
+    extras = [
+        'contact me at sara.k@example.com', 'my number is +966 55 123 4567', 'جوالي ٠٥٥١٢٣٤٥٦٧',
+        'IBAN SA03 8000 0000 6080 1016 7519', 'رقم الهوية 1012345678', 'you are an idiot',
+        'انت غبي جدا', 'الله يلعنك', 'please be kind', 'شكرا جزيلا',
+    ]
+    prompts = []
+    for _ in range(count):
+        question = QUESTION_BANK[rng.randrange(len(QUESTION_BANK))]
+        text = question[rng.choice(('en', 'ar'))]
+        if rng.random() < 0.3:
+            text = f"{text} {rng.choice(extras)}"
+        prompts.append(text)
+    return prompts
+
+
+def benchmark(count, processes, chunk=2000):
+    prompts = sample_prompts(count)
+    scanner()
+    started = time.perf_counter()
+    flagged = scan_texts(prompts)
+    single = count / (time.perf_counter() - started)
+    print(f"{count} prompts, {sum(p for p, _ in flagged)} private, {sum(t for _, t in flagged)} toxic")
+    print(f"1 core        {single:12,.0f} prompts/s")
+
+    chunks = [prompts[start:start + chunk] for start in range(0, count, chunk)]
+    with ProcessPoolExecutor(processes) as pool:
+        # Build the scanner in every worker before timing
+        list(pool.map(scan_texts, [[''] for _ in range(processes)]))
+        started = time.perf_counter()
+        pooled = [flags for part in pool.map(scan_texts, chunks) for flags in part]
+        rate = count / (time.perf_counter() - started)
+    assert pooled == flagged
+    print(f"{processes} processes {rate:12,.0f} prompts/s ({rate / single:.1f}x)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('export', nargs='?', help="Parquet export directory (export_parquet.py --out)")
+    parser.add_argument('--out', help="write the flagged answers (ids and pattern names) to this CSV")
+    parser.add_argument('--benchmark', action='store_true', help="measure throughput on generated prompts")
+    parser.add_argument('--prompts', type=int, default=100000)
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args(argv)
+
+    if args.benchmark:
+        benchmark(args.prompts, args.processes)
+        return 0
+    if not args.export:
+        parser.error("give an export directory or --benchmark")
+    totals = scan_export(args.export, args.out)
+    print(f"{totals['answers']} answers: {totals[PRIVATE]} {PRIVATE}, {totals[TOXIC]} {TOXIC}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
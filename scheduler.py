@@ -0,0 +1,74 @@
+import logging
+import random
+import threading
+import time
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+
+def coverage_weights(totals, strength=1.0):
+    """{index: 1 / (1 + answers above the least-answered)^strength} for {index: answers}"""
+    floor = min(totals.values())
+    return {index: 1.0 / (1.0 + total - floor) ** strength for index, total in totals.items()}
+
+
+class QuestionScheduler:
+    """Picks a session's random questions, favouring ones with fewer answers so far
+
+    Counts come from count_source() (e.g. the dashboard aggregates) and are
+    refreshed in the background after `ttl` seconds; session starts never wait
+    for a refresh and never touch shared storage. Between refreshes, questions
+    handed out by this process are added to the counts so a burst of session
+    starts spreads across the bank instead of piling onto the same scenarios.
+    """
+
+    def __init__(self, count_source, candidates, ttl=60, strength=1.0):
+        self.count_source = count_source
+        self.candidates = list(candidates)
+        self.ttl = ttl
+        self.strength = strength
+        self._counts = {}
+        self._counts_at = 0.0
+        self._assigned = Counter()
+        self._refreshing = threading.Lock()
+
+    def _refresh(self):
+        try:
+            counts = self.count_source()
+            self._counts = {index: counts.get(index, 0) for index in self.candidates}
+            # Rebinding is atomic; a session that read the old Counter just increments a stale one
+            self._assigned = Counter()
+            self._counts_at = time.time()
+        except Exception:
+            logger.exception("Question count refresh failed; keeping the previous counts")
+            self._counts_at = time.time()
+        finally:
+            self._refreshing.release()
+
+    def _maybe_refresh(self):
+        if time.time() - self._counts_at <= self.ttl:
+            return
+        # Whoever gets the lock refreshes in the background; everyone else uses the current counts
+        if self._refreshing.acquire(blocking=False):
+            threading.Thread(target=self._refresh, name="question-counts", daemon=True).start()
+
+    def weights(self):
+        """Sampling weight per candidate, from the last counts plus this process's picks since"""
+        counts, assigned = self._counts, self._assigned
+        return coverage_weights({index: counts.get(index, 0) + assigned[index] for index in self.candidates},
+                                self.strength)
+
+    def pick(self, k):
+        """Choose k distinct candidates, weighted towards under-answered ones, in random order"""
+        self._maybe_refresh()
+        weights = self.weights()
+        # Efraimidis-Spirakis weighted sampling without replacement: keep the k largest u^(1/w)
+        keyed = sorted(self.candidates, key=lambda index: random.random() ** (1.0 / weights[index]),
+                       reverse=True)
+        chosen = keyed[:k]
+        random.shuffle(chosen)
+        assigned = self._assigned
+        for index in chosen:
+            assigned[index] += 1
+        return chosen
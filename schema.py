@@ -0,0 +1,223 @@
+"""Compact response document schema and a reader for every stored shape.
+
+Version 1 documents (written before this module existed) copy the English and
+Arabic text of every question and store localized demographic labels.
+Version 2 documents store QUESTION_BANK indices plus the version of the bank
+snapshot they index into, and language-independent demographic codes:
+
+    {
+        'schema_version': 2,
+        'id': ..., 'status': 'draft' | 'submitted', 'timestamp': ..., 'language': 'en' | 'ar',
+        'question_bank_version': '3f2a9c01b7d4',
+        'question_ids': [0, 17, ..., 43],          # bank indices in display order
+        'responses': {'0': '...', '3': '...'},     # keyed by position, empty answers omitted
+        'answered_ids': [0, 21],                   # bank indices with an answer, set on submit
+        'demographics': {'age': '18_24', 'education': None, 'experience': 'daily'},
+        'final_questions': {'suggestions': '...'},
+    }
+
+Each bank revision is stored once under question_bank_snapshots/<version>.
+"""
+from datetime import datetime
+
+import content
+from survey_content import DEMOGRAPHIC_OPTIONS, QUESTION_BANK
+
+SCHEMA_VERSION = 2
+SNAPSHOT_COLLECTION = "question_bank_snapshots"
+
+
+# The bank this process started with; hot-reloaded revisions carry their own version
+QUESTION_BANK_VERSION = content.current().bank_version
+
+
+def _text_index(questions):
+    """{question text in any language: bank index}"""
+    index = {}
+    for number, question in enumerate(questions):
+        for text in question.values():
+            index.setdefault(text, number)
+    return index
+
+
+# Reverse lookups used to encode legacy payloads and expand version 1 documents
+_QUESTION_INDEX = _text_index(QUESTION_BANK)
+# Bank version -> _text_index() of other studies' banks and later revisions
+_BANK_INDEXES = {}
+
+_DEMOGRAPHIC_CODES = {
+    field: {
+        **{label: code for code, labels in options.items() for label in labels.values()},
+        **{code: code for code in options},
+    }
+    for field, options in DEMOGRAPHIC_OPTIONS.items()
+}
+
+
+def snapshot_path(version=QUESTION_BANK_VERSION):
+    return f"{SNAPSHOT_COLLECTION}/{version}"
+
+
+def snapshot_document(snapshot=None):
+    """A content revision's question bank as stored once per revision"""
+    snapshot = snapshot or content.current()
+    return {'version': snapshot.bank_version, 'questions': list(snapshot.questions)}
+
+
+def question_index(text, snapshot=None):
+    """Bank index of a question given its text in any language, or None
+
+    Looks in QUESTION_BANK unless a content snapshot (another study's or
+    revision's) is given.
+    """
+    if snapshot is None or snapshot.bank_version == QUESTION_BANK_VERSION:
+        return _QUESTION_INDEX.get(text)
+    lookup = _BANK_INDEXES.get(snapshot.bank_version)
+    if lookup is None:
+        lookup = _BANK_INDEXES.setdefault(snapshot.bank_version, _text_index(snapshot.questions))
+    return lookup.get(text)
+
+
+def demographic_code(field, value):
+    """Code for a demographic answer given as a code or a label in any language"""
+    if value is None:
+        return None
+    return _DEMOGRAPHIC_CODES.get(field, {}).get(value, value)
+
+
+def encode_demographics(demographics):
+    return {field: demographic_code(field, value) for field, value in (demographics or {}).items()}
+
+
+def answered_ids(question_ids, responses):
+    """Bank indices of the questions that received a non-empty answer"""
+    return [index for index, text in zip(question_ids, responses) if text]
+
+
+def new_document(doc_id, language, question_ids, responses, demographics,
+                 final_questions=None, status='submitted', timestamp=None, bank_version=None):
+    """Build a version 2 response document"""
+    return {
+        'schema_version': SCHEMA_VERSION,
+        'id': doc_id,
+        'status': status,
+        'timestamp': timestamp or datetime.utcnow(),
+        'language': language,
+        'question_bank_version': bank_version or QUESTION_BANK_VERSION,
+        'question_ids': list(question_ids),
+        'responses': {str(i): text for i, text in enumerate(responses) if text},
+        'answered_ids': answered_ids(question_ids, responses),
+        'demographics': encode_demographics(demographics),
+        'final_questions': final_questions or {},
+    }
+
+
+def encode_submission(doc_id, language, data, timestamp=None, snapshot=None):
+    """Encode a payload shaped like show_final_step's into a response document
+
+    Questions index into the snapshot's bank (QUESTION_BANK for None). Falls
+    back to a version 1 document when a question is not in that bank.
+    """
+    items = data.get('questions_and_responses', [])
+    question_ids = [question_index(item.get('question_en'), snapshot) for item in items]
+    if None in question_ids:
+        return {
+            'id': doc_id,
+            'status': 'submitted',
+            'timestamp': timestamp or datetime.utcnow(),
+            'language': language,
+            'demographics': data.get('demographics', {}),
+            'questions_and_responses': items,
+            'final_questions': data.get('final_questions', {}),
+        }
+    return new_document(
+        doc_id, language, question_ids, [item.get('response', '') for item in items],
+        data.get('demographics', {}), data.get('final_questions', {}), timestamp=timestamp,
+        bank_version=snapshot.bank_version if snapshot else None,
+    )
+
+
+class QuestionBankSnapshots:
+    """Question lists by bank version: loaded revisions locally, older ones read once from storage"""
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self._cache = {QUESTION_BANK_VERSION: QUESTION_BANK}
+
+    def __call__(self, version):
+        if version not in self._cache:
+            questions = content.questions_for(version)
+            if questions is None:
+                snapshot = self.backend.get(snapshot_path(version)) if self.backend else None
+                if snapshot is None:
+                    raise KeyError(f"Unknown question bank version: {version}")
+                questions = snapshot['questions']
+            self._cache[version] = questions
+        return self._cache[version]
+
+
+def response_texts(document):
+    """A version 1 or 2 response document's answers in position order"""
+    if 'question_ids' in document:
+        responses = document.get('responses') or {}
+        return [responses.get(str(position), '') for position in range(len(document['question_ids']))]
+    items = document.get('questions_and_responses', [])
+    if isinstance(items, dict):
+        items = [items[key] for key in sorted(items, key=int)]
+    return [item.get('response') or '' for item in items]
+
+
+def _expand_v1_items(items):
+    if isinstance(items, dict):
+        # Drafts written position-keyed so single answers could be merged in
+        items = [items[key] for key in sorted(items, key=int)]
+    return [
+        {
+            'position': position,
+            'question_index': question_index(item.get('question_en')),
+            'question_en': item.get('question_en'),
+            'question_ar': item.get('question_ar'),
+            'response': item.get('response', ''),
+        }
+        for position, item in enumerate(items)
+    ]
+
+
+def expand_document(document, load_questions=None):
+    """Expand a version 1 or version 2 document into one common shape
+
+    load_questions(version) returns the question list for a bank version;
+    it defaults to knowing only the current bank.
+    """
+    load_questions = load_questions or QuestionBankSnapshots()
+    version = document.get('schema_version', 1)
+
+    if version >= 2:
+        questions = load_questions(document['question_bank_version'])
+        responses = document.get('responses', {})
+        items = [
+            {
+                'position': position,
+                'question_index': index,
+                'question_en': questions[index]['en'],
+                'question_ar': questions[index]['ar'],
+                'response': responses.get(str(position), ''),
+            }
+            for position, index in enumerate(document.get('question_ids', []))
+        ]
+        bank_version = document['question_bank_version']
+    else:
+        items = _expand_v1_items(document.get('questions_and_responses', []))
+        bank_version = None
+
+    return {
+        'id': document.get('id'),
+        'schema_version': version,
+        'status': document.get('status', 'submitted'),
+        'timestamp': document.get('timestamp'),
+        'language': document.get('language'),
+        'question_bank_version': bank_version,
+        'demographics': encode_demographics(document.get('demographics')),
+        'questions_and_responses': items,
+        'final_questions': document.get('final_questions', {}),
+    }
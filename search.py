@@ -0,0 +1,255 @@
+"""Full-text search over submitted answers, in English and Arabic.
+
+    python search.py --update                         # index responses stored since the last update
+    python search.py "bank" --language ar --question 3
+    python search.py "البنك" --backend sqlite --path local_data/survey_responses.sqlite3 --update
+
+Answers are normalized (textnorm.py: case, diacritics, tatweel, alef/yaa/
+taa marbuta variants, digits) and split into words; Arabic words are also
+indexed without their definite article, so "بنك" finds "البنك" and "والبنك".
+A query matches answers containing all of its terms.
+
+The index is one SQLite file (--index). Every answer gets a number in the
+order it was indexed; each term's postings list holds those numbers as
+delta-encoded varints and is appended to on update, so an update costs one
+read and one write per distinct term of the new answers. The respondent's
+language and the question index are indexed as terms too ("language:ar",
+"question:3"), so filters are just more postings to intersect.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import defaultdict
+
+import schema
+from storage import add_backend_arguments, backend_from_args, scan_cursor, timestamp_text
+from textnorm import index_terms, query_terms
+
+INDEX_PATH = os.environ.get('SURVEY_SEARCH_INDEX', 'local_data/search.sqlite3')
+
+
+def encode_postings(numbers, last=0):
+    """Varint-encoded gaps between increasing numbers, starting after `last`"""
+    out = bytearray()
+    for number in numbers:
+        gap = number - last
+        last = number
+        while gap >= 0x80:
+            out.append(gap & 0x7f | 0x80)
+            gap >>= 7
+        out.append(gap)
+    return bytes(out)
+
+
+def decode_postings(data):
+    numbers = []
+    current = value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            current += value
+            numbers.append(current)
+            value = shift = 0
+    return numbers
+
+
+def language_term(language):
+    return f"language:{language}"
+
+
+def question_term(index):
+    return f"question:{index}"
+
+
+class SearchIndex:
+    """Inverted index of answers in a SQLite file"""
+
+    def __init__(self, path=INDEX_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            " number INTEGER PRIMARY KEY,"
+            " response_id TEXT NOT NULL,"
+            " position INTEGER NOT NULL,"
+            " question_index INTEGER,"
+            " language TEXT,"
+            " timestamp TEXT,"
+            " response TEXT NOT NULL,"
+            " UNIQUE (response_id, position))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS postings ("
+            " term TEXT PRIMARY KEY,"
+            " count INTEGER NOT NULL,"
+            " last INTEGER NOT NULL,"
+            " data BLOB NOT NULL"
+            ") WITHOUT ROWID"
+        )
+
+    def _meta(self, key):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _add_page(self, page, load_questions):
+        """Index the answers of one page of documents in one transaction; returns how many were new"""
+        added = defaultdict(list)
+        new = 0
+        for doc_id, document in page:
+            if document.get('status', 'submitted') != 'submitted':
+                continue
+            expanded = schema.expand_document(document, load_questions)
+            timestamp = timestamp_text(expanded['timestamp'])
+            language = expanded['language']
+            for item in expanded['questions_and_responses']:
+                text = item['response']
+                if not text:
+                    continue
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO answers (response_id, position, question_index, language,"
+                    " timestamp, response) VALUES (?, ?, ?, ?, ?, ?)",
+                    (doc_id, item['position'], item['question_index'], language, timestamp, text))
+                if not cursor.rowcount:
+                    # Indexed by an earlier run
+                    continue
+                number = cursor.lastrowid
+                new += 1
+                for term in index_terms(text):
+                    added[term].append(number)
+                added[language_term(language)].append(number)
+                if item['question_index'] is not None:
+                    added[question_term(item['question_index'])].append(number)
+
+        for term, numbers in added.items():
+            row = self._conn.execute("SELECT last FROM postings WHERE term = ?", (term,)).fetchone()
+            if row is None:
+                self._conn.execute("INSERT INTO postings (term, count, last, data) VALUES (?, ?, ?, ?)",
+                                   (term, len(numbers), numbers[-1], encode_postings(numbers)))
+            else:
+                self._conn.execute(
+                    # || yields text; the cast keeps the bytes as they are
+                    "UPDATE postings SET count = count + ?, last = ?, data = CAST(data || ? AS BLOB)"
+                    " WHERE term = ?",
+                    (len(numbers), numbers[-1], encode_postings(numbers, row[0]), term))
+        return new
+
+    def update(self, backend, page_size=500, reset=False):
+        """Index responses stored after the stored cursor; returns the number of new answers
+
+        The cursor follows ingested_at (see storage.py), so back-dated and
+        queued submissions are indexed by the update after they arrive.
+        """
+        load_questions = schema.QuestionBankSnapshots(backend)
+        with self._lock:
+            after = None if reset else json.loads(self._meta('after') or 'null')
+        total = 0
+        while True:
+            page = backend.scan(after=after, limit=page_size)
+            if not page:
+                break
+            last_id, last_document = page[-1]
+            after = scan_cursor(last_id, last_document)
+            with self._lock:
+                self._conn.execute("BEGIN")
+                try:
+                    total += self._add_page(page, load_questions)
+                    self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('after', ?)",
+                                       (json.dumps(after),))
+                    self._conn.execute("COMMIT")
+                except BaseException:
+                    self._conn.execute("ROLLBACK")
+                    raise
+            if len(page) < page_size:
+                break
+        return total
+
+    def postings(self, term):
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM postings WHERE term = ?", (term,)).fetchone()
+        return decode_postings(row[0]) if row else []
+
+    def search(self, query, language=None, question=None, limit=50):
+        """(number of matches, newest matching answers as dicts)"""
+        terms = query_terms(query)
+        if language:
+            terms.append(language_term(language))
+        if question is not None:
+            terms.append(question_term(question))
+        if not terms:
+            return 0, []
+        with self._lock:
+            counts = dict(self._conn.execute(
+                f"SELECT term, count FROM postings WHERE term IN ({','.join('?' * len(terms))})", terms))
+        if len(counts) < len(terms):
+            return 0, []
+        # Start from the rarest term so the working set stays small
+        ordered = sorted(terms, key=counts.get)
+        matches = set(self.postings(ordered[0]))
+        for term in ordered[1:]:
+            if not matches:
+                break
+            matches.intersection_update(self.postings(term))
+        newest = sorted(matches, reverse=True)[:limit]
+        if not newest:
+            return 0, []
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT number, response_id, position, question_index, language, timestamp, response"
+                f" FROM answers WHERE number IN ({','.join('?' * len(newest))}) ORDER BY number DESC",
+                newest)
+            columns = [column[0] for column in cursor.description]
+            return len(matches), [dict(zip(columns, row)) for row in cursor]
+
+    def stats(self):
+        with self._lock:
+            answers = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+            terms, size = self._conn.execute("SELECT COUNT(*), SUM(LENGTH(data)) FROM postings").fetchone()
+        return {'answers': answers, 'terms': terms, 'postings_bytes': size or 0}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_backend_arguments(parser)
+    parser.add_argument('query', nargs='?', help="words that must all appear in the answer")
+    parser.add_argument('--index', default=INDEX_PATH, help="SQLite file holding the index")
+    parser.add_argument('--update', action='store_true', help="index new responses before searching")
+    parser.add_argument('--reset', action='store_true', help="with --update, rescan every response")
+    parser.add_argument('--language', help="only answers from respondents using this language")
+    parser.add_argument('--question', type=int, help="only answers to this question bank index")
+    parser.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    index = SearchIndex(args.index)
+    if args.update:
+        started = time.perf_counter()
+        added = index.update(backend_from_args(args), reset=args.reset)
+        stats = index.stats()
+        print(f"indexed {added} new answers in {time.perf_counter() - started:.1f} s "
+              f"({stats['answers']} answers, {stats['terms']} terms, "
+              f"{stats['postings_bytes']:,} bytes of postings)")
+    if args.query or args.language or args.question is not None:
+        started = time.perf_counter()
+        total, hits = index.search(args.query or '', args.language, args.question, args.limit)
+        elapsed = (time.perf_counter() - started) * 1000
+        print(f"{total} matching answers ({elapsed:.1f} ms)")
+        for hit in hits:
+            print(f"[{hit['language']} q{hit['question_index']}] {hit['response_id']}/{hit['position']}: "
+                  f"{hit['response']}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
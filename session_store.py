@@ -0,0 +1,352 @@
+"""Respondents' survey progress kept outside the Streamlit process.
+
+    python session_store.py --serve --port 6379                 # Redis-protocol stand-in for local runs
+    python session_store.py TOKEN --url redis://localhost:6379/0
+    python session_store.py TOKEN --path local_data/sessions.sqlite3
+
+With a store configured ([session_store] secrets section or the
+SURVEY_SESSION_STORE_* environment variables), the app puts an opaque resume
+token in the URL (?resume=...) and saves the session under it, so a reconnect,
+a redeploy or a load balancer sending the browser to another worker or node
+picks up where the respondent left off.
+
+A session is a flat {field: JSON value} dict (SurveySession.to_state() plus
+the step and ids the app tracks), and every save sends only the fields that
+changed: usually one answer. The SQLite store merges them with json_patch;
+the Redis store keeps one hash per session and HSETs the changed fields.
+Any server speaking the Redis protocol works, including the small stand-in
+started with --serve.
+"""
+import argparse
+import json
+import os
+import re
+import secrets
+import socket
+import socketserver
+import sqlite3
+import sys
+import threading
+import time
+from urllib.parse import urlparse
+
+DEFAULT_PATH = 'local_data/sessions.sqlite3'
+DEFAULT_URL = 'redis://localhost:6379/0'
+DEFAULT_TTL = 14 * 24 * 3600
+KEY_PREFIX = 'survey:session:'
+
+_TOKEN = re.compile(r'[A-Za-z0-9_-]{16,64}')
+
+
+def new_token():
+    return secrets.token_urlsafe(16)
+
+
+def valid_token(token):
+    """True for strings new_token() could have made; anything else starts a new session"""
+    return isinstance(token, str) and _TOKEN.fullmatch(token) is not None
+
+
+class SQLiteSessionStore:
+    """Sessions as JSON objects in a SQLite file, shared by the workers of one machine"""
+
+    # Expired sessions are deleted every this many saves
+    PURGE_EVERY = 1000
+
+    def __init__(self, path=DEFAULT_PATH, ttl=DEFAULT_TTL):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.ttl = ttl
+        self._saves = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " token TEXT PRIMARY KEY,"
+            " state TEXT NOT NULL,"
+            " expires_at REAL NOT NULL"
+            ") WITHOUT ROWID"
+        )
+
+    def load(self, token):
+        """The stored state, or None for unknown and expired tokens"""
+        with self._lock:
+            row = self._conn.execute("SELECT state FROM sessions WHERE token = ? AND expires_at > ?",
+                                     (token, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, token, delta):
+        """Merge changed fields into the stored state (None values remove a field)"""
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO sessions (token, state, expires_at) VALUES (?, json_patch('{}', ?), ?)"
+                " ON CONFLICT (token) DO UPDATE SET state = json_patch(state, excluded.state),"
+                " expires_at = excluded.expires_at",
+                (token, json.dumps(delta, ensure_ascii=False), expires_at))
+            self._saves += 1
+            if self._saves % self.PURGE_EVERY == 0:
+                self._conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (time.time(),))
+
+    def delete(self, token):
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE token = ?", (token,))
+
+
+class RespError(Exception):
+    """An error reply from a Redis-protocol server"""
+
+
+def encode_command(args):
+    out = [b'*%d\r\n' % len(args)]
+    for arg in args:
+        data = arg if isinstance(arg, bytes) else str(arg).encode('utf-8')
+        out.append(b'$%d\r\n%s\r\n' % (len(data), data))
+    return b''.join(out)
+
+
+def read_reply(reader):
+    """One RESP2 value from a buffered binary stream; error replies are returned as RespError"""
+    line = reader.readline()
+    if not line.endswith(b'\r\n'):
+        raise ConnectionError("Connection closed mid-reply")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b'+':
+        return rest.decode('utf-8')
+    if kind == b'-':
+        return RespError(rest.decode('utf-8'))
+    if kind == b':':
+        return int(rest)
+    if kind == b'$':
+        size = int(rest)
+        if size < 0:
+            return None
+        data = reader.read(size + 2)
+        if len(data) != size + 2:
+            raise ConnectionError("Connection closed mid-reply")
+        return data[:-2]
+    if kind == b'*':
+        size = int(rest)
+        return None if size < 0 else [read_reply(reader) for _ in range(size)]
+    raise ConnectionError(f"Unexpected reply {line!r}")
+
+
+class RespClient:
+    """Minimal Redis-protocol client: one connection, commands pipelined per call"""
+
+    def __init__(self, url=DEFAULT_URL, timeout=2.0):
+        parsed = urlparse(url)
+        if parsed.scheme != 'redis':
+            raise ValueError(f"Not a redis:// URL: {url}")
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self.timeout = timeout
+        self._sock = None
+        self._reader = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._sock, self._reader = sock, sock.makefile('rb')
+        setup = []
+        if self.password:
+            setup.append(('AUTH', self.password))
+        if self.db:
+            setup.append(('SELECT', self.db))
+        if setup:
+            self._roundtrip(setup)
+
+    def _roundtrip(self, commands):
+        self._sock.sendall(b''.join(encode_command(command) for command in commands))
+        replies = [read_reply(self._reader) for _ in commands]
+        for reply in replies:
+            if isinstance(reply, RespError):
+                raise reply
+        return replies
+
+    def execute(self, *commands):
+        """Send commands in one write and return their replies
+
+        Reconnects and resends once when the connection was dropped; the
+        store only sends commands that are safe to repeat.
+        """
+        with self._lock:
+            for attempt in (1, 2):
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    return self._roundtrip(commands)
+                except (OSError, ConnectionError):
+                    self.close()
+                    if attempt == 2:
+                        raise
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = self._reader = None
+
+
+class RedisSessionStore:
+    """Sessions as Redis hashes of JSON-encoded fields, shared by every node"""
+
+    def __init__(self, url=DEFAULT_URL, ttl=DEFAULT_TTL, client=None):
+        self.ttl = int(ttl)
+        self.client = client or RespClient(url)
+
+    def load(self, token):
+        (fields,) = self.client.execute(('HGETALL', KEY_PREFIX + token))
+        if not fields:
+            return None
+        return {fields[i].decode('utf-8'): json.loads(fields[i + 1]) for i in range(0, len(fields), 2)}
+
+    def save(self, token, delta):
+        if not delta:
+            return
+        key = KEY_PREFIX + token
+        pairs = [item for field, value in delta.items() for item in (field, json.dumps(value, ensure_ascii=False))]
+        self.client.execute(('HSET', key, *pairs), ('EXPIRE', key, self.ttl))
+
+    def delete(self, token):
+        self.client.execute(('DEL', KEY_PREFIX + token))
+
+
+def create_store(config):
+    """The store named by config['backend'] (sqlite or redis), or None to keep sessions in process"""
+    kind = config.get('backend') or 'none'
+    ttl = float(config.get('ttl', DEFAULT_TTL))
+    if kind == 'none':
+        return None
+    if kind == 'sqlite':
+        return SQLiteSessionStore(config.get('path', DEFAULT_PATH), ttl)
+    if kind == 'redis':
+        return RedisSessionStore(config.get('url', DEFAULT_URL), ttl)
+    raise ValueError(f"Unknown session store: {kind}")
+
+
+class StandInServer(socketserver.ThreadingTCPServer):
+    """In-memory server for the hash commands the store uses (not for production data)"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        super().__init__(address, _StandInHandler)
+        self.data = {}
+        self.expires = {}
+        self.lock = threading.Lock()
+
+    def _live(self, key):
+        deadline = self.expires.get(key)
+        if deadline is not None and deadline <= time.time():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return self.data.get(key)
+
+    def command(self, name, args):
+        with self.lock:
+            if name == 'PING':
+                return 'PONG'
+            if name in ('AUTH', 'SELECT'):
+                return 'OK'
+            if name == 'HSET' and len(args) >= 3 and len(args) % 2 == 1:
+                fields = self._live(args[0])
+                if fields is None:
+                    fields = self.data[args[0]] = {}
+                added = 0
+                for field, value in zip(args[1::2], args[2::2]):
+                    added += field not in fields
+                    fields[field] = value
+                return added
+            if name == 'HGETALL' and len(args) == 1:
+                fields = self._live(args[0]) or {}
+                return [item for pair in fields.items() for item in pair]
+            if name == 'HDEL' and len(args) >= 2:
+                fields = self._live(args[0]) or {}
+                return sum(fields.pop(field, None) is not None for field in args[1:])
+            if name == 'DEL' and args:
+                removed = sum(self._live(key) is not None for key in args)
+                for key in args:
+                    self.data.pop(key, None)
+                    self.expires.pop(key, None)
+                return removed
+            if name == 'EXPIRE' and len(args) == 2:
+                if self._live(args[0]) is None:
+                    return 0
+                self.expires[args[0]] = time.time() + int(args[1])
+                return 1
+        return RespError(f"ERR unsupported command or arguments '{name}'")
+
+
+class _StandInHandler(socketserver.StreamRequestHandler):
+    def setup(self):
+        # Replies to pipelined commands go out as separate writes
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        super().setup()
+
+    def handle(self):
+        while True:
+            try:
+                request = read_reply(self.rfile)
+            except (ConnectionError, ValueError):
+                return
+            if not isinstance(request, list) or not request:
+                return
+            name = request[0].decode('utf-8').upper()
+            reply = self.server.command(name, request[1:])
+            self.wfile.write(_encode_reply(reply))
+
+
+def _encode_reply(value):
+    if isinstance(value, RespError):
+        return b'-%s\r\n' % str(value).encode('utf-8')
+    if isinstance(value, str):
+        return b'+%s\r\n' % value.encode('utf-8')
+    if isinstance(value, int):
+        return b':%d\r\n' % value
+    if isinstance(value, list):
+        return b'*%d\r\n' % len(value) + b''.join(_encode_reply(item) for item in value)
+    return b'$%d\r\n%s\r\n' % (len(value), value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('token', nargs='?', help="print the state stored under this resume token")
+    parser.add_argument('--path', help="SQLite session file")
+    parser.add_argument('--url', help="redis:// URL of the session server")
+    parser.add_argument('--serve', action='store_true', help="run the Redis-protocol stand-in")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6379)
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        with StandInServer((args.host, args.port)) as server:
+            print(f"session store stand-in on {args.host}:{args.port}")
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+        return 0
+    if not args.token:
+        parser.error("give a resume token or --serve")
+    store = RedisSessionStore(args.url) if args.url else SQLiteSessionStore(args.path or DEFAULT_PATH)
+    state = store.load(args.token)
+    if state is None:
+        print("no session stored under this token")
+        return 1
+    print(json.dumps(state, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
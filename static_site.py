@@ -0,0 +1,427 @@
+"""Export the survey as a static HTML/JS bundle for the ingest server mode.
+
+    python static_site.py --out site/
+    python static_site.py --out site/ --weights       # pick questions by the current answer counts
+    python static_site.py --out site/pilot/ --study pilot
+    python ingest_server.py --static site/
+
+The page runs the whole consent, demographics, questions and final flow in
+the browser and sends one POST to the ingest endpoint at the end, in the
+payload shape described in submissions.py. Questions, messages and the
+header, consent and progress markup come from the study's current content
+revision (the same fragments render.py builds for the Streamlit app), and
+the session shape (questions per session, pinned first and last questions,
+languages) from its studies.json entry, so rebuild the bundle whenever
+either changes.
+
+The browser cannot ask the coverage-balanced scheduler (scheduler.py) for
+questions. With --weights the build reads the answer counts from storage and
+bakes the scheduler's weights into the bundle; they stay as they were at
+build time, so rebuild it now and then to keep coverage even. Without
+--weights every other question is equally likely.
+"""
+import argparse
+import json
+import os
+import sys
+
+import assets
+import i18n
+import render
+import studies
+from aggregates import AggregateView
+from scheduler import coverage_weights
+from storage import add_backend_arguments, backend_from_args
+from survey_content import DEMOGRAPHIC_CODES
+
+# Languages written right to left
+RTL_LANGUAGES = ('ar', 'fa', 'he', 'ur')
+
+EXTRA_CSS = """
+    body { font-family: "Source Sans Pro", system-ui, sans-serif; margin: 0; background: #fff; color: #31333f; }
+    #app { max-width: 1100px; margin: 0 auto; padding: 1rem 2rem 4rem; }
+    .toolbar { display: flex; justify-content: flex-end; }
+    .row { display: flex; gap: 1rem; margin-top: 1rem; }
+    .row > * { flex: 1; }
+    button { padding: 0.6rem 1rem; border-radius: 8px; border: 1px solid #d0d3db; background: #fff; cursor: pointer; font-size: 1rem; }
+    button.primary { background: #667eea; border-color: #667eea; color: #fff; }
+    button:disabled { opacity: 0.6; cursor: wait; }
+    label { display: block; margin: 1rem 0 0.3rem; font-weight: 600; }
+    select, textarea { width: 100%; box-sizing: border-box; padding: 0.6rem; font: inherit; border-radius: 8px; border: 1px solid #d0d3db; }
+    textarea { min-height: 150px; }
+    .error { color: #b00020; margin-top: 1rem; }
+    .thanks { text-align: center; padding: 3rem; }
+"""
+
+PAGE = """<!DOCTYPE html>
+<html lang="{language}" dir="{direction}">
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>{title}</title>
+<link rel="stylesheet" href="{stylesheet}">
+<style>{extra_css}</style>
+</head>
+<body>
+<div id="app"></div>
+<script id="survey-data" type="application/json">{data}</script>
+<script src="survey.js"></script>
+</body>
+</html>
+"""
+
+SCRIPT = r"""
+(function () {
+  'use strict';
+  var DATA = JSON.parse(document.getElementById('survey-data').textContent);
+  var STORE = 'survey-state-' + DATA.study + '-' + DATA.contentVersion;
+  var app = document.getElementById('app');
+
+  function uuid() {
+    if (window.crypto && crypto.randomUUID) return crypto.randomUUID().replace(/-/g, '');
+    var bytes = new Uint8Array(16);
+    crypto.getRandomValues(bytes);
+    bytes[6] = (bytes[6] & 0x0f) | 0x40;
+    bytes[8] = (bytes[8] & 0x3f) | 0x80;
+    return Array.prototype.map.call(bytes, function (b) { return ('0' + b.toString(16)).slice(-2); }).join('');
+  }
+
+  function pickQuestions() {
+    // Pinned questions first and last; the rest drawn like scheduler.py, by the weights baked in at build time
+    var keyed = DATA.candidates.map(function (index, i) {
+      return { index: index, key: Math.pow(Math.random(), 1 / DATA.weights[i]) };
+    });
+    keyed.sort(function (a, b) { return b.key - a.key; });
+    var pool = keyed.slice(0, DATA.picks).map(function (item) { return item.index; });
+    for (var j = pool.length - 1; j > 0; j--) {
+      var k = Math.floor(Math.random() * (j + 1)), t = pool[j];
+      pool[j] = pool[k]; pool[k] = t;
+    }
+    return DATA.pinnedFirst.concat(pool, DATA.pinnedLast);
+  }
+
+  function load() {
+    try {
+      var saved = JSON.parse(sessionStorage.getItem(STORE));
+      if (saved && saved.token) return saved;
+    } catch (e) { /* start over */ }
+    var ids = pickQuestions();
+    return {
+      token: uuid(), language: DATA.defaultLanguage, step: 0, current: 0, submitted: false,
+      questionIds: ids, responses: ids.map(function () { return ''; }),
+      demographics: {}, suggestions: ''
+    };
+  }
+
+  var state = load();
+
+  function save() {
+    try { sessionStorage.setItem(STORE, JSON.stringify(state)); } catch (e) { /* private mode */ }
+  }
+
+  function t(key, values) {
+    var text = DATA.messages[state.language][key];
+    return text.replace(/\{(\w+)\}/g, function (match, name) {
+      return values && name in values ? values[name] : match;
+    });
+  }
+
+  function el(tag, attrs, children) {
+    var node = document.createElement(tag);
+    Object.keys(attrs || {}).forEach(function (name) {
+      if (name === 'text') node.textContent = attrs[name];
+      else if (name === 'html') node.innerHTML = attrs[name];
+      else if (name.slice(0, 2) === 'on') node.addEventListener(name.slice(2), attrs[name]);
+      else node.setAttribute(name, attrs[name]);
+    });
+    (children || []).forEach(function (child) { node.appendChild(child); });
+    return node;
+  }
+
+  function button(label, onclick, primary) {
+    return el('button', { type: 'button', text: label, onclick: onclick, 'class': primary ? 'primary' : '' });
+  }
+
+  function go(changes) {
+    Object.keys(changes).forEach(function (key) { state[key] = changes[key]; });
+    save();
+    render();
+    window.scrollTo(0, 0);
+  }
+
+  function progress() {
+    var fragments = DATA.fragments[state.language];
+    if (state.submitted) return fragments.progress['4'];
+    if (state.step === 2) return fragments.progress['2.' + state.current];
+    return fragments.progress[String(state.step)];
+  }
+
+  function consentStep() {
+    return [
+      el('h2', { text: t('consent_header') }),
+      el('div', { html: DATA.fragments[state.language].consent }),
+      el('div', { 'class': 'row' }, [button(t('agree_button'), function () { go({ step: 1 }); }, true)])
+    ];
+  }
+
+  function demographicsStep() {
+    var nodes = [el('h2', { text: t('demographics_header') })];
+    var labels = { age: 'age_group', education: 'education', experience: 'chatbot_experience' };
+    Object.keys(DATA.demographics).forEach(function (field) {
+      var select = el('select', {
+        onchange: function () { state.demographics[field] = select.value; save(); }
+      }, DATA.demographics[field].map(function (code) {
+        return el('option', { value: code, text: t('option.' + field + '.' + code) });
+      }));
+      select.value = state.demographics[field] || DATA.demographics[field][0];
+      state.demographics[field] = select.value;
+      nodes.push(el('label', { text: t(labels[field]) }), select);
+    });
+    nodes.push(el('div', { 'class': 'row' }, [
+      button(t('previous'), function () { go({ step: 0 }); }),
+      button(t('skip'), function () { go({ step: 2, current: 0 }); }),
+      button(t('next'), function () { go({ step: 2, current: 0 }); }, true)
+    ]));
+    return nodes;
+  }
+
+  function questionStep() {
+    var position = state.current, last = state.questionIds.length - 1;
+    var question = DATA.questions[state.questionIds[position]][DATA.languages.indexOf(state.language)];
+    var answer = el('textarea', {
+      placeholder: t('prompt_placeholder'),
+      oninput: function () { state.responses[position] = answer.value; save(); }
+    });
+    answer.value = state.responses[position];
+    var back = position > 0
+      ? button(t('previous'), function () { go({ current: position - 1 }); })
+      : button('← ' + t('step_background'), function () { go({ step: 1 }); });
+    var forward = position < last
+      ? button(t('next'), function () { go({ current: position + 1 }); }, true)
+      : button(t('step_final') + ' →', function () { go({ step: 3 }); }, true);
+    return [
+      el('div', { 'class': 'question-counter', text: t('question_of', { current: position + 1, total: last + 1 }) }),
+      el('div', { 'class': 'question-card' }, [el('div', { 'class': 'scenario-text', text: '💬 ' + question })]),
+      el('label', { text: t('your_prompt') }),
+      answer,
+      el('hr'),
+      el('div', { 'class': 'row' }, [
+        back,
+        button(t('skip'), function () { go(position < last ? { current: position + 1 } : { step: 3 }); }),
+        forward
+      ])
+    ];
+  }
+
+  function payload() {
+    return {
+      token: state.token,
+      study: DATA.study,
+      language: state.language,
+      demographics: state.demographics,
+      questions_and_responses: state.questionIds.map(function (index, position) {
+        var question = DATA.questions[index];
+        return {
+          // The text in any language identifies the question, for studies without English too
+          question_en: question[Math.max(DATA.languages.indexOf('en'), 0)],
+          question_ar: question[DATA.languages.indexOf('ar')],
+          response: state.responses[position]
+        };
+      }),
+      final_questions: { suggestions: state.suggestions }
+    };
+  }
+
+  function submit(submitButton, errorBox) {
+    submitButton.disabled = true;
+    errorBox.textContent = '';
+    var attempt = 0;
+    function send() {
+      fetch(DATA.endpoint, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(payload())
+      }).then(function (response) {
+        if (response.ok) return go({ submitted: true });
+        if (response.status >= 500 && attempt < 4) return retry();
+        return response.json().catch(function () { return {}; }).then(function (body) {
+          throw new Error(body.error || response.statusText);
+        });
+      }).catch(function (error) {
+        if (error instanceof TypeError && attempt < 4) return retry();
+        submitButton.disabled = false;
+        errorBox.textContent = t('save_error', { error: error.message });
+      });
+    }
+    function retry() {
+      // The same token is sent again, so a retry never stores the response twice
+      attempt += 1;
+      setTimeout(send, 500 * Math.pow(2, attempt));
+    }
+    send();
+  }
+
+  function finalStep() {
+    var suggestions = el('textarea', {
+      placeholder: t('suggestions_placeholder'),
+      oninput: function () { state.suggestions = suggestions.value; save(); }
+    });
+    suggestions.value = state.suggestions;
+    var errorBox = el('div', { 'class': 'error' });
+    var submitButton = button(t('submit'), function () { submit(submitButton, errorBox); }, true);
+    return [
+      el('h2', { text: t('final_header') }),
+      el('label', { text: t('suggestions') }),
+      suggestions,
+      el('div', { 'class': 'row' }, [
+        button(t('previous'), function () { go({ step: 2, current: state.questionIds.length - 1 }); }),
+        submitButton
+      ]),
+      errorBox
+    ];
+  }
+
+  function thankYou() {
+    return [el('div', { 'class': 'thanks' }, [
+      el('h1', { text: t('thank_you') }),
+      el('p', { text: t('thank_you_message') }),
+      el('p', { text: '🔬 ' + t('thank_you_impact') }),
+      el('p', { text: '🛡️ ' + t('thank_you_safety') })
+    ])];
+  }
+
+  function render() {
+    var language = state.language;
+    var next = DATA.languages[(DATA.languages.indexOf(language) + 1) % DATA.languages.length];
+    document.documentElement.lang = language;
+    document.documentElement.dir = DATA.rtl.indexOf(language) >= 0 ? 'rtl' : 'ltr';
+    document.title = t('page_title');
+    var steps = [consentStep, demographicsStep, questionStep, finalStep];
+    var body = state.submitted ? thankYou() : steps[state.step]();
+    app.innerHTML = '';
+    app.appendChild(el('div', { 'class': 'toolbar' }, [
+      el('button', {
+        type: 'button', title: t('language_help'), text: DATA.messages[next].language_button,
+        onclick: function () { go({ language: next }); }
+      })
+    ]));
+    app.appendChild(el('div', { html: DATA.fragments[language].header }));
+    app.appendChild(el('div', { html: progress() }));
+    body.forEach(function (node) { app.appendChild(node); });
+  }
+
+  render();
+})();
+"""
+
+
+def fragments(version, language, questions=render.QUESTIONS_PER_SESSION):
+    """The markup render.py builds for the app, keyed the way survey.js looks it up"""
+    progress = {}
+    for step in range(render.TOTAL_STEPS + 1):
+        progress[str(step)] = ''.join(render.progress_html(language, version, step, render.TOTAL_STEPS))
+    for substep in range(questions):
+        progress[f'2.{substep}'] = ''.join(render.progress_html(
+            language, version, 2, render.TOTAL_STEPS, substep, questions))
+    return {
+        'header': render.header_html(language, version),
+        'consent': render.consent_html(language, version),
+        'progress': progress,
+    }
+
+
+def answer_counts(backend, study):
+    """{question bank index: answers} of a study's stored responses, from count() queries"""
+    if study.collection:
+        backend = backend.with_collection(study.collection)
+    view = AggregateView(backend, languages=study.languages, bank_size=len(study.content.questions))
+    return view.question_counts()
+
+
+def bundle_data(endpoint, study, default_language=None, counts=None, strength=1.0):
+    """Everything survey.js needs, from a study's current content revision
+
+    With counts ({bank index: answers}) the other questions are weighted
+    like the scheduler would weight them now; without, evenly.
+    """
+    snapshot = study.content
+    catalog = i18n.catalog(snapshot.version)
+    languages = list(study.languages)
+    candidates = study.candidates()
+    weights = coverage_weights({index: counts.get(index, 0) for index in candidates}, strength) if counts else {}
+    first, last = study.pinned()
+    return {
+        'study': study.id,
+        'contentVersion': snapshot.version,
+        'endpoint': endpoint,
+        'languages': languages,
+        'defaultLanguage': default_language or languages[0],
+        'rtl': [language for language in languages if language in RTL_LANGUAGES],
+        'pinnedFirst': first,
+        'pinnedLast': last,
+        'candidates': candidates,
+        'weights': [weights.get(index, 1.0) for index in candidates],
+        'picks': study.picks,
+        'questions': [[question[language] for language in languages] for question in snapshot.questions],
+        'messages': {language: {key: catalog.text(language, key) for key in snapshot.translations[language]}
+                     for language in languages},
+        'demographics': {field: list(codes) for field, codes in DEMOGRAPHIC_CODES.items()},
+        'fragments': {language: fragments(snapshot.version, language, study.questions) for language in languages},
+    }
+
+
+def build(out_dir, study, endpoint='/api/submit', default_language=None, counts=None, strength=1.0):
+    """Write index.html, survey.js and the stylesheet into out_dir; returns the page path"""
+    data = bundle_data(endpoint, study, default_language, counts, strength)
+    default_language = data['defaultLanguage']
+    # The app's stylesheet, fingerprinted next to the page
+    stylesheet = assets.build(static_dir=out_dir)
+    # Keep '</script>' inside strings from closing the data block
+    embedded = json.dumps(data, ensure_ascii=False, separators=(',', ':')).replace('</', '<\\/')
+    page = PAGE.format(
+        language=default_language,
+        direction='rtl' if default_language in RTL_LANGUAGES else 'ltr',
+        title=data['messages'][default_language]['page_title'],
+        stylesheet=assets.asset_url(stylesheet, '.'),
+        extra_css=EXTRA_CSS,
+        data=embedded,
+    )
+    os.makedirs(out_dir, exist_ok=True)
+    for name, text in (('survey.js', SCRIPT.lstrip()), ('index.html', page)):
+        path = os.path.join(out_dir, name)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(path + '.tmp', path)
+    return os.path.join(out_dir, 'index.html')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the survey as a static HTML/JS bundle")
+    parser.add_argument('--out', default='site', help="output directory")
+    parser.add_argument('--endpoint', default='/api/submit',
+                        help="URL the finished payload is POSTed to (absolute for a different host)")
+    parser.add_argument('--language', help="language shown first (default: the study's first)")
+    parser.add_argument('--study', help="study to export (default: the default one in studies.json)")
+    parser.add_argument('--studies', default=studies.STUDIES_PATH, help="study definitions (see studies.py)")
+    parser.add_argument('--weights', action='store_true',
+                        help="weight the questions by the answer counts in storage (see the backend options)")
+    parser.add_argument('--strength', type=float, default=1.0, help="scheduler strength for --weights")
+    add_backend_arguments(parser)
+    args = parser.parse_args(argv)
+
+    try:
+        study = studies.load(args.studies, args.collection).get(args.study)
+    except KeyError:
+        parser.error(f"Unknown study: {args.study}")
+    counts = None
+    if args.weights:
+        backend = backend_from_args(args)
+        counts = answer_counts(backend, study)
+        backend.close()
+    page = build(args.out, study, args.endpoint, args.language, counts, args.strength)
+    print(f"wrote {page} ({os.path.getsize(page):,} bytes), survey.js and the stylesheet")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,669 @@
+"""Storage backends for survey responses: Firestore, SQLite, JSON lines and memory.
+
+    python storage.py --backfill-ingested     # give documents stored before ingested_at one
+"""
+import argparse
+import copy
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import metrics
+
+# Firestore rejects a WriteBatch with more than 500 writes
+FIRESTORE_BATCH_LIMIT = 500
+
+DEFAULT_COLLECTION = "survey_responses"
+
+# Server time of the write that gave a document its timestamp (submitted it);
+# scan() pages in this order, so documents with back-dated timestamps and
+# submissions that waited in a queue are still read after earlier pages
+INGESTED_FIELD = "ingested_at"
+
+
+class AlreadyExists(Exception):
+    """A 'create' write found its document already there; nothing in the commit was applied"""
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def timestamp_text(value):
+    """ISO text for a timestamp, in naive UTC so values from every backend compare equal"""
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value.isoformat()
+    return value
+
+
+def _position(document):
+    """Where a document sorts in scan(); documents stored before ingested_at use their timestamp"""
+    return timestamp_text(document.get(INGESTED_FIELD) or document.get('timestamp'))
+
+
+def scan_cursor(doc_id, document):
+    """The `after` cursor that continues a scan past this document"""
+    return [_position(document), doc_id]
+
+
+def _stamped(writes, stamp):
+    """Writes that set a timestamp, with ingested_at set to the commit's server time"""
+    return [(op, doc_id, {**payload, INGESTED_FIELD: stamp})
+            if op != 'increment' and 'timestamp' in payload else (op, doc_id, payload)
+            for op, doc_id, payload in writes]
+
+
+def _after_cursor(timestamp, doc_id, after):
+    """Whether a (timestamp, id) position sorts after the cursor; None means the start"""
+    return after is None or (timestamp, doc_id) > tuple(after)
+
+
+def merge_fields(document, fields):
+    """Return a copy of document with fields merged in, like Firestore set(merge=True)"""
+    result = dict(document)
+    for key, value in fields.items():
+        if isinstance(value, dict) and isinstance(result.get(key), dict):
+            result[key] = merge_fields(result[key], value)
+        else:
+            result[key] = value
+    return result
+
+
+def increment_fields(document, amounts):
+    """Return a copy of document with nested numeric amounts added, like Firestore Increment"""
+    result = dict(document)
+    for key, value in amounts.items():
+        current = result.get(key)
+        if isinstance(value, dict):
+            result[key] = increment_fields(current if isinstance(current, dict) else {}, value)
+        else:
+            result[key] = (current if isinstance(current, (int, float)) else 0) + value
+    return result
+
+
+def apply_write(document, op, payload):
+    """The document that results from applying one write to `document` (None if missing)"""
+    if op == 'set':
+        return payload
+    if op == 'create':
+        if document is not None:
+            raise AlreadyExists("Document already exists")
+        return payload
+    if op == 'merge':
+        return merge_fields(document or {}, payload)
+    if op == 'increment':
+        return increment_fields(document or {}, payload)
+    raise ValueError(f"Unsupported write operation: {op}")
+
+
+def is_transient(error):
+    """Whether a failed write may succeed if retried: timeouts, unavailability, lock contention"""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    if isinstance(error, sqlite3.OperationalError):
+        # Only SQLITE_BUSY/SQLITE_LOCKED; a missing table or a full disk stays an error
+        code = getattr(error, 'sqlite_errorcode', None)
+        if code is not None:
+            return code & 0xff in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+        message = str(error)
+        return 'locked' in message or 'busy' in message
+    try:
+        from google.api_core import exceptions
+    except ImportError:
+        return False
+    return isinstance(error, (
+        exceptions.Aborted,
+        exceptions.DeadlineExceeded,
+        exceptions.InternalServerError,
+        exceptions.ResourceExhausted,
+        exceptions.ServiceUnavailable,
+        exceptions.Unknown,
+    ))
+
+
+def split_path(doc_id, default_collection):
+    """Split 'collection/.../id' into (collection, id); bare ids use the default collection"""
+    collection, _, name = doc_id.rpartition('/')
+    return (collection or default_collection), name
+
+
+def dump_document(document):
+    """Serialize a response document to compact JSON"""
+    return json.dumps(document, ensure_ascii=False, separators=(',', ':'), default=_json_default)
+
+
+def _field(document, path):
+    for part in path.split('.'):
+        if not isinstance(document, dict):
+            return None
+        document = document.get(part)
+    return document
+
+
+def matches(document, filters):
+    """Whether a document passes (field_path, op, value) filters; op is '==' or 'array_contains'"""
+    for path, op, value in filters:
+        actual = _field(document, path)
+        if op == '==':
+            if actual != value:
+                return False
+        elif op == 'array_contains':
+            if not isinstance(actual, list) or value not in actual:
+                return False
+        else:
+            raise ValueError(f"Unsupported filter operator: {op}")
+    return True
+
+
+def _scan_documents(items, after, limit):
+    """In-memory version of StorageBackend.scan over (doc_id, document) pairs"""
+    keyed = []
+    for doc_id, document in items:
+        position = _position(document)
+        if position is not None and _after_cursor(position, doc_id, after):
+            keyed.append(((position, doc_id), doc_id, document))
+    keyed.sort(key=lambda entry: entry[0])
+    return [(doc_id, document) for _, doc_id, document in keyed[:limit]]
+
+
+class StorageBackend:
+    """Where survey responses are written
+
+    Writes are (op, doc_id, payload) triples: 'set' replaces the whole document,
+    'merge' merges nested fields into it and creates it if missing,
+    'increment' adds the nested numbers in payload to the stored ones, and
+    'create' writes a new document but fails the whole commit with
+    AlreadyExists if it is already there. A doc_id
+    containing '/' is a full 'collection/id' path; bare ids live in the
+    backend's own collection. Writes that set 'timestamp' also get
+    ingested_at, the backend's own time for the commit.
+    """
+
+    name = "base"
+
+    def apply_batch(self, writes):
+        """Apply a list of (op, doc_id, payload) writes as one commit"""
+        raise NotImplementedError
+
+    def write_batch(self, items):
+        """Write a list of (doc_id, document) pairs"""
+        self.apply_batch([('set', doc_id, document) for doc_id, document in items])
+
+    def write(self, doc_id, document):
+        """Write a single document"""
+        self.write_batch([(doc_id, document)])
+
+    def merge(self, doc_id, fields):
+        """Merge fields into a single document"""
+        self.apply_batch([('merge', doc_id, fields)])
+
+    def get(self, doc_id):
+        """Read one document, or None if it does not exist"""
+        raise NotImplementedError
+
+    def scan(self, after=None, limit=500):
+        """Up to `limit` (doc_id, document) pairs with a timestamp, ordered by (ingested_at, id)
+
+        `after` is a scan_cursor() of the last document read; only documents
+        stored after it are returned. Drafts have no timestamp yet and are
+        never returned.
+        """
+        raise NotImplementedError
+
+    def count(self, filters):
+        """Number of documents matching (field_path, op, value) filters"""
+        raise NotImplementedError
+
+    def _ingest_stamp(self):
+        """ingested_at for this commit, later than any earlier commit's; called under the write lock"""
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        last = getattr(self, '_last_ingested', None)
+        if last is not None and now <= last:
+            # The clock stepped back: keep the scan order
+            now = last + timedelta(microseconds=1)
+        self._last_ingested = now
+        return now
+
+    def backfill_ingested(self, page_size=500):
+        """Give documents stored before ingested_at existed their timestamp as ingested_at; returns how many
+
+        Only Firestore needs this (its queries skip documents without the
+        ordering field); the other backends fall back to the timestamp.
+        """
+        return 0
+
+    def with_collection(self, collection):
+        """A view of the same storage and connection whose bare ids, scans and counts use another collection"""
+        view = copy.copy(self)
+        view.collection = collection
+        return view
+
+    def warm_up(self):
+        """Open connections ahead of the first write"""
+
+    def close(self):
+        pass
+
+
+class FirestoreBackend(StorageBackend):
+    """Writes responses to a Firestore collection using WriteBatch commits"""
+
+    name = "firestore"
+
+    def __init__(self, db, collection=DEFAULT_COLLECTION):
+        self.db = db
+        self.collection = collection
+
+    def _ref(self, doc_id):
+        if '/' in doc_id:
+            return self.db.document(doc_id)
+        return self.db.collection(self.collection).document(doc_id)
+
+    def apply_batch(self, writes):
+        from google.cloud.firestore import SERVER_TIMESTAMP
+
+        writes = _stamped(writes, SERVER_TIMESTAMP)
+        for start in range(0, len(writes), FIRESTORE_BATCH_LIMIT):
+            batch = self.db.batch()
+            for op, doc_id, payload in writes[start:start + FIRESTORE_BATCH_LIMIT]:
+                if op == 'increment':
+                    batch.set(self._ref(doc_id), self._increments(payload), merge=True)
+                elif op == 'create':
+                    batch.create(self._ref(doc_id), payload)
+                else:
+                    batch.set(self._ref(doc_id), payload, merge=(op == 'merge'))
+            try:
+                batch.commit()
+            except Exception as error:
+                from google.api_core import exceptions
+
+                if isinstance(error, (exceptions.AlreadyExists, exceptions.Conflict)):
+                    raise AlreadyExists(str(error)) from error
+                raise
+
+    @classmethod
+    def _increments(cls, amounts):
+        from google.cloud.firestore import Increment
+
+        return {
+            key: cls._increments(value) if isinstance(value, dict) else Increment(value)
+            for key, value in amounts.items()
+        }
+
+    def write(self, doc_id, document):
+        self._ref(doc_id).set(document)
+
+    def get(self, doc_id):
+        snapshot = self._ref(doc_id).get()
+        return snapshot.to_dict() if snapshot.exists else None
+
+    def scan(self, after=None, limit=500):
+        query = (self.db.collection(self.collection)
+                 .order_by(INGESTED_FIELD)
+                 .order_by('__name__')
+                 .limit(limit))
+        if after is not None:
+            ingested = datetime.fromisoformat(after[0]).replace(tzinfo=timezone.utc)
+            last = self.db.collection(self.collection).document(after[1])
+            query = query.start_after({INGESTED_FIELD: ingested, '__name__': last})
+        return [(snapshot.id, snapshot.to_dict()) for snapshot in query.stream()]
+
+    def backfill_ingested(self, page_size=500):
+        query = self.db.collection(self.collection).order_by('timestamp').order_by('__name__').limit(page_size)
+        filled = 0
+        last = None
+        while True:
+            page = list((query.start_after(last) if last is not None else query).stream())
+            missing = [snapshot for snapshot in page if INGESTED_FIELD not in snapshot.to_dict()]
+            if missing:
+                # A merge without 'timestamp' is not stamped again
+                self.apply_batch([('merge', snapshot.reference.path, {INGESTED_FIELD: snapshot.get('timestamp')})
+                                  for snapshot in missing])
+                filled += len(missing)
+            if len(page) < page_size:
+                return filled
+            last = page[-1]
+
+    def count(self, filters):
+        from google.cloud.firestore_v1.base_query import FieldFilter
+
+        query = self.db.collection(self.collection)
+        for path, op, value in filters:
+            query = query.where(filter=FieldFilter(path, op, value))
+        # An aggregation query: billed per 1000 index entries, no documents are read
+        result = query.count().get()
+        return int(result[0][0].value)
+
+    def warm_up(self):
+        # A single document read opens the gRPC channel and fetches auth tokens
+        self.db.collection(self.collection).document("_warmup").get()
+
+
+class SQLiteBackend(StorageBackend):
+    """Stores responses as JSON rows in a local SQLite file in WAL mode"""
+
+    name = "sqlite"
+
+    def __init__(self, path, collection=DEFAULT_COLLECTION):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.collection = collection
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            " collection TEXT NOT NULL,"
+            " id TEXT NOT NULL,"
+            # The scan position: ingested_at, or the timestamp of documents stored before it
+            " timestamp TEXT,"
+            " document TEXT NOT NULL,"
+            " PRIMARY KEY (collection, id))"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS documents_by_time ON documents (collection, timestamp, id)"
+        )
+
+    def _read(self, collection, name):
+        row = self._conn.execute(
+            "SELECT document FROM documents WHERE collection = ? AND id = ?",
+            (collection, name),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get(self, doc_id):
+        with self._lock:
+            return self._read(*split_path(doc_id, self.collection))
+
+    def scan(self, after=None, limit=500):
+        sql = ("SELECT id, document FROM documents"
+               " WHERE collection = ? AND timestamp IS NOT NULL")
+        params = [self.collection]
+        if after is not None:
+            sql += " AND (timestamp > ? OR (timestamp = ? AND id > ?))"
+            params += [after[0], after[0], after[1]]
+        sql += " ORDER BY timestamp, id LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [(doc_id, json.loads(document)) for doc_id, document in rows]
+
+    def count(self, filters):
+        sql = "SELECT COUNT(*) FROM documents WHERE collection = ?"
+        params = [self.collection]
+        for path, op, value in filters:
+            if op == '==':
+                sql += " AND json_extract(document, ?) = ?"
+            elif op == 'array_contains':
+                sql += " AND EXISTS (SELECT 1 FROM json_each(document, ?) WHERE value = ?)"
+            else:
+                raise ValueError(f"Unsupported filter operator: {op}")
+            params += ['$.' + path, value]
+        with self._lock:
+            return self._conn.execute(sql, params).fetchone()[0]
+
+    def apply_batch(self, writes):
+        with self._lock:
+            # Take the write lock first, so commits from other processes get later stamps
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for op, doc_id, payload in _stamped(writes, self._ingest_stamp()):
+                    collection, name = split_path(doc_id, self.collection)
+                    if op != 'set':
+                        payload = apply_write(self._read(collection, name), op, payload)
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO documents (collection, id, timestamp, document)"
+                        " VALUES (?, ?, ?, ?)",
+                        (collection, name, _position(payload), dump_document(payload)),
+                    )
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class JsonlBackend(StorageBackend):
+    """Appends responses to a JSON Lines file, one write per line
+
+    Merges and increments are appended as {"_id": ..., "_op": ..., ...fields} lines and are
+    folded into the document by whoever reads the file back. Writes outside the
+    backend's collection carry a "_collection" key.
+    """
+
+    name = "jsonl"
+
+    def __init__(self, path, collection=DEFAULT_COLLECTION, fsync=False):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.collection = collection
+        # Lines without "_collection" belong to this one, also for with_collection() views
+        self._file_collection = collection
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', encoding='utf-8')
+        # (collection, id) of every document in the file, loaded on the first 'create'
+        self._existing = None
+
+    def apply_batch(self, writes):
+        with self._lock:
+            lines = []
+            keys = []
+            for op, doc_id, payload in _stamped(writes, self._ingest_stamp()):
+                collection, name = split_path(doc_id, self.collection)
+                keys.append((op, (collection, name)))
+                header = {'_id': name}
+                if collection != self._file_collection:
+                    header['_collection'] = collection
+                if op not in ('set', 'create'):
+                    header['_op'] = op
+                lines.append(dump_document({**header, **payload}) + '\n')
+            lines = ''.join(lines)
+            if self._existing is None and any(op == 'create' for op, _ in keys):
+                self._file.flush()
+                with open(self.path, encoding='utf-8') as f:
+                    self._existing = {self._record_key(json.loads(line)) for line in f}
+            if self._existing is not None:
+                created = [key for op, key in keys if op == 'create']
+                if any(key in self._existing for key in created) or len(set(created)) < len(created):
+                    raise AlreadyExists("Document already exists")
+                self._existing.update(key for _, key in keys)
+            self._file.write(lines)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+
+    def _record_key(self, record):
+        return record.get('_collection', self._file_collection), record['_id']
+
+    def iter_records(self):
+        """Yield every (collection, id, op, payload) line written so far"""
+        with self._lock:
+            self._file.flush()
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                record = json.loads(line)
+                name = record.pop('_id')
+                collection = record.pop('_collection', self._file_collection)
+                op = record.pop('_op', 'set')
+                yield collection, name, op, record
+
+    def fold_documents(self, collection=None):
+        """Replay the file into {id: document} for one collection"""
+        collection = collection or self.collection
+        documents = {}
+        for record_collection, record_id, op, payload in self.iter_records():
+            if record_collection != collection:
+                continue
+            documents[record_id] = apply_write(documents.get(record_id), op, payload)
+        return documents
+
+    def get(self, doc_id):
+        collection, name = split_path(doc_id, self.collection)
+        return self.fold_documents(collection).get(name)
+
+    def scan(self, after=None, limit=500):
+        # Local rehearsal backend: replays the whole file per page
+        return _scan_documents(self.fold_documents().items(), after, limit)
+
+    def count(self, filters):
+        return sum(1 for document in self.fold_documents().values() if matches(document, filters))
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class MemoryBackend(StorageBackend):
+    """Keeps responses in process memory; a stub for load tests and benchmarks"""
+
+    name = "memory"
+
+    def __init__(self, collection=DEFAULT_COLLECTION, latency=0.0):
+        self.collection = collection
+        self.latency = latency
+        self._lock = threading.Lock()
+        self.documents = {}
+
+    def apply_batch(self, writes):
+        if self.latency:
+            # Stand in for one network round-trip per commit
+            time.sleep(self.latency)
+        with self._lock:
+            # Apply to a copy of the touched documents so a failed create leaves nothing behind
+            pending = {}
+            for op, doc_id, payload in _stamped(writes, self._ingest_stamp()):
+                key = split_path(doc_id, self.collection)
+                current = pending[key] if key in pending else self.documents.get(key)
+                pending[key] = apply_write(current, op, payload)
+            self.documents.update(pending)
+
+    def get(self, doc_id):
+        with self._lock:
+            return self.documents.get(split_path(doc_id, self.collection))
+
+    def scan(self, after=None, limit=500):
+        with self._lock:
+            items = [(name, document) for (collection, name), document in self.documents.items()
+                     if collection == self.collection]
+        return _scan_documents(items, after, limit)
+
+    def count(self, filters):
+        with self._lock:
+            return sum(1 for (collection, _), document in self.documents.items()
+                       if collection == self.collection and matches(document, filters))
+
+
+class InstrumentedBackend:
+    """Wraps a backend so every public method call is timed as a storage.<method> span"""
+
+    def __init__(self, backend):
+        self._backend = backend
+
+    def __getattr__(self, attr):
+        value = getattr(self._backend, attr)
+        if attr.startswith('_') or not callable(value):
+            return value
+
+        def call(*args, **kwargs):
+            with metrics.span(f"storage.{attr}"):
+                return value(*args, **kwargs)
+        return call
+
+    def with_collection(self, collection):
+        return InstrumentedBackend(self._backend.with_collection(collection))
+
+
+def firestore_client(service_account_info):
+    """Initialize Firebase once per process and return a Firestore client"""
+    # Imported here so grpc/protobuf/google-cloud only load when Firestore is used
+    import firebase_admin
+    from firebase_admin import credentials, firestore
+
+    if not firebase_admin._apps:
+        firebase_admin.initialize_app(credentials.Certificate(service_account_info))
+
+    return firestore.client()
+
+
+def add_backend_arguments(parser):
+    """Storage options shared by the command-line tools"""
+    parser.add_argument('--backend', default=os.environ.get('SURVEY_STORAGE_BACKEND', 'firestore'),
+                        choices=('firestore', 'sqlite', 'jsonl'), help="storage backend to read/write")
+    parser.add_argument('--path', default=os.environ.get('SURVEY_STORAGE_PATH'),
+                        help="database or file path for the sqlite and jsonl backends")
+    parser.add_argument('--collection', default=os.environ.get('SURVEY_STORAGE_COLLECTION', DEFAULT_COLLECTION))
+    parser.add_argument('--credentials', default='.streamlit/secrets.toml',
+                        help="service account JSON file, or a secrets.toml with a [firebase] section")
+
+
+def backend_from_args(args):
+    """Build the backend selected by add_backend_arguments() options"""
+    config = {'backend': args.backend, 'collection': args.collection}
+    if args.path:
+        config['path'] = args.path
+
+    def load_client():
+        if args.credentials.endswith('.toml'):
+            import tomllib
+            with open(args.credentials, 'rb') as f:
+                info = tomllib.load(f)['firebase']
+        else:
+            with open(args.credentials, encoding='utf-8') as f:
+                info = json.load(f)
+        return firestore_client(info)
+
+    return create_backend(config, load_client)
+
+
+def create_backend(config, firestore_client_factory=None):
+    """Build the backend named by config['backend'] (firestore, sqlite, jsonl or memory)"""
+    kind = config.get('backend', 'firestore')
+    collection = config.get('collection', DEFAULT_COLLECTION)
+    if kind == 'firestore':
+        if firestore_client_factory is None:
+            raise ValueError("The firestore backend needs a client factory")
+        return FirestoreBackend(firestore_client_factory(), collection)
+    if kind == 'sqlite':
+        return SQLiteBackend(config.get('path', 'local_data/survey_responses.sqlite3'), collection)
+    if kind == 'jsonl':
+        return JsonlBackend(config.get('path', 'local_data/survey_responses.jsonl'), collection,
+                            fsync=bool(config.get('fsync', False)))
+    if kind == 'memory':
+        return MemoryBackend(collection, latency=float(config.get('latency', 0.0)))
+    raise ValueError(f"Unknown storage backend: {kind}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_backend_arguments(parser)
+    parser.add_argument('--backfill-ingested', action='store_true',
+                        help="set ingested_at from the timestamp where it is missing, so scans "
+                             "(exports, search, dedup) read documents stored before it existed")
+    args = parser.parse_args(argv)
+
+    backend = backend_from_args(args)
+    if args.backfill_ingested:
+        print(f"Backfilled ingested_at on {backend.backfill_ingested()} documents")
+    backend.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,212 @@
+"""Study definitions: several surveys served by one process.
+
+    python studies.py                      # validate content/studies.json and list the studies
+
+content/studies.json lists the studies and names the one shown without a
+?study= query parameter:
+
+    {
+        "default": "prompts",
+        "studies": [
+            {
+                "id": "prompts",
+                "content": "content/survey_content.json",   # question bank and messages (content.py)
+                "questions": 10,                            # questions per session, pinned ones included
+                "pinned_first": [0],                        # bank indices always shown first ...
+                "pinned_last": [-1],                        # ... and last (negative: from the end)
+                "languages": ["ar", "en"],                  # offered in this order; the first is the default
+                "collection": null                          # null: the storage backend's own collection
+            }
+        ]
+    }
+
+Every field but "id" is optional: the content file defaults to
+SURVEY_CONTENT_PATH, the session shape to the ten questions the app has
+always asked and the languages to the content's own, in its order. Without
+the file the app runs that single survey in Arabic and English. Studies share
+the process: one storage client, one background writer and one render
+cache. Only content, scheduling, counters and the response collection are
+per study.
+"""
+import argparse
+import json
+import os
+import sys
+
+from jsonschema import Draft202012Validator
+
+import content
+from storage import DEFAULT_COLLECTION
+
+STUDIES_PATH = os.environ.get('SURVEY_STUDIES_PATH', 'content/studies.json')
+DEFAULT_STUDY = 'prompts'
+# The app has always opened in Arabic
+DEFAULT_LANGUAGES = ('ar', 'en')
+
+STUDIES_SCHEMA = {
+    '$schema': 'https://json-schema.org/draft/2020-12/schema',
+    'type': 'object',
+    'required': ['studies'],
+    'additionalProperties': False,
+    'properties': {
+        'default': {'type': 'string'},
+        'studies': {
+            'type': 'array',
+            'minItems': 1,
+            'items': {
+                'type': 'object',
+                'required': ['id'],
+                'additionalProperties': False,
+                'properties': {
+                    'id': {'type': 'string', 'pattern': '^[a-z0-9_-]{1,40}$'},
+                    'content': {'type': 'string'},
+                    'questions': {'type': 'integer', 'minimum': 1},
+                    'pinned_first': {'type': 'array', 'items': {'type': 'integer'}},
+                    'pinned_last': {'type': 'array', 'items': {'type': 'integer'}},
+                    'languages': {'type': 'array', 'minItems': 1, 'items': {'type': 'string'}},
+                    'collection': {'type': ['string', 'null'], 'pattern': '^[A-Za-z0-9_-]+$'},
+                },
+            },
+        },
+    },
+}
+Draft202012Validator.check_schema(STUDIES_SCHEMA)
+VALIDATOR = Draft202012Validator(STUDIES_SCHEMA)
+
+
+class Study:
+    """One survey: its content file, session shape and response collection"""
+
+    def __init__(self, study_id, content_path=content.CONTENT_PATH, questions=10,
+                 pinned_first=(0,), pinned_last=(-1,), languages=None, collection=None):
+        self.id = study_id
+        self.content_path = content_path
+        self.questions = questions
+        self.pinned_first = tuple(pinned_first)
+        self.pinned_last = tuple(pinned_last)
+        self._languages = tuple(languages) if languages else None
+        self.collection = collection
+
+    @property
+    def content(self):
+        """The revision new sessions of this study start with"""
+        return content.current(self.content_path)
+
+    @property
+    def languages(self):
+        return self._languages or self.content.languages
+
+    def pinned(self):
+        """(first, last) lists of pinned bank indices"""
+        size = len(self.content.questions)
+        return [index % size for index in self.pinned_first], [index % size for index in self.pinned_last]
+
+    def candidates(self):
+        """Bank indices the scheduler picks the rest of a session from"""
+        first, last = self.pinned()
+        return [index for index in range(len(self.content.questions)) if index not in {*first, *last}]
+
+    @property
+    def picks(self):
+        """How many questions a session gets besides the pinned ones"""
+        return self.questions - len(self.pinned_first) - len(self.pinned_last)
+
+    def doc_id(self, name):
+        """Storage id of a response document: bare ids land in the backend's own collection"""
+        return f"{self.collection}/{name}" if self.collection else name
+
+    def check(self):
+        """Raise ValueError if the definition does not fit its content"""
+        snapshot = self.content
+        size = len(snapshot.questions)
+        pinned = self.pinned_first + self.pinned_last
+        if any(not -size <= index < size for index in pinned):
+            raise ValueError(f"Study {self.id}: pinned questions must be within the {size}-question bank")
+        first, last = self.pinned()
+        if len({*first, *last}) != len(pinned):
+            raise ValueError(f"Study {self.id}: a question is pinned twice")
+        if not 0 <= self.picks <= len(self.candidates()):
+            raise ValueError(f"Study {self.id}: {self.questions} questions per session do not fit "
+                             f"{len(pinned)} pinned and {len(self.candidates())} other questions")
+        unknown = set(self.languages) - set(snapshot.languages)
+        if unknown:
+            raise ValueError(f"Study {self.id}: {', '.join(sorted(unknown))} not in {self.content_path}")
+
+
+class Studies:
+    """Every study by id, and the default one
+
+    collection is the storage backend's own collection, where studies
+    without one store their responses.
+    """
+
+    def __init__(self, studies, default=None, collection=DEFAULT_COLLECTION):
+        self._studies = {study.id: study for study in studies}
+        if len(self._studies) != len(studies):
+            raise ValueError("Study ids must be unique")
+        collections = [study.collection or collection for study in studies]
+        if len(set(collections)) != len(collections):
+            # Counters and dashboards are per collection
+            shared = sorted({name for name in collections if collections.count(name) > 1})
+            raise ValueError(f"Each study needs its own collection; {', '.join(shared)} is shared "
+                             f"(studies without one use the backend's {collection})")
+        self.default = default or studies[0].id
+        if self.default not in self._studies:
+            raise ValueError(f"The default study {self.default} is not defined")
+
+    def get(self, study_id=None):
+        """A study by id, the default one for None; KeyError for unknown ids"""
+        return self._studies[study_id or self.default]
+
+    def __iter__(self):
+        return iter(self._studies.values())
+
+    def __len__(self):
+        return len(self._studies)
+
+
+def load(path=STUDIES_PATH, collection=DEFAULT_COLLECTION):
+    """Studies from a definitions file; the single default survey when the file does not exist
+
+    collection is the storage backend's own one (see Studies).
+    """
+    if not os.path.exists(path):
+        return Studies([Study(DEFAULT_STUDY, languages=DEFAULT_LANGUAGES)], collection=collection)
+    with open(path, encoding='utf-8') as f:
+        source = json.load(f)
+    error = next(VALIDATOR.iter_errors(source), None)
+    if error is not None:
+        location = '/'.join(map(str, error.absolute_path)) or 'top level'
+        raise ValueError(f"{path}: {location}: {error.message}")
+    loaded = [Study(entry['id'],
+                    content_path=entry.get('content', content.CONTENT_PATH),
+                    questions=entry.get('questions', 10),
+                    pinned_first=entry.get('pinned_first', (0,)),
+                    pinned_last=entry.get('pinned_last', (-1,)),
+                    languages=entry.get('languages'),
+                    collection=entry.get('collection'))
+              for entry in source['studies']]
+    for study in loaded:
+        study.check()
+    return Studies(loaded, source.get('default'), collection)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--path', default=STUDIES_PATH)
+    parser.add_argument('--collection', default=os.environ.get('SURVEY_STORAGE_COLLECTION', DEFAULT_COLLECTION),
+                        help="the storage backend's own collection")
+    args = parser.parse_args(argv)
+
+    defined = load(args.path, args.collection)
+    for study in defined:
+        first, last = study.pinned()
+        marker = '*' if study.id == defined.default else ' '
+        print(f"{marker} {study.id:<16} {study.questions:3d} questions (pinned {first} ... {last}) "
+              f"of {len(study.content.questions)} in {study.content_path}, "
+              f"languages {', '.join(study.languages)}, collection {study.collection or '(default)'}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,361 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from collections import Counter, defaultdict
+
+from tenacity import Retrying, retry_if_exception, stop_after_attempt, wait_exponential_jitter
+
+from storage import AlreadyExists, is_transient, merge_fields
+
+logger = logging.getLogger(__name__)
+
+# Largest group handed to the backend at once (the Firestore WriteBatch limit)
+MAX_BATCH_WRITES = 500
+
+# One document per submission token, created in the same commit as the submission
+TOKEN_COLLECTION = "submission_tokens"
+
+_STOP = object()
+
+
+class CircuitOpen(Exception):
+    """Storage has failed repeatedly and is not being called for a while"""
+
+
+class CircuitBreaker:
+    """Stops calling a failing backend for `reset_timeout` seconds after `threshold` failures in a row
+
+    Once the timeout passes the circuit is half-open: the next call goes
+    through, and its outcome closes the circuit again or reopens it.
+    """
+
+    def __init__(self, threshold=5, reset_timeout=30.0):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return 'half_open'
+            return 'open'
+
+    def retry_in(self):
+        """Seconds until calls are allowed again (0 when they are allowed now)"""
+        with self._lock:
+            if self._opened_at is None:
+                return 0.0
+            return max(0.0, self._opened_at + self.reset_timeout - time.monotonic())
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.threshold:
+                if self._opened_at is None:
+                    logger.warning("Storage circuit opened after %d failed commits", self._failures)
+                # A failed half-open probe restarts the wait
+                self._opened_at = time.monotonic()
+
+
+class SubmissionWriter:
+    """Process-wide write-behind queue that flushes submissions to a storage backend in batches
+
+    Writes may carry counter increments. The increments of a whole flush are
+    summed into one write to a random shard of `counters`, committed in the
+    same batch as the responses, so the counters stay exact. Documents of a
+    collection registered with add_counters() count towards that collection's
+    counters instead, so studies sharing the writer keep separate totals.
+
+    A write given a submission token also creates submission_tokens/<token> in
+    its commit. Retrying a commit whose outcome was unknown (a timeout after
+    Firestore applied it) then fails with AlreadyExists instead of applying
+    the write and its counter increments twice; the batch is replayed one
+    submission at a time and the ones already stored are skipped.
+
+    Transient failures are retried with exponential backoff. Repeated failures
+    open a circuit breaker: the queue keeps its items and waits for storage to
+    recover instead of dropping them, and write_now() fails fast.
+    """
+
+    def __init__(self, backend, counters=None, max_queue=10000, linger=0.05, max_attempts=3,
+                 breaker=None, close_timeout=10):
+        self.backend = backend
+        self.counters = counters
+        self._collection_counters = {}
+        # Leave room in every commit for the counter shard write
+        self.max_batch = MAX_BATCH_WRITES - (1 if counters else 0)
+        self.linger = linger
+        self.max_attempts = max_attempts
+        self.breaker = breaker or CircuitBreaker()
+        self.close_timeout = close_timeout
+        self._closing_at = None
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._stats = {
+            'enqueued': 0,
+            'rejected': 0,
+            'coalesced': 0,
+            'written': 0,
+            'duplicates': 0,
+            'retries': 0,
+            'failed': 0,
+            'batches': 0,
+            'last_flush_seconds': 0.0,
+            'max_flush_seconds': 0.0,
+            'total_flush_seconds': 0.0,
+        }
+        self._thread = threading.Thread(target=self._run, name="submission-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def add_counters(self, collection, counters):
+        """Count writes to collection/<id> documents in their own counters"""
+        with self._lock:
+            self._collection_counters[collection] = counters
+            # One shard write per counter a flush may touch
+            self.max_batch = MAX_BATCH_WRITES - (1 if self.counters else 0) - len(self._collection_counters)
+
+    def submit(self, doc_id, document, counts=None, token=None):
+        """Queue a document for writing; returns False when the queue is full"""
+        return self._enqueue('set', doc_id, document, counts, token)
+
+    def merge(self, doc_id, fields, counts=None, token=None):
+        """Queue a field merge into a document; returns False when the queue is full"""
+        return self._enqueue('merge', doc_id, fields, counts, token)
+
+    def write_now(self, op, doc_id, payload, counts=None, token=None):
+        """Write synchronously on the caller's thread, with counters in the same commit
+
+        Raises CircuitOpen while storage is failing; a token that was already
+        used counts as success.
+        """
+        if self.breaker.state == 'open':
+            raise CircuitOpen("Storage is temporarily unavailable")
+        try:
+            self._commit(self._item_writes(op, doc_id, payload, counts, token), wait=False)
+        except AlreadyExists:
+            with self._lock:
+                self._stats['duplicates'] += 1
+
+    def write_batch(self, items):
+        """Commit (op, doc_id, payload, counts, token) items on the caller's thread
+
+        For bulk loads that checkpoint their own progress: several threads may
+        call this at once, each commit is coalesced and retried like a queued
+        flush, and it returns only once the items are stored. Returns how many
+        were written; items whose token was already used are skipped.
+        """
+        items = list(items)
+        for item in items:
+            if item[3] and self._counter_for(item[1]) is not None and item[4] is None:
+                raise ValueError("Writes with counts need a submission token")
+        # Each item also creates its token document
+        per_commit = max(1, self.max_batch // 2)
+        written = 0
+        for start in range(0, len(items), per_commit):
+            written += self._flush(items[start:start + per_commit])
+        return written
+
+    def _token_write(self, token):
+        return ('create', f"{TOKEN_COLLECTION}/{token}", {'created_at': time.time()})
+
+    def _item_writes(self, op, doc_id, payload, counts, token):
+        writes = [(op, doc_id, payload)]
+        if token is not None:
+            writes.append(self._token_write(token))
+        return self._with_counts(writes, {self._counter_for(doc_id): counts})
+
+    def _counter_for(self, doc_id):
+        """The counters a document's increments go to (None when counting is off)"""
+        collection, _, name = doc_id.partition('/')
+        if name and collection in self._collection_counters:
+            return self._collection_counters[collection]
+        return self.counters
+
+    def _with_counts(self, writes, counts):
+        """Writes plus one shard increment per {counters: counts} entry"""
+        increments = [counter.increment_write(amounts) for counter, amounts in counts.items()
+                      if counter is not None and amounts]
+        return writes + increments if increments else writes
+
+    def _enqueue(self, op, doc_id, payload, counts, token):
+        if counts and self._counter_for(doc_id) is not None and token is None:
+            # Without a token a retried commit could add these counts twice
+            raise ValueError("Writes with counts need a submission token")
+        try:
+            self._queue.put_nowait((op, doc_id, payload, counts, token))
+        except queue.Full:
+            with self._lock:
+                self._stats['rejected'] += 1
+            return False
+        with self._lock:
+            self._stats['enqueued'] += 1
+        return True
+
+    def queue_depth(self):
+        """Number of submissions waiting to be flushed"""
+        return self._queue.qsize()
+
+    def stats(self):
+        """Snapshot of the queue depth, flush counters and circuit state"""
+        with self._lock:
+            snapshot = dict(self._stats)
+        snapshot['queue_depth'] = self.queue_depth()
+        snapshot['circuit_open'] = int(self.breaker.state == 'open')
+        return snapshot
+
+    def close(self, timeout=None):
+        """Flush everything still queued and stop the background thread"""
+        if not self._thread.is_alive():
+            return
+        timeout = self.close_timeout if timeout is None else timeout
+        self._closing_at = time.monotonic() + timeout
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            stop = self._fill_batch(batch)
+            self._flush(batch)
+            if stop:
+                return
+
+    def _fill_batch(self, batch):
+        """Pull more queued items into the batch, waiting at most `linger` seconds"""
+        deadline = time.monotonic() + self.linger
+        # Each token adds a write to the commit
+        writes = sum(2 if item[4] is not None else 1 for item in batch)
+        while writes < self.max_batch - 1:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout > 0:
+                    item = self._queue.get(timeout=timeout)
+                else:
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                return False
+            if item is _STOP:
+                return True
+            batch.append(item)
+            writes += 2 if item[4] is not None else 1
+        return False
+
+    def _coalesce(self, batch):
+        """Fold writes to the same document into one, keeping first-seen order"""
+        writes = {}
+        tokens = []
+        counts = defaultdict(Counter)
+        for op, doc_id, payload, item_counts, token in batch:
+            previous = writes.get(doc_id)
+            if previous is None or op == 'set':
+                writes[doc_id] = (op, doc_id, payload)
+            else:
+                # set + merge stays a set; merge + merge stays a merge
+                writes[doc_id] = (previous[0], doc_id, merge_fields(previous[2], payload))
+            if token is not None:
+                tokens.append(self._token_write(token))
+            if item_counts:
+                counts[self._counter_for(doc_id)].update(item_counts)
+        with self._lock:
+            self._stats['coalesced'] += len(batch) - len(writes)
+        return self._with_counts(list(writes.values()) + tokens, counts)
+
+    def _commit(self, writes, wait=True):
+        """Apply one commit, retrying transient failures with exponential backoff
+
+        With wait=True (the background thread) a failing backend is retried
+        until it recovers, pausing while the circuit is open, so queued
+        submissions are never dropped for being unlucky; only while closing
+        does it give up. Errors that a retry cannot fix are raised at once.
+        """
+        while True:
+            if wait:
+                pause = self.breaker.retry_in()
+                if pause and self._closing():
+                    raise CircuitOpen("Storage is still unavailable at shutdown")
+                time.sleep(pause)
+            try:
+                for attempt in Retrying(
+                    stop=stop_after_attempt(self.max_attempts),
+                    wait=wait_exponential_jitter(initial=0.5, max=8),
+                    retry=retry_if_exception(is_transient),
+                    before_sleep=self._count_retry,
+                    reraise=True,
+                ):
+                    with attempt:
+                        self.backend.apply_batch(writes)
+            except Exception as error:
+                if isinstance(error, AlreadyExists) or not is_transient(error):
+                    # Storage answered, so it is up
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                if not wait or self._closing():
+                    raise
+                logger.warning("Commit of %d writes failed; retrying once storage recovers",
+                               len(writes))
+                continue
+            self.breaker.record_success()
+            return
+
+    def _closing(self):
+        return self._closing_at is not None and time.monotonic() >= self._closing_at
+
+    def _count_retry(self, retry_state):
+        with self._lock:
+            self._stats['retries'] += 1
+
+    def _replay(self, batch):
+        """Commit a batch one submission at a time; returns how many were written"""
+        written = 0
+        for op, doc_id, payload, counts, token in batch:
+            try:
+                self._commit(self._item_writes(op, doc_id, payload, counts, token))
+                written += 1
+            except AlreadyExists:
+                # Stored by an earlier attempt whose response was lost, or submitted twice
+                with self._lock:
+                    self._stats['duplicates'] += 1
+            except Exception:
+                logger.exception("Dropping write to %s", doc_id)
+                with self._lock:
+                    self._stats['failed'] += 1
+        return written
+
+    def _flush(self, batch):
+        started = time.monotonic()
+        try:
+            self._commit(self._coalesce(batch))
+            written = len(batch)
+        except AlreadyExists:
+            written = self._replay(batch)
+        except Exception:
+            # A write that can never succeed (or storage still down while closing):
+            # isolate it so the rest of the batch is stored
+            logger.exception("Commit of %d submissions failed; writing them one by one", len(batch))
+            written = self._replay(batch)
+
+        elapsed = time.monotonic() - started
+        with self._lock:
+            self._stats['written'] += written
+            self._stats['batches'] += 1
+            self._stats['last_flush_seconds'] = elapsed
+            self._stats['max_flush_seconds'] = max(self._stats['max_flush_seconds'], elapsed)
+            self._stats['total_flush_seconds'] += elapsed
+        return written
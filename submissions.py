@@ -0,0 +1,141 @@
+"""Saving finished survey responses, without Streamlit.
+
+Shared by the Streamlit app and the JSON ingest server (ingest_server.py).
+A payload has the shape show_final_step has always built, plus the
+respondent's language, a random submission token and, for studies other
+than the default one (see studies.py), the study:
+
+    {
+        "token": "3f0c...",                      # uuid4 hex, names the document
+        "study": "prompts",                      # optional: the default study
+        "language": "ar",
+        "demographics": {"age": "18_24", "education": null, "experience": "daily"},
+        "questions_and_responses": [{"question_en": "...", "question_ar": "...", "response": "..."}],
+        "final_questions": {"suggestions": "..."}
+    }
+
+Questions, languages and the number of questions are checked against that
+study's content and session shape.
+"""
+import functools
+import re
+
+import scan
+import schema
+import studies
+from aggregates import summarize
+from counters import ShardedCounter
+from survey_content import DEMOGRAPHIC_CODES
+
+MAX_RESPONSE_CHARS = 5000
+
+_TOKEN = re.compile(r'^[0-9a-f]{32}$')
+
+
+class InvalidSubmission(ValueError):
+    """A payload that cannot be stored as a response"""
+
+
+def submit_document(writer, document, token, aggregates=None, doc_id=None):
+    """Queue a response document once per token, with its counter increments; write directly if the queue is full
+
+    The document is named after the token unless doc_id says otherwise
+    (a 'collection/id' path for studies with their own collection).
+    """
+    if 'flags' not in document:
+        scan.tag_document(document)
+    counts = summarize(document)
+    doc_id = doc_id or token
+    if not writer.submit(doc_id, document, counts, token=token):
+        writer.write_now('set', doc_id, document, counts, token=token)
+    if aggregates is not None:
+        aggregates.add(counts)
+    return counts
+
+
+def register_studies(writer, defined, counter_shards=10):
+    """Prepare a writer for every study: own counters for own collections, and each question bank snapshot"""
+    for study in defined:
+        if study.collection and counter_shards:
+            writer.add_counters(study.collection, ShardedCounter(writer.backend, study.collection, counter_shards))
+    # Responses store question indices into these snapshots, written once per bank revision
+    snapshots = {study.content.bank_version: study.content for study in defined}
+    for bank_version, snapshot in snapshots.items():
+        writer.submit(schema.snapshot_path(bank_version), schema.snapshot_document(snapshot))
+
+
+@functools.cache
+def _defined_studies():
+    return studies.load()
+
+
+def find_study(payload, defined=None):
+    """The study a payload names (the default one without "study"); raises InvalidSubmission"""
+    study_id = payload.get('study')
+    try:
+        return (defined or _defined_studies()).get(study_id)
+    except KeyError:
+        raise InvalidSubmission(f"Unknown study: {study_id!r}") from None
+
+
+def _text(value, field):
+    if value is None:
+        return ''
+    if not isinstance(value, str):
+        raise InvalidSubmission(f"{field} must be a string")
+    if len(value) > MAX_RESPONSE_CHARS:
+        raise InvalidSubmission(f"{field} is longer than {MAX_RESPONSE_CHARS} characters")
+    return value
+
+
+def validate_payload(payload, defined=None):
+    """Check a submitted payload and return (token, language, data, study) normalised; raises InvalidSubmission
+
+    `defined` are the studies to look the payload's up in (studies.load() for None).
+    """
+    if not isinstance(payload, dict):
+        raise InvalidSubmission("Payload must be a JSON object")
+    study = find_study(payload, defined)
+    token = str(payload.get('token', '')).replace('-', '').lower()
+    if not _TOKEN.match(token):
+        raise InvalidSubmission("token must be a uuid4")
+    language = payload.get('language')
+    if language not in study.languages:
+        raise InvalidSubmission(f"Unknown language: {language!r}")
+
+    items = payload.get('questions_and_responses')
+    if not isinstance(items, list) or not 0 < len(items) <= study.questions:
+        raise InvalidSubmission(f"questions_and_responses must list 1 to {study.questions} questions")
+    snapshot = study.content
+    questions = []
+    for position, item in enumerate(items):
+        if not isinstance(item, dict) or schema.question_index(item.get('question_en'), snapshot) is None:
+            # Usually a static bundle built from an older question bank
+            raise InvalidSubmission(f"Question {position} is not in the current question bank")
+        questions.append({
+            'question_en': item['question_en'],
+            'question_ar': item.get('question_ar'),
+            'response': _text(item.get('response'), f"Response {position}"),
+        })
+
+    demographics = {}
+    for field, codes in DEMOGRAPHIC_CODES.items():
+        code = schema.demographic_code(field, (payload.get('demographics') or {}).get(field))
+        if code is not None and code not in codes:
+            raise InvalidSubmission(f"Unknown {field}: {code!r}")
+        demographics[field] = code
+
+    final_questions = payload.get('final_questions') or {}
+    return token, language, {
+        'demographics': demographics,
+        'questions_and_responses': questions,
+        'final_questions': {'suggestions': _text(final_questions.get('suggestions'), "suggestions")},
+    }, study
+
+
+def save_payload(writer, payload, aggregates=None, defined=None):
+    """Validate, encode and queue a submitted payload; returns the response id"""
+    token, language, data, study = validate_payload(payload, defined)
+    document = schema.encode_submission(token, language, data, snapshot=study.content)
+    submit_document(writer, document, token, aggregates, doc_id=study.doc_id(token))
+    return token
@@ -0,0 +1,31 @@
+"""Survey content shared by the app, the dashboard and the command-line tools
+
+QUESTION_BANK and TRANSLATIONS come from content/survey_content.json (see
+content.py) as it was when this process started; sessions read the revision
+they started with through content.snapshot(). Demographic codes are part of
+the stored schema, so they stay in code; their labels are messages.
+"""
+import content
+
+_startup = content.current()
+
+# Question Bank in English and Arabic
+QUESTION_BANK = _startup.questions
+
+TRANSLATIONS = _startup.translations
+
+# Demographic answer codes are part of the stored schema; their labels are content
+DEMOGRAPHIC_CODES = {
+    'age': ('prefer_not_to_say', 'under_18', '18_24', '25_34', '35_44', '45_54', '55_plus'),
+    'education': ('prefer_not_to_say', 'high_school', 'bachelors_student', 'bachelors', 'masters', 'phd'),
+    'experience': ('never', 'rarely', 'sometimes', 'often', 'daily'),
+}
+
+# {field: {code: {language: label}}}, labelled from the 'option.<field>.<code>' messages
+DEMOGRAPHIC_OPTIONS = {
+    field: {
+        code: {language: TRANSLATIONS[language][f'option.{field}.{code}'] for language in TRANSLATIONS}
+        for code in codes
+    }
+    for field, codes in DEMOGRAPHIC_CODES.items()
+}
@@ -0,0 +1,186 @@
+"""Compact per-session survey state.
+
+Sessions used to keep a list of question dicts, ten {'text': ...} dicts, a
+parallel list of saved texts, a demographics dict and a final_questions dict
+in st.session_state. SurveySession keeps the QUESTION_BANK indices in an
+array and everything else in slots; question text is looked up in the shared,
+memory-mapped content revision the session started with (see content.py).
+
+    python survey_session.py --sessions 5000   # tracemalloc bytes per session
+"""
+import argparse
+import random
+import sys
+import tracemalloc
+from array import array
+
+import content
+from survey_content import QUESTION_BANK
+
+DEMOGRAPHIC_FIELDS = ('age', 'education', 'experience')
+
+# The old sessions referenced the dicts of a module-level literal bank
+_LEGACY_BANK = list(QUESTION_BANK)
+
+
+class SurveySession:
+    """One respondent's questions and answers"""
+
+    __slots__ = ('content_version', 'question_ids', 'texts', 'saved',
+                 'age', 'education', 'experience', 'suggestions')
+
+    def __init__(self, question_ids, content_version=None):
+        # Pinned so a content reload never changes text under this respondent
+        self.content_version = content_version or content.current().version
+        self.question_ids = array('H', question_ids)
+        self.texts = [''] * len(self.question_ids)
+        # Answer text as last written to the draft document
+        self.saved = [''] * len(self.question_ids)
+        self.age = self.education = self.experience = None
+        self.suggestions = ''
+
+    def __len__(self):
+        return len(self.question_ids)
+
+    @property
+    def content(self):
+        return content.snapshot(self.content_version)
+
+    @property
+    def bank_version(self):
+        return self.content.bank_version
+
+    def question(self, position):
+        """The question bank entry ({'en', 'ar'}) shown at a position"""
+        return self.content.questions[self.question_ids[position]]
+
+    @property
+    def demographics(self):
+        return {field: getattr(self, field) for field in DEMOGRAPHIC_FIELDS}
+
+    def set_demographics(self, age, education, experience):
+        self.age, self.education, self.experience = age, education, experience
+
+    @property
+    def final_questions(self):
+        return {'suggestions': self.suggestions}
+
+    def unsaved(self):
+        """{position: text} for answers that changed since they were last saved"""
+        return {str(i): text for i, (text, saved) in enumerate(zip(self.texts, self.saved)) if text != saved}
+
+    def mark_saved(self, position=None):
+        if position is None:
+            self.saved = list(self.texts)
+        else:
+            self.saved[position] = self.texts[position]
+
+    def to_state(self):
+        """Flat {field: JSON value} form for session_store.py; each answer is its own field"""
+        state = {
+            'content_version': self.content_version,
+            'bank_version': self.bank_version,
+            'question_ids': list(self.question_ids),
+            'suggestions': self.suggestions,
+            **self.demographics,
+        }
+        state.update((f'text.{position}', text) for position, text in enumerate(self.texts))
+        return state
+
+    @classmethod
+    def from_state(cls, state, fallback=None):
+        """Rebuild a session from to_state() output; None if its questions are not available here
+
+        `fallback` is the current revision of the session's study (default:
+        the main content file), used when the session's own revision is not.
+        Restored answers count as unsaved, so the final submit sends them all
+        to the draft again (a merge of the same values).
+        """
+        version = state.get('content_version')
+        try:
+            content.snapshot(version)
+        except KeyError:
+            # Started on a node with another content revision: the same bank means the same questions
+            fallback = fallback or content.current()
+            if fallback.bank_version != state.get('bank_version'):
+                return None
+            version = fallback.version
+        session = cls(state['question_ids'], version)
+        for position in range(len(session)):
+            session.texts[position] = state.get(f'text.{position}') or ''
+        session.set_demographics(*(state.get(field) for field in DEMOGRAPHIC_FIELDS))
+        session.suggestions = state.get('suggestions') or ''
+        return session
+
+
+def legacy_session(question_ids):
+    """The session_state entries SurveySession replaces, as the app used to build them"""
+    return {
+        'question_ids': list(question_ids),
+        'selected_questions': [_LEGACY_BANK[i] for i in question_ids],
+        'responses': [{'text': ''} for _ in question_ids],
+        'saved_responses': [''] * len(question_ids),
+        'demographics': {'age': None, 'education': None, 'experience': None},
+        'final_questions': {'suggestions': ''},
+    }
+
+
+def _answer(length):
+    return ''.join(random.choice('abcdefghij klmnopqrstuvwxyz') for _ in range(length))
+
+
+def _fill_legacy(session, length):
+    for position, response in enumerate(session['responses']):
+        response['text'] = _answer(length)
+        session['saved_responses'][position] = response['text']
+    session['demographics'] = {'age': '18_24', 'education': 'bachelors', 'experience': 'daily'}
+    session['final_questions'] = {'suggestions': _answer(length)}
+
+
+def _fill_compact(session, length):
+    for position in range(len(session)):
+        session.texts[position] = _answer(length)
+    session.mark_saved()
+    session.set_demographics('18_24', 'bachelors', 'daily')
+    session.suggestions = _answer(length)
+
+
+def measure(build, fill, sessions, answer_chars):
+    """Bytes allocated per session by `build`, after `fill` (if answer_chars) answers it"""
+    random.seed(0)
+    candidates = range(1, len(QUESTION_BANK) - 1)
+    question_sets = [[0] + random.sample(candidates, 8) + [len(QUESTION_BANK) - 1] for _ in range(sessions)]
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    kept = []
+    for question_ids in question_sets:
+        session = build(question_ids)
+        if answer_chars:
+            fill(session, answer_chars)
+        kept.append(session)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    # The list holding the sessions is measurement overhead, not session state
+    allocated -= sys.getsizeof(kept)
+    return allocated / sessions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure session state memory with tracemalloc")
+    parser.add_argument('--sessions', type=int, default=5000)
+    parser.add_argument('--answer-chars', type=int, default=200,
+                        help="length of each synthetic answer (0 for a freshly started session)")
+    args = parser.parse_args(argv)
+
+    print(f"{'state':<10}{'new session':>14}{'answered':>14}   bytes per session")
+    for name, build, fill in (('legacy', legacy_session, _fill_legacy),
+                              ('compact', SurveySession, _fill_compact)):
+        empty = measure(build, fill, args.sessions, 0)
+        answered = measure(build, fill, args.sessions, args.answer_chars)
+        print(f"{name:<10}{empty:>14,.0f}{answered:>14,.0f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
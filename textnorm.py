@@ -0,0 +1,61 @@
+"""Text normalization shared by the scanners and indexes over answers.
+
+Answers mix English and Arabic, and the same Arabic word is written many
+ways: with or without diacritics and tatweel, with any of four alefs, with
+ya or alef maqsura, with taa marbuta or ha, with Arabic-Indic digits.
+normalize() folds all of these so equal words compare equal.
+"""
+import re
+
+# Arabic-Indic and Persian digits to ASCII; one character each, so spans are unchanged
+ASCII_DIGITS = str.maketrans('٠١٢٣٤٥٦٧٨٩۰۱۲۳۴۵۶۷۸۹', '0123456789' * 2)
+
+# Diacritics, Quranic marks, superscript alef and tatweel
+_ARABIC_MARKS = [*range(0x0610, 0x061b), *range(0x064b, 0x0660), 0x0670, *range(0x06d6, 0x06ee), 0x0640]
+_FOLD = str.maketrans({
+    **dict.fromkeys(map(chr, _ARABIC_MARKS)),
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا', 'ى': 'ي', 'ة': 'ه',
+    **dict(zip('٠١٢٣٤٥٦٧٨٩۰۱۲۳۴۵۶۷۸۹', '0123456789' * 2)),
+})
+_SPACES = re.compile(r'\s+')
+_WORD = re.compile(r'\w+')
+
+# Clitics written onto the next word ("the", "and", "so", "with", "for the", "O ...")
+ARABIC_PREFIXES = frozenset(('ال', 'و', 'ف', 'ب', 'ل', 'وال', 'فال', 'بال', 'لل', 'يا'))
+
+
+def normalize(text):
+    """Casefold, strip Arabic diacritics, fold spelling variants and digits, collapse spaces"""
+    return _SPACES.sub(' ', text.casefold().translate(_FOLD))
+
+
+def words(text):
+    """The normalized words of a text, punctuation dropped"""
+    return _WORD.findall(normalize(text))
+
+
+# Definite-article prefixes, longest first; single-letter clitics are left on,
+# since too many words start with the same letters (بنك is not ب + نك)
+_DEFINITE = ('ولل', 'فلل', 'وال', 'فال', 'بال', 'كال', 'لل', 'ال')
+
+
+def strip_definite(word):
+    """An Arabic word without its definite article (البنك, والبنك, للبنك -> بنك)"""
+    for prefix in _DEFINITE:
+        if word.startswith(prefix) and len(word) - len(prefix) >= 2:
+            return word[len(prefix):]
+    return word
+
+
+def index_terms(text):
+    """Distinct search terms of a text: each word, and its article-free form"""
+    terms = set()
+    for word in words(text):
+        terms.add(word)
+        terms.add(strip_definite(word))
+    return terms
+
+
+def query_terms(text):
+    """The terms a search for text must match (all of them)"""
+    return list(dict.fromkeys(strip_definite(word) for word in words(text)))